@@ -29,6 +29,10 @@ SECRET_KEY = os.environ["SECRET_KEY"]
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Para apuntar la librería de Stripe a otro servidor (manage.py stripe_local).
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+# Pasarela con la que se abren los pagos (home.checkout): "stripe" o "falsa".
+PASARELA_PAGO = os.getenv("PASARELA_PAGO", "stripe")
 SITE_DOMAIN = os.getenv("SITE_DOMAIN")
 DEBUG_STATE= os.getenv("DEBUG_STATE")
 
@@ -58,6 +62,8 @@ CORS_ALLOWED_ORIGINS = [SITE_DOMAIN]
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Antes de sesiones, CSRF y mensajes para ver las cookies que añaden
+    'home.middleware.PaginaCompartidaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # <-- añadir aquí
     'django.middleware.common.CommonMiddleware',
@@ -110,6 +116,26 @@ DATABASES = {
     }
 }
 
+# Caché compartida: la versión del catálogo y los índices en memoria dependen de
+# ella para enterarse de los cambios hechos por otros procesos (en producción
+# debe ser Redis/Memcached, no LocMem).
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv("CACHE_LOCATION", 'entertainpet'),
+    }
+}
+
+# Minutos que quedan apartadas las unidades de un checkout sin pagar.
+RESERVA_STOCK_MINUTOS = int(os.getenv("RESERVA_STOCK_MINUTOS", "30"))
+
+# Envío de correos transaccionales (home.correos). "falso" no sale a Brevo:
+# simula la latencia y los fallos indicados para pruebas de carga sin red.
+CORREO_TRANSPORTE = os.getenv("CORREO_TRANSPORTE", "brevo")
+CORREO_CONCURRENCIA = int(os.getenv("CORREO_CONCURRENCIA", "4"))
+CORREO_FALSO_LATENCIA_MS = int(os.getenv("CORREO_FALSO_LATENCIA_MS", "0"))
+CORREO_FALSO_FALLOS = float(os.getenv("CORREO_FALSO_FALLOS", "0"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -11,6 +11,8 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
 from home.forms import ClienteUpdateForm
 from home.models import Cliente,Categoria, ItemPedido, Marca, Pedido, Producto, ImagenProducto, Pedido
+from home import metadatos, versions
+from home.fichas import cargar_fichas
 from .forms import CategoriaForm, ProductForm, ImagenFormSet
 import json
 from django.db.models import Sum, Count, F, DecimalField, ExpressionWrapper
@@ -375,35 +377,38 @@ class CatalogoGestionView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # Productos destacados (orden general del catálogo)
-        destacados = (
-            Producto.objects.filter(es_destacado=True)
-            .order_by("orden_catalogo", "nombre")
+        # Todos los productos en una consulta (más las de cargar_fichas) y
+        # se reparten en memoria entre destacados, categorías y marcas.
+        productos = cargar_fichas(
+            Producto.objects.order_by("orden_catalogo", "nombre"), tallas=False
         )
 
+        # Productos destacados (orden general del catálogo)
+        destacados = [p for p in productos if p.es_destacado]
+
         # Categorías con sus productos (para la pestaña "Por Categoría")
-        categorias_con_productos = []
-        categorias = Categoria.objects.all().order_by("nombre")
+        por_categoria = {}
+        for producto in sorted(productos, key=lambda p: (p.orden_categoria, p.nombre)):
+            por_categoria.setdefault(producto.categoria_id, []).append(producto)
 
-        for cat in categorias:
-            productos_cat = (
-                Producto.objects.filter(categoria=cat)
-                .order_by("orden_categoria", "nombre")
-            )
-            categorias_con_productos.append(
-                {
-                    "categoria": cat,
-                    "productos": productos_cat,
-                }
-            )
+        categorias_con_productos = [
+            {
+                "categoria": cat,
+                "productos": por_categoria.get(cat.pk, []),
+            }
+            for cat in Categoria.objects.all().order_by("nombre")
+        ]
+
+        por_marca = {}
+        for producto in productos:
+            por_marca.setdefault(producto.marca_id, []).append(producto)
 
-        marcas = Marca.objects.prefetch_related('productos').all()
         context['marcas_con_productos'] = [
             {
                 'marca': marca,
-                'productos': marca.productos.order_by('orden_catalogo')
+                'productos': por_marca.get(marca.pk, [])
             }
-            for marca in marcas
+            for marca in Marca.objects.all()
         ]
 
         context["destacados"] = destacados
@@ -438,6 +443,9 @@ def actualizar_orden_catalogo(request):
 
         Producto.objects.filter(pk=producto_id).update(orden_catalogo=index)
 
+    # update() no lanza señales: avisar a los índices y cachés del catálogo.
+    versions.marcar_catalogo()
+    metadatos.invalidar()
     return JsonResponse({"success": True})
 
 @require_POST
@@ -466,6 +474,8 @@ def actualizar_orden_categoria(request, categoria_id):
             orden_categoria=index
         )
 
+    versions.marcar_catalogo()
+    metadatos.invalidar()
     return JsonResponse({"success": True})
 
 @require_POST
@@ -495,6 +505,8 @@ def actualizar_orden_marca(request, marca_id):
         for index, producto_id in enumerate(orden):
             Producto.objects.filter(id=producto_id, marca_id=marca_id).update(orden_catalogo=index)
         
+        versions.marcar_catalogo()
+        metadatos.invalidar()
         return JsonResponse({'success': True})
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
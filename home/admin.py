@@ -1,6 +1,9 @@
 from django.contrib import admin
+
+from . import correos, inventario, tareas
 from .models import (
-    Categoria, Marca, Producto, ImagenProducto, TallaProducto, Carrito, ItemCarrito, Pedido, ItemPedido
+    Categoria, Marca, Producto, ImagenProducto, TallaProducto, Carrito, ItemCarrito, Pedido, ItemPedido,
+    MovimientoStock, ReservaStock, Tarea, EventoStripe, CorreoSaliente,
 )
 
 @admin.register(Categoria)
@@ -26,6 +29,31 @@ class ProductoAdmin(admin.ModelAdmin):
     search_fields = ["nombre"]
     inlines = [ImagenInline, TallaInline]
 
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not TallaProducto:
+            return super().save_formset(request, form, formset, change)
+        # El stock de una talla existente no se sobrescribe: lo que se suma o resta
+        # al valor mostrado (la base, sin reservas ni apuntes sin plegar) se apunta
+        # como ajuste en el libro de inventario.
+        ajustes, referencia = [], f"admin:{request.user.get_username()}"
+        instancias = formset.save(commit=False)
+        for talla in formset.deleted_objects:
+            talla.delete()
+        formularios = {f.instance: f for f in formset.forms if f.instance.pk}
+        cambios = {talla: f.changed_data for talla, f in formularios.items()}
+        for talla in instancias:
+            if talla.pk is None:
+                talla.save()
+                continue
+            campos = [c for c in cambios.get(talla, []) if c != "stock"]
+            if campos:
+                talla.save(update_fields=campos)
+            if "stock" in cambios.get(talla, []):
+                diferencia = talla.stock - formularios[talla].initial["stock"]
+                ajustes.append((talla.pk, MovimientoStock.Tipo.AJUSTE, diferencia, referencia))
+        formset.save_m2m()
+        inventario.apuntar(ajustes)
+
 @admin.register(Carrito)
 class CarritoAdmin(admin.ModelAdmin):
     list_display = ("codigo_carrito", "creado_en", "actualizado_en")
@@ -48,4 +76,59 @@ class PedidoAdmin(admin.ModelAdmin):
 class ItemPedidoAdmin(admin.ModelAdmin):
     list_display = ("pedido", "producto", "cantidad")
     list_filter = ("pedido", "producto")
-    search_fields = ("pedido__stripe_checkout_id", "producto__nombre")
\ No newline at end of file
+    search_fields = ("pedido__stripe_checkout_id", "producto__nombre")
+
+@admin.register(ReservaStock)
+class ReservaStockAdmin(admin.ModelAdmin):
+    list_display = ("codigo_carrito", "talla_producto", "cantidad", "estado", "expira_en")
+    list_filter = ("estado",)
+    search_fields = ("codigo_carrito",)
+
+@admin.register(MovimientoStock)
+class MovimientoStockAdmin(admin.ModelAdmin):
+    list_display = ("talla_producto", "tipo", "cantidad", "referencia", "creado_en", "plegado")
+    list_filter = ("tipo", "plegado")
+    search_fields = ("referencia", "talla_producto__producto__nombre")
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(Tarea)
+class TareaAdmin(admin.ModelAdmin):
+    list_display = ("tipo", "estado", "intentos", "max_intentos", "disponible_en", "actualizada_en")
+    list_filter = ("estado", "tipo")
+    readonly_fields = ("ultimo_error",)
+    actions = ["reintentar"]
+
+    @admin.action(description="Reintentar las tareas fallidas seleccionadas")
+    def reintentar(self, request, queryset):
+        n = tareas.reintentar(queryset.values_list("pk", flat=True))
+        self.message_user(request, f"{n} tareas devueltas a la cola")
+
+
+@admin.register(EventoStripe)
+class EventoStripeAdmin(admin.ModelAdmin):
+    list_display = ("evento_id", "tipo", "sesion_id", "tarea", "recibido_en")
+    list_filter = ("tipo",)
+    search_fields = ("evento_id", "sesion_id")
+    readonly_fields = ("evento_id", "tipo", "sesion_id", "sesion_pagada", "tarea", "recibido_en")
+
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    list_display = ("asunto", "destinatario", "estado", "intentos", "disponible_en", "enviado_en")
+    list_filter = ("estado",)
+    search_fields = ("destinatario", "asunto")
+    readonly_fields = ("html", "id_mensaje", "ultimo_error")
+    actions = ["reintentar"]
+
+    @admin.action(description="Reintentar los correos fallidos seleccionados")
+    def reintentar(self, request, queryset):
+        n = correos.reintentar(queryset.values_list("pk", flat=True))
+        self.message_user(request, f"{n} correos devueltos a la bandeja de salida")
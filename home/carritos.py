@@ -0,0 +1,235 @@
+"""
+Resumen del carrito: líneas, importes y contador de la cabecera.
+
+``ResumenCarrito`` carga las líneas de un carrito (con producto, talla e
+imagen principal) en una sola consulta y calcula subtotal, IVA, envío y total
+una vez, en ``Decimal``. Lo usan la página del carrito, el checkout de Stripe,
+el de invitados y el contador de la cabecera, así que todos cobran lo mismo.
+
+El contador (``carrito_resumen``) no consulta la BD: cada cambio en el carrito
+de un cliente (añadir, cambiar cantidades, quitar, fusionar el de sesión o
+pagarlo) llama a ``actualizar()``, que lo recalcula al confirmar la
+transacción. El subtotal depende de los precios, así que se guarda junto a la
+versión del catálogo con la que se calculó y se rehace si esta cambia.
+"""
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, When
+
+from . import versions
+from .models import Carrito, ItemCarrito, Producto, TallaProducto
+
+CLAVE = "carrito:resumen:{}"
+CENTIMOS = Decimal("0.01")
+IVA = Decimal("0.21")
+ENVIO = Decimal("4.50")
+
+
+def _centimos(importe):
+    return int((importe * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def _claves_sesion(cart):
+    """``[(key, producto_id, talla_producto_id, cantidad)]`` de las claves válidas."""
+    claves = []
+    for key, cantidad in cart.items():
+        try:
+            producto_id, talla_producto_id = key.split('-')
+            claves.append((key, int(producto_id), int(talla_producto_id), cantidad))
+        except ValueError:
+            continue
+    return claves
+
+
+def lineas_sesion(cart):
+    """
+    Convierte el carrito de sesión (``{"producto-talla": cantidad}``) en una
+    lista de diccionarios: {"producto", "talla_producto", "cantidad", "subtotal", "key"}.
+    Una consulta por modelo, sea cual sea el tamaño del carrito.
+    """
+    claves = _claves_sesion(cart)
+    if not claves:
+        return []
+    productos = Producto.objects.in_bulk({c[1] for c in claves})
+    tallas = TallaProducto.objects.in_bulk({c[2] for c in claves})
+    items = []
+    for key, producto_id, talla_producto_id, cantidad in claves:
+        producto = productos.get(producto_id)
+        talla_producto = tallas.get(talla_producto_id)
+        if producto is None or talla_producto is None:
+            continue
+        items.append({
+            "producto": producto,
+            "talla_producto": talla_producto,
+            "cantidad": cantidad,
+            "subtotal": producto.precio_final * cantidad,
+            "key": key
+        })
+    return items
+
+
+def fusionar_sesion(cart, cliente):
+    """
+    Suma el carrito de sesión al carrito del cliente: las líneas nuevas se
+    crean de golpe y las que ya existían se incrementan con un único UPDATE.
+    """
+    claves = _claves_sesion(cart)
+    with transaction.atomic():
+        carrito, _ = Carrito.objects.get_or_create(cliente=cliente)
+        if not claves:
+            return carrito
+        productos = set(Producto.objects.filter(pk__in={c[1] for c in claves}).values_list("pk", flat=True))
+        tallas = set(TallaProducto.objects.filter(pk__in={c[2] for c in claves}).values_list("pk", flat=True))
+        cantidades = {
+            (producto_id, talla_producto_id): cantidad
+            for _, producto_id, talla_producto_id, cantidad in claves
+            if producto_id in productos and talla_producto_id in tallas
+        }
+        if not cantidades:
+            return carrito
+
+        existentes = {
+            (producto_id, talla_producto_id): pk
+            for pk, producto_id, talla_producto_id in ItemCarrito.objects.select_for_update()
+            .filter(carrito=carrito, producto_id__in=productos, talla_producto_id__in=tallas)
+            .values_list("pk", "producto_id", "talla_producto_id")
+        }
+        incrementos = {existentes[par]: cantidad for par, cantidad in cantidades.items() if par in existentes}
+        if incrementos:
+            ItemCarrito.objects.filter(pk__in=incrementos).update(cantidad=Case(
+                *[When(pk=pk, then=F("cantidad") + cantidad) for pk, cantidad in incrementos.items()],
+                default=F("cantidad"),
+            ))
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto_id=producto_id, talla_producto_id=talla_producto_id, cantidad=cantidad)
+            for (producto_id, talla_producto_id), cantidad in cantidades.items()
+            if (producto_id, talla_producto_id) not in existentes
+        ])
+    return carrito
+
+
+def _valor(item, campo):
+    return item[campo] if isinstance(item, dict) else getattr(item, campo)
+
+
+@dataclass
+class ResumenCarrito:
+    """
+    Líneas de un carrito (``ItemCarrito`` o diccionarios del carrito de
+    sesión) y sus importes. ``carrito`` es None para el carrito de sesión.
+    """
+    items: list
+    carrito: Carrito = None
+    unidades: int = field(init=False)
+    subtotal: Decimal = field(init=False)
+    iva: Decimal = field(init=False)
+    envio: Decimal = field(init=False)
+    total: Decimal = field(init=False)
+
+    def __post_init__(self):
+        self.unidades = sum(_valor(item, "cantidad") for item in self.items)
+        self.subtotal = sum(
+            (_valor(item, "producto").precio_final * _valor(item, "cantidad") for item in self.items),
+            Decimal("0"),
+        ).quantize(CENTIMOS)
+        self.iva = (self.subtotal * IVA).quantize(CENTIMOS, rounding=ROUND_HALF_UP)
+        self.envio = ENVIO if self.subtotal > 0 else Decimal("0.00")
+        self.total = self.subtotal + self.iva + self.envio
+
+    @classmethod
+    def de_carrito(cls, carrito):
+        if carrito is None:
+            return cls([])
+        items = list(
+            ItemCarrito.objects.filter(carrito=carrito)
+            .select_related("producto", "talla_producto")
+            .order_by("id")
+        )
+        return cls(items, carrito)
+
+    @classmethod
+    def de_codigo(cls, codigo_carrito):
+        """Carrito por su código con sus líneas en una consulta (dos si está vacío o no existe)."""
+        items = list(
+            ItemCarrito.objects.filter(carrito__codigo_carrito=codigo_carrito)
+            .select_related("carrito", "producto", "talla_producto")
+            .order_by("id")
+        )
+        if items:
+            return cls(items, items[0].carrito)
+        return cls([], Carrito.objects.filter(codigo_carrito=codigo_carrito).first())
+
+    @classmethod
+    def de_cliente(cls, cliente, crear=False):
+        if crear:
+            carrito, _ = Carrito.objects.get_or_create(cliente=cliente)
+        else:
+            carrito = Carrito.objects.filter(cliente=cliente).first()
+        return cls.de_carrito(carrito)
+
+    @classmethod
+    def de_sesion(cls, session):
+        return cls(lineas_sesion(session.get("cart", {})))
+
+    @classmethod
+    def de_peticion(cls, request, crear=False):
+        if request.user.is_authenticated:
+            return cls.de_cliente(request.user, crear=crear)
+        return cls.de_sesion(request.session)
+
+    @property
+    def codigo_carrito(self):
+        return self.carrito.codigo_carrito if self.carrito else ""
+
+    def lineas_stripe(self, divisa="eur"):
+        """``line_items`` de Stripe: un precio por línea más el envío y el IVA."""
+        def linea(nombre, importe, cantidad=1):
+            return {
+                "price_data": {
+                    "currency": divisa,
+                    "product_data": {"name": nombre},
+                    "unit_amount": _centimos(importe),
+                },
+                "quantity": cantidad,
+            }
+
+        lineas = [
+            linea(_valor(item, "producto").nombre, _valor(item, "producto").precio_final, _valor(item, "cantidad"))
+            for item in self.items
+        ]
+        lineas.append(linea("Gastos de envío", ENVIO))
+        lineas.append(linea("IVA (21%)", self.iva))
+        return lineas
+
+
+def _guardar(cliente_id):
+    # La versión se lee antes de consultar: si un precio cambia mientras tanto
+    # el resumen queda con una versión vieja y se recalcula en la siguiente lectura.
+    version = versions.version_catalogo()
+    actual = ResumenCarrito.de_cliente(cliente_id)
+    cache.set(CLAVE.format(cliente_id), (version, actual.unidades, str(actual.subtotal)), None)
+    return actual.unidades, actual.subtotal
+
+
+def resumen(cliente_id):
+    """``(unidades, subtotal)`` del carrito del cliente; sin consultas si está en caché."""
+    guardado = cache.get(CLAVE.format(cliente_id))
+    if guardado is not None:
+        version, unidades, subtotal = guardado
+        if version == versions.version_catalogo():
+            return unidades, Decimal(subtotal)
+    return _guardar(cliente_id)
+
+
+def actualizar(cliente_id):
+    """
+    Llamar tras cualquier cambio en el carrito del cliente. Se borra ya, para
+    que nadie lea el valor viejo, y se recalcula cuando el cambio sea visible.
+    """
+    if cliente_id is None:
+        return
+    cache.delete(CLAVE.format(cliente_id))
+    transaction.on_commit(lambda: _guardar(cliente_id))
@@ -0,0 +1,125 @@
+"""
+Inicio del pago de un carrito.
+
+``iniciar_pago()`` es lo que hacen el botón de pagar del carrito
+(``create_checkout_session``) y la compra como invitado: carga el carrito con
+sus líneas en una consulta, aparta las unidades (``home.reservas``) y abre la
+sesión de pago en la pasarela. Si la pasarela falla las unidades se liberan.
+
+La pasarela es intercambiable: ``PASARELA_PAGO = "stripe"`` usa la API de
+Stripe y ``"falsa"`` crea sesiones en memoria sin salir a la red, para pruebas
+y pruebas de carga. Cualquier objeto con ``crear_sesion()`` sirve (ver
+``usar_pasarela``).
+"""
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+import stripe
+from django.conf import settings
+
+from . import reservas
+from .carritos import ResumenCarrito
+
+
+class ErrorCheckout(Exception):
+    """No se puede iniciar el pago. ``status`` es el código HTTP con el que responder."""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+@dataclass
+class SesionPago:
+    id: str
+    url: str
+
+
+class PasarelaStripe:
+    def crear_sesion(self, codigo_carrito, line_items, email, exito_url, cancelar_url, expira_en=None):
+        opciones = {"expires_at": int(expira_en.timestamp())} if expira_en else {}
+        sesion = stripe.checkout.Session.create(
+            customer_email=email,
+            payment_method_types=['card'],
+            line_items=line_items,
+            **opciones,
+            mode='payment',
+            success_url=exito_url,
+            cancel_url=cancelar_url,
+            metadata={"cart_code": codigo_carrito},
+        )
+        return SesionPago(id=sesion["id"], url=sesion["url"])
+
+
+class PasarelaFalsa:
+    """Sesiones en memoria: la URL de pago lleva directamente a la de éxito."""
+
+    def __init__(self):
+        self.sesiones = {}
+        self._cerrojo = threading.Lock()
+
+    def crear_sesion(self, codigo_carrito, line_items, email, exito_url, cancelar_url, expira_en=None):
+        sesion_id = f"cs_falso_{uuid.uuid4().hex}"
+        with self._cerrojo:
+            self.sesiones[sesion_id] = {
+                "cart_code": codigo_carrito, "line_items": line_items, "email": email, "expira_en": expira_en,
+            }
+        return SesionPago(id=sesion_id, url=exito_url.replace("{CHECKOUT_SESSION_ID}", sesion_id))
+
+
+_pasarela = None
+_cerrojo_pasarela = threading.Lock()
+
+
+def pasarela():
+    """La pasarela del proceso, creada en el primer uso según ``PASARELA_PAGO``."""
+    global _pasarela
+    with _cerrojo_pasarela:
+        if _pasarela is None:
+            _pasarela = PasarelaFalsa() if settings.PASARELA_PAGO == "falsa" else PasarelaStripe()
+        return _pasarela
+
+
+def usar_pasarela(nueva):
+    """Sustituye la pasarela del proceso (pruebas y pruebas de carga). Devuelve la anterior."""
+    global _pasarela
+    with _cerrojo_pasarela:
+        anterior, _pasarela = _pasarela, nueva
+    return anterior
+
+
+def iniciar_pago(codigo_carrito, email, exito_url, cancelar_url):
+    """
+    Reserva las unidades del carrito y abre su sesión de pago. Devuelve la
+    ``SesionPago``; lanza ``ErrorCheckout`` si el carrito no existe, está
+    vacío, no hay stock o la pasarela falla.
+    """
+    resumen = ResumenCarrito.de_codigo(codigo_carrito)
+    if resumen.carrito is None:
+        raise ErrorCheckout("El carrito no existe.", status=404)
+    if not resumen.items:
+        raise ErrorCheckout("El carrito está vacío.")
+
+    # Las unidades quedan apartadas mientras dura el pago
+    try:
+        expira_en = reservas.reservar(
+            codigo_carrito, [(item.talla_producto_id, item.cantidad) for item in resumen.items]
+        )
+    except reservas.StockInsuficiente as e:
+        item = next(i for i in resumen.items if i.talla_producto_id == e.talla_producto_id)
+        raise ErrorCheckout(
+            f"No quedan unidades suficientes de {item.producto.nombre} ({item.talla_producto.talla}).",
+            status=409,
+        ) from e
+
+    # Stripe exige al menos 30 minutos; la sesión caduca poco después que la reserva
+    caducidad = expira_en + timedelta(seconds=60) if reservas.duracion() >= timedelta(minutes=30) else None
+    try:
+        return pasarela().crear_sesion(
+            codigo_carrito, resumen.lineas_stripe(), email, exito_url, cancelar_url, expira_en=caducidad,
+        )
+    except Exception as e:
+        reservas.liberar(codigo_carrito)
+        raise ErrorCheckout(str(e)) from e
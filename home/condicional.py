@@ -0,0 +1,112 @@
+"""
+Validadores HTTP (ETag / Last-Modified) para las páginas del catálogo.
+
+Se calculan solo con la caché compartida (``home.versions``), sin consultar
+la BD, para poder contestar ``304 Not Modified`` antes de ejecutar la vista.
+La parte que depende del usuario va aparte (``parte_usuario``): si la página
+lleva algo que no se puede validar barato, no se emite validador y la vista
+se ejecuta siempre.
+"""
+import datetime
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+
+from . import versions
+from .middleware import es_visitante_sin_estado
+from .models import Producto
+
+CLAVE_SLUG = "catalogo:slug:{}"
+
+
+def _etag(*partes):
+    return hashlib.sha1("|".join(str(p) for p in partes).encode()).hexdigest()[:24]
+
+
+def _fecha(ms):
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+def parte_usuario(request):
+    """
+    Lo que cambia la página de un usuario a otro, o None si no se puede validar
+    (los mensajes pendientes solo se muestran una vez). El carrito ya no va en
+    el HTML; la cabecera sí lleva el nombre del usuario identificado y, salvo
+    para el visitante sin sesión, un token CSRF: el validador incluye su
+    secreto para que una página guardada antes de rotarlo (al volver a
+    iniciar sesión) no se dé por buena.
+    """
+    if len(get_messages(request)):
+        return None
+    if es_visitante_sin_estado(request):
+        return "anonimo"
+    # Crea el secreto si aún no lo hay, para que la respuesta lleve el mismo
+    get_token(request)
+    csrf = hashlib.sha1(request.META["CSRF_COOKIE"].encode()).hexdigest()[:12]
+    if request.user.is_authenticated:
+        return f"usuario:{request.user.pk}:{csrf}"
+    return f"sesion:{csrf}"
+
+
+def recordar_slug(producto):
+    cache.set(CLAVE_SLUG.format(producto.slug), producto.pk, None)
+
+
+def olvidar_slug(producto):
+    cache.delete(CLAVE_SLUG.format(producto.slug))
+
+
+def _producto_id(slug):
+    """Id del producto con ese slug, guardado en caché; None si no existe."""
+    clave = CLAVE_SLUG.format(slug)
+    pk = cache.get(clave)
+    if pk is None:
+        pk = Producto.objects.filter(slug=slug).values_list("pk", flat=True).first()
+        if pk is None:
+            return None
+        cache.set(clave, pk, None)
+    return pk
+
+
+# ---------- catálogo ----------
+
+def etag_catalogo(request, *args, **kwargs):
+    usuario = parte_usuario(request)
+    if usuario is None:
+        return None
+    return _etag("catalogo", versions.version_catalogo(), request.GET.urlencode(), usuario)
+
+
+def modificado_catalogo(request, *args, **kwargs):
+    if parte_usuario(request) is None:
+        return None
+    return _fecha(versions.ultimo_cambio())
+
+
+# ---------- detalle de producto ----------
+
+def etag_producto(request, slug, *args, **kwargs):
+    usuario = parte_usuario(request)
+    pk = _producto_id(slug)
+    if usuario is None or pk is None:
+        return None
+    return _etag("producto", pk, versions.ultimo_cambio(pk), usuario)
+
+
+def modificado_producto(request, slug, *args, **kwargs):
+    pk = _producto_id(slug)
+    if parte_usuario(request) is None or pk is None:
+        return None
+    return _fecha(versions.ultimo_cambio(pk))
+
+
+# ---------- autocompletado (no depende del usuario) ----------
+
+def etag_autocompletado(request, *args, **kwargs):
+    return _etag("autocompletado", versions.version_catalogo(), request.GET.get("q", ""))
+
+
+def modificado_autocompletado(request, *args, **kwargs):
+    return _fecha(versions.ultimo_cambio())
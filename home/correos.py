@@ -0,0 +1,229 @@
+"""
+Bandeja de salida de correos transaccionales.
+
+``encolar_confirmacion()`` renderiza el correo del pedido y lo guarda como
+``CorreoSaliente`` dentro de la transacción que crea el pedido: si el pedido
+no se confirma tampoco hay correo, y si Brevo está caído el pedido no se
+entera. ``manage.py enviar_correos`` los envía por lotes: reclama varios con
+un solo UPDATE, los manda a la vez (como mucho ``CORREO_CONCURRENCIA``) por el
+transporte del proceso y reintenta los que fallan con espera exponencial.
+
+El transporte se crea una vez por proceso: el de Brevo reutiliza el mismo
+``ApiClient`` y sus conexiones en todos los envíos. Con
+``CORREO_TRANSPORTE = "falso"`` no sale nada a la red, para medir el envío sin
+Brevo. El envío es al menos una vez: si un worker muere tras enviar y antes de
+anotarlo, el correo se vuelve a mandar al vencer su bloqueo.
+"""
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import sib_api_v3_sdk
+from django.conf import settings
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from sib_api_v3_sdk.rest import ApiException
+
+from .fichas import cargar_fichas
+from .models import Cliente, CorreoSaliente
+from .tareas import espera
+
+logger = logging.getLogger(__name__)
+
+REMITENTE = {"name": "Entertain Pet", "email": "entertainpet2025@gmail.com"}
+# Tiempo que un worker tiene un lote antes de que otro pueda recuperarlo.
+BLOQUEO = timedelta(minutes=5)
+LOTE = 50
+
+Estado = CorreoSaliente.Estado
+
+
+class ErrorPermanente(Exception):
+    """El transporte rechaza el correo y reintentarlo no va a cambiar nada."""
+
+
+class TransporteBrevo:
+    """Envía por la API de Brevo con un único cliente (y pool de conexiones) por proceso."""
+
+    def __init__(self, conexiones):
+        configuracion = sib_api_v3_sdk.Configuration()
+        configuracion.api_key["api-key"] = os.environ.get("BREVO_API_KEY")
+        configuracion.connection_pool_maxsize = conexiones
+        self._api = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuracion))
+
+    def enviar(self, correo):
+        mensaje = sib_api_v3_sdk.SendSmtpEmail(
+            to=[{"email": correo.destinatario}],
+            sender=REMITENTE,
+            subject=correo.asunto,
+            html_content=correo.html,
+        )
+        try:
+            return self._api.send_transac_email(mensaje).message_id or ""
+        except ApiException as e:
+            if e.status == 400:
+                raise ErrorPermanente(e.body) from e
+            raise
+
+
+class TransporteFalso:
+    """No envía nada: espera ``latencia`` segundos y falla con probabilidad ``fallos``."""
+
+    def __init__(self, latencia=0.0, fallos=0.0):
+        self.latencia = latencia
+        self.fallos = fallos
+        self.enviados = []
+        self._cerrojo = threading.Lock()
+
+    def enviar(self, correo):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if random.random() < self.fallos:
+            raise ConnectionError("Fallo simulado del transporte falso")
+        with self._cerrojo:
+            self.enviados.append(correo.pk)
+        return f"falso-{uuid.uuid4().hex}"
+
+
+_transporte = None
+_cerrojo_transporte = threading.Lock()
+
+
+def transporte():
+    """El transporte del proceso, creado en el primer uso según ``CORREO_TRANSPORTE``."""
+    global _transporte
+    with _cerrojo_transporte:
+        if _transporte is None:
+            if settings.CORREO_TRANSPORTE == "falso":
+                _transporte = TransporteFalso(
+                    settings.CORREO_FALSO_LATENCIA_MS / 1000, settings.CORREO_FALSO_FALLOS,
+                )
+            else:
+                _transporte = TransporteBrevo(settings.CORREO_CONCURRENCIA)
+        return _transporte
+
+
+def usar_transporte(nuevo):
+    """Sustituye el transporte del proceso (pruebas y medición). Devuelve el anterior."""
+    global _transporte
+    with _cerrojo_transporte:
+        anterior, _transporte = _transporte, nuevo
+    return anterior
+
+
+def confirmacion(pedido):
+    """``(asunto, html)`` del correo de confirmación de ``pedido``."""
+    seguimiento_url = settings.SITE_DOMAIN + reverse("home:seguimiento_token", args=[pedido.seguimiento_token])
+    items = list(pedido.pedido_items.select_related("producto"))
+    cargar_fichas([item.producto for item in items], tallas=False)
+    items_con_subtotal = [
+        {
+            "producto": item.producto,
+            "cantidad": item.cantidad,
+            "subtotal": item.producto.precio_final * item.cantidad,
+            "imagen_url": item.producto.imagen_principal or None,
+        }
+        for item in items
+    ]
+    context = {
+        "pedido": pedido,
+        "items_con_subtotal": items_con_subtotal,
+        "cliente": Cliente.objects.filter(email=pedido.cliente_email).first(),
+        "seguimiento_url": seguimiento_url,
+    }
+    asunto = f"Confirmación de tu pedido #{pedido.stripe_checkout_id}"
+    return asunto, render_to_string("email/confirmacion.html", context)
+
+
+def encolar_confirmacion(pedido):
+    """Guarda en la bandeja de salida el correo de confirmación del pedido."""
+    asunto, html = confirmacion(pedido)
+    return CorreoSaliente.objects.create(pedido=pedido, destinatario=pedido.cliente_email, asunto=asunto, html=html)
+
+
+def _disponibles(ahora):
+    return CorreoSaliente.objects.filter(
+        Q(estado=Estado.PENDIENTE, disponible_en__lte=ahora)
+        | Q(estado=Estado.ENVIANDO, bloqueado_hasta__lt=ahora)
+    )
+
+
+def reclamar(lote=LOTE):
+    """Marca como enviando hasta ``lote`` correos disponibles y los devuelve."""
+    ahora = timezone.now()
+    candidatos = list(_disponibles(ahora).order_by("disponible_en", "pk").values_list("pk", flat=True)[:lote])
+    if not candidatos:
+        return []
+    # Solo se quedan los candidatos que nadie reclamó entre la lectura y el UPDATE
+    marca = uuid.uuid4().hex
+    _disponibles(ahora).filter(pk__in=candidatos).update(
+        estado=Estado.ENVIANDO, lote=marca, bloqueado_hasta=ahora + BLOQUEO, intentos=F("intentos") + 1,
+    )
+    return list(CorreoSaliente.objects.filter(lote=marca, estado=Estado.ENVIANDO).order_by("pk"))
+
+
+def _enviar(correo):
+    try:
+        return correo, transporte().enviar(correo), None
+    except Exception as e:
+        return correo, None, e
+
+
+def enviar(correos, concurrencia=None):
+    """
+    Envía un lote ya reclamado, como mucho ``concurrencia`` a la vez, y anota
+    el resultado de todos con dos UPDATE. Devuelve ``(enviados, fallidos)``.
+    """
+    concurrencia = concurrencia or settings.CORREO_CONCURRENCIA
+    with ThreadPoolExecutor(max_workers=max(1, concurrencia)) as pool:
+        resultados = list(pool.map(_enviar, correos))
+
+    ahora = timezone.now()
+    enviados, fallidos = [], []
+    for correo, id_mensaje, error in resultados:
+        correo.bloqueado_hasta = None
+        if error is None:
+            correo.estado, correo.id_mensaje, correo.enviado_en, correo.ultimo_error = (
+                Estado.ENVIADO, id_mensaje, ahora, "",
+            )
+            enviados.append(correo)
+            continue
+        logger.warning("Correo %s falló (intento %s/%s): %s", correo.pk, correo.intentos, correo.max_intentos, error)
+        definitivo = isinstance(error, ErrorPermanente) or correo.intentos >= correo.max_intentos
+        correo.estado = Estado.FALLIDO if definitivo else Estado.PENDIENTE
+        correo.disponible_en = ahora + espera(correo.intentos)
+        correo.ultimo_error = f"{type(error).__name__}: {error}"
+        fallidos.append(correo)
+    CorreoSaliente.objects.bulk_update(
+        enviados, ["estado", "id_mensaje", "enviado_en", "ultimo_error", "bloqueado_hasta"],
+    )
+    CorreoSaliente.objects.bulk_update(
+        fallidos, ["estado", "disponible_en", "ultimo_error", "bloqueado_hasta"],
+    )
+    return len(enviados), len(fallidos)
+
+
+def procesar(lote=LOTE, concurrencia=None):
+    """Envía lotes hasta vaciar la bandeja. Devuelve ``(enviados, fallidos)``."""
+    totales = [0, 0]
+    while True:
+        correos = reclamar(lote)
+        if not correos:
+            return tuple(totales)
+        enviados, fallidos = enviar(correos, concurrencia)
+        totales[0] += enviados
+        totales[1] += fallidos
+
+
+def reintentar(correo_ids):
+    """Devuelve a la bandeja correos fallidos, con los intentos a cero."""
+    return CorreoSaliente.objects.filter(pk__in=correo_ids, estado=Estado.FALLIDO).update(
+        estado=Estado.PENDIENTE, intentos=0, disponible_en=timezone.now(), bloqueado_hasta=None,
+    )
@@ -0,0 +1,41 @@
+"""
+Registro de eventos de Stripe.
+
+Stripe reintenta un webhook hasta recibir un 2xx y puede entregar el mismo
+evento varias veces, incluso a la vez; además una sesión de pago puede pasar
+por ``checkout.session.completed`` y ``checkout.session.async_payment_succeeded``.
+``recibir()`` guarda cada evento en ``EventoStripe`` y encola el pedido en la
+misma transacción, así que son las restricciones únicas de la tabla las que
+deciden: un evento ya visto, o el segundo evento de pago de una sesión, no
+encolan nada y el webhook responde enseguida.
+"""
+from django.db import IntegrityError, transaction
+
+from . import tareas
+from .models import EventoStripe
+
+TIPOS_PAGO = ("checkout.session.completed", "checkout.session.async_payment_succeeded")
+
+
+def recibir(evento):
+    """
+    Registra ``evento`` (el JSON del webhook) y, si es el primer evento de
+    pago de su sesión, encola ``cumplir_pedido``. Devuelve la tarea encolada
+    o None si no hay nada que hacer (evento repetido o sesión ya encolada).
+    """
+    tipo = evento["type"]
+    sesion = evento["data"]["object"]
+    datos = {"evento_id": evento["id"], "tipo": tipo, "sesion_id": sesion.get("id", "")}
+    if tipo in TIPOS_PAGO:
+        try:
+            with transaction.atomic():
+                tarea = tareas.encolar(
+                    "cumplir_pedido", session=sesion, cart_code=(sesion.get("metadata") or {}).get("cart_code"),
+                )
+                EventoStripe.objects.create(sesion_pagada=sesion["id"], tarea=tarea, **datos)
+                return tarea
+        except IntegrityError:
+            # El evento ya estaba o la sesión ya se encoló con otro evento
+            pass
+    EventoStripe.objects.get_or_create(evento_id=datos.pop("evento_id"), defaults=datos)
+    return None
@@ -0,0 +1,336 @@
+"""
+Motor de facetas del catálogo.
+
+Para cada valor de faceta (categoría, marca, color, material, tramo de precio y
+disponibilidad de stock) se guarda en memoria un bitset con los ids de los
+productos disponibles que lo tienen; los bitsets son enteros de Python, así que
+filtrar es hacer ``&``/``|`` y contar es ``bit_count()``. Dentro de una faceta
+los valores se combinan con OR y entre facetas con AND, como hacía
+``ProductListView``. El índice sigue la versión del catálogo (``home.versions``).
+"""
+import bisect
+import math
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from . import versions
+from .models import Producto
+
+# Tramos de precio que se muestran en la barra lateral: [desde, hasta).
+TRAMOS_PRECIO = [(0, 10), (10, 25), (25, 50), (50, 100), (100, None)]
+CENTIMO = Decimal("0.01")
+
+FACETAS = ("categoria", "marca", "color", "material", "precio", "stock")
+
+
+def _bitset(ids):
+    ids = list(ids)
+    if not ids:
+        return 0
+    datos = bytearray(max(ids) // 8 + 1)
+    for pk in ids:
+        datos[pk >> 3] |= 1 << (pk & 7)
+    return int.from_bytes(datos, "little")
+
+
+def ids_de(bits):
+    """Ids contenidos en un bitset, en orden creciente."""
+    ids = []
+    binario = bin(bits)[:1:-1]
+    i = binario.find("1")
+    while i != -1:
+        ids.append(i)
+        i = binario.find("1", i + 1)
+    return ids
+
+
+def _tramo(precio):
+    for i, (desde, hasta) in enumerate(TRAMOS_PRECIO):
+        if precio >= desde and (hasta is None or precio < hasta):
+            return i
+    return 0
+
+
+def maximo_tramo(hasta):
+    """
+    Máximo del filtro ``max`` (inclusivo) que selecciona lo mismo que cuenta
+    el tramo que acaba en ``hasta`` (exclusivo): los precios van en céntimos.
+    """
+    return None if hasta is None else Decimal(hasta) - CENTIMO
+
+
+def _enteros(valores):
+    return {int(v) for v in valores if str(v).isdigit()}
+
+
+def _decimal(valor):
+    try:
+        return Decimal(valor) if valor not in (None, "") else None
+    except InvalidOperation:
+        return None
+
+
+@dataclass
+class Filtros:
+    categoria: set = field(default_factory=set)
+    marca: set = field(default_factory=set)
+    color: set = field(default_factory=set)
+    material: set = field(default_factory=set)
+    precio_min: Decimal = None
+    precio_max: Decimal = None
+    solo_stock: bool = False
+
+    @classmethod
+    def desde_get(cls, get):
+        return cls(
+            categoria=_enteros(get.getlist("categoria")),
+            marca=_enteros(get.getlist("marca")),
+            color=_enteros(get.getlist("color")),
+            material={m for m in get.getlist("material") if m},
+            precio_min=_decimal(get.get("min")),
+            precio_max=_decimal(get.get("max")),
+            solo_stock=get.get("stock") == "1",
+        )
+
+    @property
+    def activos(self):
+        return bool(
+            self.categoria or self.marca or self.color or self.material
+            or self.precio_min is not None or self.precio_max is not None or self.solo_stock
+        )
+
+
+@dataclass
+class ResultadoFacetas:
+    bits: int
+    conteos: dict
+
+    @property
+    def total(self):
+        return self.bits.bit_count()
+
+
+class IndiceFacetas(versions.IndiceVersionado):
+    def _vaciar(self):
+        self._todos = 0
+        self._valores = {f: {} for f in FACETAS}
+        # Bitsets por euro entero, para filtrar rangos min/max arbitrarios.
+        self._por_euro = {}
+        self._docs = {}
+        self._ordenes = {}
+
+    def _quitar(self, pk):
+        doc = self._docs.pop(pk, None)
+        if doc is None:
+            return
+        self._ordenes = {}
+        mascara = ~(1 << pk)
+        self._todos &= mascara
+        for faceta, valores in doc["facetas"].items():
+            for valor in valores:
+                bits = self._valores[faceta].get(valor, 0) & mascara
+                if bits:
+                    self._valores[faceta][valor] = bits
+                else:
+                    self._valores[faceta].pop(valor, None)
+        euro = doc["euro"]
+        bits = self._por_euro.get(euro, 0) & mascara
+        if bits:
+            self._por_euro[euro] = bits
+        else:
+            self._por_euro.pop(euro, None)
+
+    def _cargar(self, pks):
+        self._ordenes = {}
+        qs = Producto.objects.filter(esta_disponible=True)
+        colores = Producto.colores.through.objects.all()
+        if pks is not None:
+            qs = qs.filter(pk__in=pks)
+            colores = colores.filter(producto_id__in=pks)
+
+        colores_de = {}
+        for producto_id, color_id in colores.values_list("producto_id", "color_id"):
+            colores_de.setdefault(producto_id, []).append(color_id)
+
+        nuevos = {}
+        filas = qs.values_list(
+            "id", "categoria_id", "marca_id", "material", "precio", "stock_total",
+            "orden_categoria", "orden_catalogo",
+        ).iterator(chunk_size=2000)
+        for pk, categoria_id, marca_id, material, precio, stock_total, orden_categoria, orden_catalogo in filas:
+            facetas = {
+                "categoria": (categoria_id,),
+                "marca": (marca_id,),
+                "color": tuple(colores_de.get(pk, ())),
+                "material": (material,) if material else (),
+                "precio": (_tramo(precio),),
+                "stock": (True,) if stock_total > 0 else (),
+            }
+            self._docs[pk] = {
+                "facetas": facetas,
+                "precio": precio,
+                "euro": math.floor(precio),
+                "orden_categoria": orden_categoria,
+                "orden_catalogo": orden_catalogo,
+                "id": pk,
+            }
+            for faceta, valores in facetas.items():
+                for valor in valores:
+                    nuevos.setdefault((faceta, valor), []).append(pk)
+            nuevos.setdefault(("euro", math.floor(precio)), []).append(pk)
+            nuevos.setdefault(("todos", None), []).append(pk)
+
+        # Un bitset por valor de una vez: OR-ear producto a producto sería
+        # cuadrático en una reconstrucción completa.
+        for (faceta, valor), ids in nuevos.items():
+            bits = _bitset(ids)
+            if faceta == "todos":
+                self._todos |= bits
+            elif faceta == "euro":
+                self._por_euro[valor] = self._por_euro.get(valor, 0) | bits
+            else:
+                self._valores[faceta][valor] = self._valores[faceta].get(valor, 0) | bits
+
+    # ---------- consulta ----------
+
+    def _union(self, faceta, valores):
+        bits = 0
+        for valor in valores:
+            bits |= self._valores[faceta].get(valor, 0)
+        return bits
+
+    def _rango_precio(self, minimo, maximo):
+        """Productos con minimo <= precio <= maximo (cualquiera de los dos puede faltar)."""
+        bits = 0
+        for euro, euro_bits in self._por_euro.items():
+            if (minimo is not None and euro + 1 <= minimo) or (maximo is not None and euro > maximo):
+                continue
+            if (minimo is None or euro >= minimo) and (maximo is None or euro + 1 <= maximo):
+                bits |= euro_bits
+                continue
+            # Euro en el borde del rango: comprobar el precio exacto.
+            for pk in ids_de(euro_bits):
+                precio = self._docs[pk]["precio"]
+                if (minimo is None or precio >= minimo) and (maximo is None or precio <= maximo):
+                    bits |= 1 << pk
+        return bits
+
+    def _mascaras(self, filtros):
+        mascaras = {}
+        if filtros.categoria:
+            mascaras["categoria"] = self._union("categoria", filtros.categoria)
+        if filtros.marca:
+            mascaras["marca"] = self._union("marca", filtros.marca)
+        if filtros.color:
+            mascaras["color"] = self._union("color", filtros.color)
+        if filtros.material:
+            mascaras["material"] = self._union("material", filtros.material)
+        if filtros.precio_min is not None or filtros.precio_max is not None:
+            mascaras["precio"] = self._rango_precio(filtros.precio_min, filtros.precio_max)
+        if filtros.solo_stock:
+            mascaras["stock"] = self._valores["stock"].get(True, 0)
+        return mascaras
+
+    def filtrar(self, filtros, ids=None):
+        """
+        Aplica ``filtros`` (y opcionalmente la lista de ids de una búsqueda) y
+        devuelve el bitset resultante junto con los conteos por valor de cada
+        faceta. El conteo de una faceta ignora su propia selección, para que
+        al marcar una categoría sigan viéndose las cifras de las demás.
+        """
+        self.sincronizar()
+        with self._lock:
+            base = self._todos
+            if ids is not None:
+                base &= _bitset(ids)
+            mascaras = self._mascaras(filtros)
+
+            bits = base
+            for mascara in mascaras.values():
+                bits &= mascara
+
+            conteos = {}
+            for faceta in FACETAS:
+                universo = base
+                for otra, mascara in mascaras.items():
+                    if otra != faceta:
+                        universo &= mascara
+                conteos[faceta] = {
+                    valor: n
+                    for valor, valor_bits in self._valores[faceta].items()
+                    if (n := (universo & valor_bits).bit_count())
+                }
+            return ResultadoFacetas(bits, conteos)
+
+    def _orden(self, campos):
+        """(ids, claves) de todo el catálogo ordenado por ``campos``; uno por versión."""
+        orden = self._ordenes.get(campos)
+        if orden is None:
+            clave = lambda pk: tuple(self._docs[pk][c] for c in campos)
+            ids = sorted(self._docs, key=clave)
+            orden = self._ordenes[campos] = (ids, [clave(pk) for pk in ids])
+        return orden
+
+    def ordenar(self, bits, campos):
+        """
+        Ids del bitset ordenados por ``campos`` (y después por id). Si el
+        resultado es una parte grande del catálogo sale más barato recorrer
+        el orden completo, que se calcula una vez por versión.
+        """
+        campos = tuple(campos) + ("id",)
+        ids = ids_de(bits)
+        with self._lock:
+            if len(ids) * 8 < len(self._docs):
+                return sorted(ids, key=lambda pk: tuple(self._docs[pk][c] for c in campos))
+            orden, _ = self._orden(campos)
+            if len(ids) == len(self._docs):
+                return list(orden)
+            incluidos = set(ids)
+            return [pk for pk in orden if pk in incluidos]
+
+    def pagina(self, bits, campos, cursor=None, hacia_atras=False, tamaño=12):
+        """
+        Paginación por cursor (keyset) sobre el orden de ``campos``.
+
+        ``cursor`` es la clave de ordenación del último producto de la página
+        anterior (o del primero de la siguiente si ``hacia_atras``). Devuelve
+        ``(ids, claves, hay_anterior, hay_siguiente)``. Se salta directamente
+        a la posición del cursor con una búsqueda binaria y solo se recorre
+        hasta completar la página, así que el coste no depende de lo profunda
+        que sea.
+        """
+        campos = tuple(campos) + ("id",)
+        with self._lock:
+            orden, claves = self._orden(campos)
+            datos = bits.to_bytes(bits.bit_length() // 8 + 1, "little")
+            incluido = lambda pk: pk >> 3 < len(datos) and datos[pk >> 3] >> (pk & 7) & 1
+
+            if hacia_atras:
+                inicio = bisect.bisect_left(claves, tuple(cursor)) - 1 if cursor else len(orden) - 1
+                posiciones = range(inicio, -1, -1)
+            else:
+                inicio = bisect.bisect_right(claves, tuple(cursor)) if cursor else 0
+                posiciones = range(inicio, len(orden))
+
+            encontrados = []
+            hay_mas = False
+            for i in posiciones:
+                if incluido(orden[i]):
+                    if len(encontrados) == tamaño:
+                        hay_mas = True
+                        break
+                    encontrados.append(i)
+
+            if hacia_atras:
+                encontrados.reverse()
+                hay_anterior, hay_siguiente = hay_mas, True
+            else:
+                hay_anterior, hay_siguiente = cursor is not None, hay_mas
+            return (
+                [orden[i] for i in encontrados],
+                [claves[i] for i in encontrados],
+                hay_anterior,
+                hay_siguiente,
+            )
+
+facetas = IndiceFacetas()
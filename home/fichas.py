@@ -0,0 +1,63 @@
+"""
+Carga en bloque de lo que necesita la tarjeta de un producto.
+
+Las plantillas del catálogo, la gestión del catálogo, el carrito y el correo
+de confirmación pintan para cada producto su imagen principal, su marca y
+categoría y (en el catálogo) sus tallas con stock. Hacerlo producto a
+producto son varias consultas por tarjeta; ``cargar_fichas`` lo resuelve para
+toda la página con un número fijo de consultas.
+
+La imagen principal va en la propia fila del producto
+(``Producto.imagen_principal``) y se mantiene al cambiar sus imágenes.
+"""
+from django.db.models import OuterRef, Prefetch, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+
+from .models import ImagenProducto, Producto, TallaProducto, nueva_version
+
+
+def actualizar_imagen_principal(producto_ids=None):
+    """
+    Apunta ``imagen_principal`` a la imagen marcada como principal o, si no
+    hay ninguna, a la primera; vacía si el producto no tiene imágenes. También
+    cambia la versión de los productos.
+    """
+    principal = (
+        ImagenProducto.objects.filter(producto=OuterRef("pk"))
+        .order_by("-es_principal", "id")
+        .values("imagen")[:1]
+    )
+    qs = Producto.objects.all()
+    if producto_ids is not None:
+        qs = qs.filter(pk__in=producto_ids)
+    return qs.update(
+        imagen_principal=Coalesce(Subquery(principal), Value("")), version=nueva_version()
+    )
+
+
+def cargar_fichas(productos, tallas=True, marca_categoria=True):
+    """
+    Prepara ``productos`` para pintar sus tarjetas:
+
+    - ``producto.marca`` / ``producto.categoria`` ya cargadas, si ``marca_categoria``.
+    - ``producto.tallas.all`` precargado, si ``tallas``.
+
+    Devuelve la lista de productos.
+    """
+    productos = [p for p in productos if p is not None]
+    if not productos:
+        return productos
+
+    relaciones = ["marca", "categoria"] if marca_categoria else []
+    if tallas:
+        relaciones.append(Prefetch("tallas", queryset=TallaProducto.objects.order_by("id")))
+    prefetch_related_objects(productos, *relaciones)
+    return productos
+
+
+def tallas_por_producto(productos):
+    """{id: [{id, talla, stock}]} de productos con las tallas ya cargadas."""
+    return {
+        str(p.pk): [{"id": t.pk, "talla": t.talla, "stock": t.stock} for t in p.tallas.all()]
+        for p in productos
+    }
@@ -0,0 +1,76 @@
+"""
+Caché en memoria del HTML de las tarjetas de producto.
+
+Cada tarjeta se guarda por (plantilla, producto) junto con la ``version`` del
+producto con la que se pintó; ``Producto.version`` cambia con el propio
+producto, sus imágenes, tallas o colores, y se lee en la misma fila que los
+datos de la tarjeta, así que nunca se sirve una tarjeta de una versión
+anterior. La caché tiene un tope de memoria y expulsa las tarjetas menos
+usadas.
+
+Las tarjetas se pintan sin ``request``: nada que dependa del usuario o de su
+carrito puede acabar dentro, y anónimos y usuarios comparten la misma caché.
+"""
+import threading
+from collections import OrderedDict
+
+from django.template.loader import get_template
+
+MAX_BYTES = 4 * 1024 * 1024
+
+
+class CacheFragmentos:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._vaciar()
+
+    def _vaciar(self):
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    def vaciar(self):
+        with self._lock:
+            self._vaciar()
+
+    def _guardar(self, clave, version, html):
+        anterior = self._entradas.pop(clave, None)
+        if anterior is not None:
+            self._bytes -= len(anterior[1])
+        if len(html) > self.max_bytes:
+            return
+        self._entradas[clave] = (version, html)
+        self._bytes += len(html)
+        while self._bytes > self.max_bytes:
+            _, (_, expulsado) = self._entradas.popitem(last=False)
+            self._bytes -= len(expulsado)
+
+    def tarjeta(self, producto, plantilla):
+        """HTML de ``plantilla`` para ``producto``, de la caché si su versión coincide."""
+        clave = (plantilla, producto.pk)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == producto.version:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+
+        html = get_template(plantilla).render({"producto": producto})
+        with self._lock:
+            self._guardar(clave, producto.version, html)
+        return html
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+fragmentos = CacheFragmentos()
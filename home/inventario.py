@@ -0,0 +1,149 @@
+"""
+Libro de inventario.
+
+Todo cambio de stock (ventas, reposiciones, ajustes, reservas y sus
+liberaciones) se apunta como un ``MovimientoStock`` nuevo en lugar de
+reescribir la fila de ``TallaProducto``. El stock disponible es
+``TallaProducto.stock`` (la base) más la suma de los apuntes sin plegar.
+
+Las entradas (``apuntar()``: reposiciones, liberaciones, ajustes del admin)
+solo insertan y no esperan a nadie. Las salidas que comprueban el disponible
+(``retirar()``, ``retirar_varias()``) y ``ajustar()`` sí bloquean la fila de
+la talla con ``select_for_update()`` mientras leen y apuntan, así que dos
+compras de la misma talla van una detrás de otra; el libro solo acorta ese
+bloqueo a una lectura y un INSERT. En SQLite ``select_for_update()`` no hace
+nada: las ordena el único escritor de la base de datos y la que choca falla
+con un error de bloqueo (las tareas de la cola se reintentan).
+
+``compactar()`` (``manage.py compactar_inventario``) pliega periódicamente los
+apuntes en la base y refresca ``stock_total`` y las cachés del catálogo, que
+mientras tanto muestran la base. Las decisiones (añadir al carrito, reservar,
+vender) leen siempre el disponible exacto. Los apuntes no se borran al
+plegarlos: quedan como historial.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import metadatos, stock, versions
+from .models import MovimientoStock, TallaProducto
+
+Tipo = MovimientoStock.Tipo
+# Apuntes marcados como plegados por consulta (límite de parámetros de SQLite).
+LOTE = 500
+
+
+def pendiente():
+    """Expresión con la suma de los apuntes sin plegar de cada talla."""
+    suma = (
+        MovimientoStock.objects.filter(talla_producto=OuterRef("pk"), plegado=False)
+        .values("talla_producto")
+        .annotate(total=Sum("cantidad"))
+        .values("total")
+    )
+    return Coalesce(Subquery(suma, output_field=IntegerField()), Value(0), output_field=IntegerField())
+
+
+def con_disponible(qs=None):
+    """Anota ``disponible`` (base + apuntes sin plegar) en un queryset de tallas."""
+    qs = TallaProducto.objects.all() if qs is None else qs
+    return qs.annotate(disponible=F("stock") + pendiente())
+
+
+def disponible(talla_producto_id):
+    valor = con_disponible().filter(pk=talla_producto_id).values_list("disponible", flat=True).first()
+    return valor or 0
+
+
+def apuntar(movimientos):
+    """Inserta ``[(talla_producto_id, tipo, cantidad, referencia)]`` sin más comprobaciones."""
+    MovimientoStock.objects.bulk_create([
+        MovimientoStock(talla_producto_id=talla_producto_id, tipo=tipo, cantidad=cantidad, referencia=referencia)
+        for talla_producto_id, tipo, cantidad, referencia in movimientos
+        if cantidad
+    ])
+
+
+def retirar(talla_producto_id, cantidad, tipo, referencia=""):
+    """
+    Apunta una salida de ``cantidad`` unidades solo si están disponibles.
+    True si se pudo. Bloquea la fila de la talla (sin escribirla) para que
+    dos salidas no comprueben el mismo disponible a la vez.
+    """
+    with transaction.atomic():
+        if not TallaProducto.objects.select_for_update().filter(pk=talla_producto_id).exists():
+            return False
+        if disponible(talla_producto_id) < cantidad:
+            return False
+        apuntar([(talla_producto_id, tipo, -cantidad, referencia)])
+    return True
+
+
+def retirar_varias(cantidades, tipo, referencia=""):
+    """
+    ``retirar()`` de varias tallas (``{talla_producto_id: cantidad}``) con un
+    número fijo de consultas: bloquea todas las tallas, lee su disponible de
+    una vez y apunta juntas las salidas que caben. Devuelve
+    ``{talla_producto_id: cantidad}`` de las que no había stock.
+    """
+    if not cantidades:
+        return {}
+    with transaction.atomic():
+        list(TallaProducto.objects.select_for_update().filter(pk__in=cantidades).order_by("pk").values_list("pk"))
+        disponibles = dict(con_disponible().filter(pk__in=cantidades).values_list("pk", "disponible"))
+        salidas, faltan = [], {}
+        for talla_producto_id, cantidad in sorted(cantidades.items()):
+            if disponibles.get(talla_producto_id, 0) >= cantidad:
+                salidas.append((talla_producto_id, tipo, -cantidad, referencia))
+            else:
+                faltan[talla_producto_id] = cantidad
+        apuntar(salidas)
+    return faltan
+
+
+def ajustar(talla_producto_id, objetivo, referencia=""):
+    """
+    Apunta el ajuste que deja el disponible de la talla en ``objetivo``.
+    Bloquea la fila de la talla como ``retirar()``.
+    """
+    with transaction.atomic():
+        TallaProducto.objects.select_for_update().filter(pk=talla_producto_id).exists()
+        diferencia = objetivo - disponible(talla_producto_id)
+        apuntar([(talla_producto_id, Tipo.AJUSTE, diferencia, referencia)])
+    return diferencia
+
+
+def compactar():
+    """
+    Pliega en ``TallaProducto.stock`` los apuntes pendientes y refresca lo que
+    depende de él. Devuelve el número de apuntes plegados.
+    """
+    with transaction.atomic():
+        # Se pliegan exactamente los apuntes leídos aquí, aunque entren otros mientras.
+        filas = list(
+            MovimientoStock.objects.select_for_update()
+            .filter(plegado=False)
+            .values_list("pk", "talla_producto_id", "cantidad")
+        )
+        if not filas:
+            return 0
+        deltas = defaultdict(int)
+        for _, talla_producto_id, cantidad in filas:
+            deltas[talla_producto_id] += cantidad
+        for talla_producto_id, delta in sorted(deltas.items()):
+            if delta:
+                TallaProducto.objects.filter(pk=talla_producto_id).update(stock=F("stock") + delta)
+        pks = [fila[0] for fila in filas]
+        for i in range(0, len(pks), LOTE):
+            MovimientoStock.objects.filter(pk__in=pks[i:i + LOTE]).update(plegado=True)
+
+        producto_ids = set(
+            TallaProducto.objects.filter(pk__in=deltas).values_list("producto_id", flat=True)
+        )
+        stock.recalcular(producto_ids)
+        for producto_id in producto_ids:
+            versions.marcar_producto(producto_id)
+        metadatos.invalidar()
+    return len(filas)
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import inventario
+
+
+class Command(BaseCommand):
+    help = "Pliega los apuntes pendientes del libro de inventario en el stock de las tallas"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cada",
+            type=int,
+            default=0,
+            help="Repite la compactación cada N segundos en lugar de ejecutarla una vez",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            plegados = inventario.compactar()
+            self.stdout.write(self.style.SUCCESS(f"✔ {plegados} apuntes plegados en el stock"))
+            if not options["cada"]:
+                return
+            time.sleep(options["cada"])
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections
+
+from home import correos
+
+
+class Command(BaseCommand):
+    help = "Envía los correos de la bandeja de salida por lotes y reintenta los fallidos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lote",
+            type=int,
+            default=correos.LOTE,
+            help="Correos que se reclaman de una vez",
+        )
+        parser.add_argument(
+            "--concurrencia",
+            type=int,
+            default=settings.CORREO_CONCURRENCIA,
+            help="Envíos simultáneos como máximo",
+        )
+        parser.add_argument(
+            "--espera",
+            type=float,
+            default=1.0,
+            help="Segundos entre consultas cuando la bandeja está vacía",
+        )
+        parser.add_argument(
+            "--una-vez",
+            action="store_true",
+            help="Termina en cuanto la bandeja se vacía",
+        )
+
+    def handle(self, *args, **options):
+        enviados = fallidos = 0
+        inicio = time.perf_counter()
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    lote = correos.reclamar(options["lote"])
+                    if lote:
+                        ok, mal = correos.enviar(lote, options["concurrencia"])
+                        enviados, fallidos = enviados + ok, fallidos + mal
+                        continue
+                except DatabaseError as e:
+                    # Los correos reclamados vuelven a estar disponibles al vencer su bloqueo
+                    self.stderr.write(f"Error de base de datos al enviar correos: {e}")
+                if options["una_vez"]:
+                    break
+                time.sleep(options["espera"])
+        except KeyboardInterrupt:
+            self.stdout.write("Interrumpido; los correos en curso se recuperarán al vencer su bloqueo")
+        segundos = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ {enviados} correos enviados, {fallidos} fallos ({enviados / segundos:.1f} correos/s)"
+        ))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from home import reservas
+
+
+class Command(BaseCommand):
+    help = "Devuelve al stock las reservas de checkout caducadas sin pagar"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cada",
+            type=int,
+            default=0,
+            help="Repite el barrido cada N segundos en lugar de ejecutarlo una vez",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            unidades = reservas.liberar_caducadas()
+            self.stdout.write(self.style.SUCCESS(f"✔ {unidades} unidades reservadas devueltas al stock"))
+            if not options["cada"]:
+                return
+            time.sleep(options["cada"])
@@ -0,0 +1,71 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from home import reservas
+from home.models import Carrito, Categoria, ItemCarrito, Marca, Producto, TallaProducto
+from home.pedidos import fulfill_checkout
+
+
+class _Deshacer(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide consultas y tiempo de fulfill_checkout según el número de líneas del pedido. "
+        "Trabaja dentro de una transacción que se deshace al terminar"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lineas", type=int, nargs="+", default=[1, 5, 20, 50],
+            help="Tamaños de pedido (líneas distintas) a medir",
+        )
+        parser.add_argument(
+            "--repeticiones", type=int, default=5,
+            help="Pedidos por tamaño; se muestra la mediana del tiempo",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._medir(options["lineas"], options["repeticiones"])
+                raise _Deshacer
+        except _Deshacer:
+            pass
+
+    def _medir(self, tamanos, repeticiones):
+        categoria = Categoria.objects.create(nombre="Medición pedidos")
+        marca = Marca.objects.create(nombre="Medición pedidos")
+        tallas = []
+        for i in range(max(tamanos)):
+            producto = Producto.objects.create(
+                nombre=f"Medición {i}", precio=Decimal("10.00"), categoria=categoria, marca=marca,
+            )
+            tallas.append(TallaProducto.objects.create(producto=producto, talla="M", stock=10 ** 6))
+
+        self.stdout.write(f"{'líneas':>8} {'consultas':>10} {'ms (mediana)':>14}")
+        for tamano in tamanos:
+            consultas, tiempos = 0, []
+            for repeticion in range(repeticiones):
+                carrito = Carrito.objects.create()
+                ItemCarrito.objects.bulk_create([
+                    ItemCarrito(carrito=carrito, producto_id=talla.producto_id, talla_producto=talla, cantidad=1)
+                    for talla in tallas[:tamano]
+                ])
+                reservas.reservar(carrito.codigo_carrito, [(talla.pk, 1) for talla in tallas[:tamano]])
+                session = {
+                    "id": f"cs_medicion_{tamano}_{repeticion}", "amount_total": 1000 * tamano,
+                    "currency": "eur", "customer_email": "medicion@test.com",
+                }
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    fulfill_checkout(session, carrito.codigo_carrito)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+                consultas = len(capturadas)
+            self.stdout.write(f"{tamano:>8} {consultas:>10} {statistics.median(tiempos):>14.2f}")
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from home import tareas
+
+
+class Command(BaseCommand):
+    help = "Worker de la cola de tareas: pedidos y correos en segundo plano"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--hilos",
+            type=int,
+            default=1,
+            help="Tareas que se ejecutan a la vez en este proceso",
+        )
+        parser.add_argument(
+            "--espera",
+            type=float,
+            default=1.0,
+            help="Segundos entre consultas cuando la cola está vacía",
+        )
+        parser.add_argument(
+            "--tipo",
+            action="append",
+            dest="tipos",
+            help="Procesa solo las tareas de este tipo (se puede repetir)",
+        )
+        parser.add_argument(
+            "--una-vez",
+            action="store_true",
+            help="Termina en cuanto la cola se vacía",
+        )
+
+    def trabajar(self, options, hechas):
+        try:
+            while True:
+                close_old_connections()
+                try:
+                    siguiente = tareas.reclamar(options["tipos"])
+                    if siguiente is not None:
+                        tareas.ejecutar(siguiente)
+                        hechas.append(siguiente.pk)
+                        continue
+                except DatabaseError as e:
+                    # BD ocupada o caída: el worker sigue vivo y vuelve a intentarlo
+                    self.stderr.write(f"Error de base de datos en el worker: {e}")
+                    connection.close()
+                    time.sleep(options["espera"])
+                    continue
+                if options["una_vez"]:
+                    return
+                time.sleep(options["espera"])
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        hechas = []
+        hilos = [
+            threading.Thread(target=self.trabajar, args=(options, hechas), daemon=True)
+            for _ in range(max(1, options["hilos"]))
+        ]
+        for hilo in hilos:
+            hilo.start()
+        try:
+            for hilo in hilos:
+                hilo.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Interrumpido; las tareas en curso se recuperarán al vencer su bloqueo")
+        self.stdout.write(self.style.SUCCESS(f"✔ {len(hechas)} tareas ejecutadas"))
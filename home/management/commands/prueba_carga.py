@@ -0,0 +1,221 @@
+import json
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import stripe
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import Sum
+from django.test import Client
+from django.urls import reverse
+
+from home import checkout, tareas, views
+from home.models import (
+    Carrito, Categoria, CorreoSaliente, EventoStripe, ItemCarrito, Marca, MovimientoStock, Pedido, Producto,
+    TallaProducto, Tarea,
+)
+from home.stripe_local import StripeLocal
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga del embudo de compra (checkout → Stripe local → webhook → pedido → página de éxito) "
+        "con compradores simulados que compiten por el mismo stock"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--compradores", type=int, default=50)
+        parser.add_argument("--concurrencia", type=int, default=10, help="Compradores a la vez")
+        parser.add_argument("--stock", type=int, default=20, help="Unidades disponibles del producto en venta")
+        parser.add_argument("--unidades", type=int, default=1, help="Unidades que compra cada comprador")
+        parser.add_argument("--workers", type=int, default=2, help="Hilos de la cola de tareas")
+        parser.add_argument("--latencia-ms", type=int, default=0, help="Latencia de la API de Stripe local")
+        parser.add_argument("--fallos", type=float, default=0.0, help="Proporción de llamadas a Stripe que fallan")
+        parser.add_argument("--retraso-webhook-ms", type=int, default=0, help="Tiempo entre el pago y el webhook")
+        parser.add_argument("--duplicados", type=float, default=0.0, help="Proporción de webhooks repetidos")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Segundos que un comprador espera su pedido")
+        parser.add_argument("--conservar", action="store_true", help="No borra los datos de la prueba")
+
+    def handle(self, *args, **options):
+        if not views.endpoint_secret:
+            raise CommandError("Define WEBHOOK_SECRET: los webhooks se firman con él")
+        self.options = options
+        self.prefijo = f"Carga {uuid.uuid4().hex[:8]}"
+        talla, self.carritos = self.preparar()
+
+        def entregar(payload, firma):
+            respuesta = Client(raise_request_exception=False).post(
+                reverse("home:webhook"), payload, content_type="application/json", HTTP_STRIPE_SIGNATURE=firma,
+            )
+            connection.close()
+            return respuesta.status_code
+
+        self.stripe_local = StripeLocal(
+            views.endpoint_secret,
+            entregar,
+            latencia=options["latencia_ms"] / 1000,
+            fallos=options["fallos"],
+            retraso_webhook=options["retraso_webhook_ms"] / 1000,
+            duplicados=options["duplicados"],
+        )
+        anteriores = stripe.api_base, stripe.api_key
+        pasarela = checkout.usar_pasarela(checkout.PasarelaStripe())
+        parar = threading.Event()
+        self.backlog = []
+        try:
+            with self.stripe_local:
+                stripe.api_base, stripe.api_key = self.stripe_local.url, stripe.api_key or "sk_test_local"
+                hilos = [threading.Thread(target=self.worker, args=(parar,), daemon=True) for _ in range(options["workers"])]
+                hilos.append(threading.Thread(target=self.medir_backlog, args=(parar,), daemon=True))
+                for hilo in hilos:
+                    hilo.start()
+
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=max(1, options["concurrencia"])) as pool:
+                    resultados = list(pool.map(self.comprador, self.carritos))
+                duracion = time.perf_counter() - inicio
+                backlog_final = self.backlog[-1] if self.backlog else 0
+
+                limite = time.monotonic() + options["timeout"]
+                while self.pendientes() and time.monotonic() < limite:
+                    time.sleep(0.1)
+                parar.set()
+                for hilo in hilos:
+                    hilo.join()
+        finally:
+            stripe.api_base, stripe.api_key = anteriores
+            checkout.usar_pasarela(pasarela)
+
+        self.informe(talla, resultados, duracion, backlog_final)
+        if not options["conservar"]:
+            self.limpiar()
+
+    def preparar(self):
+        categoria = Categoria.objects.create(nombre=self.prefijo)
+        marca = Marca.objects.create(nombre=self.prefijo)
+        producto = Producto.objects.create(
+            nombre=f"{self.prefijo} producto", precio=Decimal("10.00"), categoria=categoria, marca=marca,
+        )
+        talla = TallaProducto.objects.create(producto=producto, talla="U", stock=self.options["stock"])
+        carritos = [Carrito.objects.create() for _ in range(self.options["compradores"])]
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto=producto, talla_producto=talla, cantidad=self.options["unidades"])
+            for carrito in carritos
+        ])
+        return talla, [carrito.codigo_carrito for carrito in carritos]
+
+    def comprador(self, codigo_carrito):
+        """Devuelve ``(resultado, segundos hasta Stripe, segundos hasta ver el pedido)``."""
+        cliente = Client(raise_request_exception=False)
+        try:
+            inicio = time.perf_counter()
+            # Como un navegador: un 5xx (la BD ocupada) se reintenta
+            for intento in range(5):
+                respuesta = cliente.post(
+                    reverse("home:create_checkout_session"),
+                    json.dumps({"cart_code": codigo_carrito, "email": f"{codigo_carrito}@carga.test"}),
+                    content_type="application/json",
+                )
+                if respuesta.status_code < 500:
+                    break
+                time.sleep(0.05 * 2 ** intento)
+            hasta_stripe = time.perf_counter() - inicio
+            if respuesta.status_code == 409:
+                return "sin_stock", hasta_stripe, None
+            if respuesta.status_code != 200:
+                return "error", hasta_stripe, None
+
+            sesion_id = respuesta.json()["data"]["id"]
+            self.stripe_local.pagar(sesion_id)
+            limite = time.monotonic() + self.options["timeout"]
+            while time.monotonic() < limite:
+                estado = cliente.get(reverse("home:pedido_estado"), {"session_id": sesion_id})
+                if estado.status_code == 200 and estado.json()["estado"] == "listo":
+                    cliente.get(reverse("home:success"), {"session_id": sesion_id})
+                    return "comprado", hasta_stripe, time.perf_counter() - inicio
+                time.sleep(0.05)
+            return "sin_pedido", hasta_stripe, None
+        finally:
+            connection.close()
+
+    def worker(self, parar):
+        while not parar.is_set():
+            close_old_connections()
+            try:
+                siguiente = tareas.reclamar(["cumplir_pedido"])
+                if siguiente is not None:
+                    tareas.ejecutar(siguiente)
+                    continue
+            except DatabaseError:
+                connection.close()
+            parar.wait(0.05)
+        connection.close()
+
+    def pendientes(self):
+        en_cola = Tarea.objects.filter(
+            tipo="cumplir_pedido", estado__in=[Tarea.Estado.PENDIENTE, Tarea.Estado.EN_CURSO],
+        ).count()
+        return self.stripe_local.pendientes + en_cola
+
+    def medir_backlog(self, parar):
+        while not parar.is_set():
+            try:
+                self.backlog.append(self.pendientes())
+            except DatabaseError:
+                pass
+            finally:
+                connection.close()
+            parar.wait(0.1)
+
+    def informe(self, talla, resultados, duracion, backlog_final):
+        cuenta = {}
+        for resultado, _, _ in resultados:
+            cuenta[resultado] = cuenta.get(resultado, 0) + 1
+        hasta_stripe = [r[1] * 1000 for r in resultados]
+        completas = [r[2] * 1000 for r in resultados if r[2] is not None]
+        sesiones = list(self.stripe_local.sesiones)
+        pedidos = Pedido.objects.filter(stripe_checkout_id__in=sesiones).count()
+        vendidas = -(
+            MovimientoStock.objects.filter(talla_producto=talla, tipo=MovimientoStock.Tipo.VENTA)
+            .aggregate(total=Sum("cantidad"))["total"] or 0
+        )
+        sobreventa = max(0, vendidas - self.options["stock"])
+        sin_servir = pedidos * self.options["unidades"] - vendidas
+
+        escribir = self.stdout.write
+        escribir(f"compradores: {len(resultados)} en {duracion:.2f} s "
+                 f"({cuenta.get('comprado', 0) / duracion:.1f} compras/s)")
+        escribir(f"comprados: {cuenta.get('comprado', 0)}  sin stock: {cuenta.get('sin_stock', 0)}  "
+                 f"errores: {cuenta.get('error', 0)}  sin pedido a tiempo: {cuenta.get('sin_pedido', 0)}")
+        for nombre, valores in (("checkout (ms)", hasta_stripe), ("hasta ver el pedido (ms)", completas)):
+            escribir(f"{nombre}: p50 {percentil(valores, 50):.1f}  p95 {percentil(valores, 95):.1f}  "
+                     f"p99 {percentil(valores, 99):.1f}")
+        escribir(f"pedidos: {pedidos}  unidades vendidas: {vendidas} de {self.options['stock']}  "
+                 f"sobreventa: {sobreventa}  pagados sin servir: {sin_servir}")
+        escribir(f"backlog de webhooks: máximo {max(self.backlog, default=0)}  al acabar las compras {backlog_final}  "
+                 f"final {self.pendientes()}")
+        escribir(f"webhooks: {self.stripe_local.entregados} entregados, {self.stripe_local.fallidos} sin entregar")
+
+    def limpiar(self):
+        sesiones = list(self.stripe_local.sesiones)
+        tarea_ids = list(EventoStripe.objects.filter(sesion_id__in=sesiones).values_list("tarea_id", flat=True))
+        pedidos = Pedido.objects.filter(stripe_checkout_id__in=sesiones)
+        CorreoSaliente.objects.filter(pedido__in=pedidos).delete()
+        pedidos.delete()
+        EventoStripe.objects.filter(sesion_id__in=sesiones).delete()
+        Tarea.objects.filter(pk__in=tarea_ids).delete()
+        Producto.objects.filter(nombre__startswith=self.prefijo).delete()
+        Carrito.objects.filter(codigo_carrito__in=self.carritos).delete()
+        Categoria.objects.filter(nombre=self.prefijo).delete()
+        Marca.objects.filter(nombre=self.prefijo).delete()
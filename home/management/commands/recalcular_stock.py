@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from home import metadatos, stock, versions
+
+
+class Command(BaseCommand):
+    help = "Recalcula el stock total desnormalizado de los productos"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--comprobar",
+            action="store_true",
+            help="Solo informa de los productos descuadrados, sin corregirlos",
+        )
+
+    def handle(self, *args, **options):
+        descuadres = stock.descuadres()
+        for pk, guardado, real in descuadres:
+            self.stdout.write(f"Producto {pk}: stock_total={guardado}, real={real}")
+
+        if options["comprobar"]:
+            if descuadres:
+                raise CommandError(f"{len(descuadres)} productos con stock_total descuadrado")
+            self.stdout.write(self.style.SUCCESS("✔ stock_total cuadra en todos los productos"))
+            return
+
+        stock.recalcular()
+        versions.marcar_catalogo()
+        metadatos.invalidar()
+        self.stdout.write(self.style.SUCCESS(f"✔ stock_total recalculado ({len(descuadres)} corregidos)"))
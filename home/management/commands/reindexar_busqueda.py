@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from home.search import fts
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los índices de búsqueda del catálogo"
+
+    def handle(self, *args, **kwargs):
+        fts.reconstruir()
+        self.stdout.write(self.style.SUCCESS("✔ Índice de texto completo reconstruido"))
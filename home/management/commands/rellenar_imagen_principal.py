@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from home import metadatos, versions
+from home.fichas import actualizar_imagen_principal
+
+
+class Command(BaseCommand):
+    help = "Rellena la imagen principal guardada en cada producto a partir de sus imágenes"
+
+    def handle(self, *args, **kwargs):
+        total = actualizar_imagen_principal()
+        versions.marcar_catalogo()
+        metadatos.invalidar()
+        self.stdout.write(self.style.SUCCESS(f"✔ Imagen principal actualizada en {total} productos"))
@@ -0,0 +1,58 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from home.stripe_local import StripeLocal, entregar_http
+
+
+class Command(BaseCommand):
+    help = (
+        "Arranca un Stripe local que crea sesiones de pago y envía webhooks firmados. "
+        "Arranca la web con STRIPE_API_BASE apuntando a él"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--puerto", type=int, default=12111)
+        parser.add_argument(
+            "--webhook-url",
+            help="Dónde se envían los webhooks (por defecto el de SITE_DOMAIN)",
+        )
+        parser.add_argument("--latencia-ms", type=int, default=0, help="Latencia de cada llamada a la API")
+        parser.add_argument("--fallos", type=float, default=0.0, help="Proporción de llamadas que fallan con un 500")
+        parser.add_argument("--retraso-webhook-ms", type=int, default=0, help="Tiempo entre el pago y el webhook")
+        parser.add_argument("--duplicados", type=float, default=0.0, help="Proporción de webhooks entregados dos veces")
+        parser.add_argument(
+            "--pago-tras",
+            type=float,
+            default=1.0,
+            help="Segundos tras crear la sesión en que se da por pagada",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.WEBHOOK_SECRET:
+            raise CommandError("Define WEBHOOK_SECRET: los webhooks se firman con él")
+        webhook_url = options["webhook_url"] or settings.SITE_DOMAIN + reverse("home:webhook")
+        stripe_local = StripeLocal(
+            settings.WEBHOOK_SECRET,
+            entregar_http(webhook_url),
+            latencia=options["latencia_ms"] / 1000,
+            fallos=options["fallos"],
+            retraso_webhook=options["retraso_webhook_ms"] / 1000,
+            duplicados=options["duplicados"],
+            pago_automatico=options["pago_tras"],
+            puerto=options["puerto"],
+        )
+        with stripe_local:
+            self.stdout.write(f"Stripe local en {stripe_local.url}; webhooks a {webhook_url}")
+            self.stdout.write(f"Arranca la web con STRIPE_API_BASE={stripe_local.url}")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ {len(stripe_local.sesiones)} sesiones, {stripe_local.entregados} webhooks entregados, "
+            f"{stripe_local.fallidos} sin entregar"
+        ))
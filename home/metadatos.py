@@ -0,0 +1,46 @@
+"""
+Metadatos de la barra lateral del catálogo en la caché compartida.
+
+Categorías, marcas, colores, los materiales distintos y los productos
+destacados (con sus tallas ya cargadas) se calculan una vez y se guardan en la
+caché de Django; los conteos de la barra salen de las facetas
+(``home.facetas``). Las señales de los modelos implicados (``home.signals``) los
+invalidan, así que una página del catálogo no vuelve a consultarlos.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+
+from .models import Categoria, Color, Marca, Producto, TallaProducto
+
+CLAVE = "catalogo:metadatos"
+MAX_DESTACADOS = 12
+
+
+def _calcular():
+    materiales = Producto.objects.exclude(material="").values_list("material", flat=True).order_by("material")
+    destacados = Producto.objects.filter(es_destacado=True, esta_disponible=True).prefetch_related(
+        Prefetch("tallas", queryset=TallaProducto.objects.order_by("id"))
+    )[:MAX_DESTACADOS]
+    return {
+        "categorias": list(Categoria.objects.all()),
+        "marcas": list(Marca.objects.all()),
+        "colores": list(Color.objects.all()),
+        "materiales": list(materiales.distinct()),
+        "destacados": list(destacados),
+    }
+
+
+def metadatos_catalogo():
+    """Diccionario con ``categorias``, ``marcas``, ``colores``, ``materiales`` y ``destacados``."""
+    datos = cache.get(CLAVE)
+    if datos is None:
+        datos = _calcular()
+        cache.set(CLAVE, datos, None)
+    return datos
+
+
+def invalidar():
+    """Se borra ya y otra vez al confirmar, por si alguien los recalculó entretanto."""
+    cache.delete(CLAVE)
+    transaction.on_commit(lambda: cache.delete(CLAVE))
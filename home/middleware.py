@@ -1,5 +1,13 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from . import versions
 
 class ForcePasswordChangeMiddleware:
     def __init__(self, get_response):
@@ -19,4 +27,79 @@ class ForcePasswordChangeMiddleware:
                     return redirect('home:change_password_forced')
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+class PaginaCompartidaMiddleware:
+    """
+    Caché de página completa para visitantes anónimos.
+
+    Las vistas marcadas con ``pagina_compartida = True`` no llevan nada propio
+    del usuario en el HTML (el carrito y el token CSRF se piden a
+    ``/carrito/resumen.json``), así que a quien llega sin cookies de sesión ni
+    de mensajes se le sirve la misma respuesta guardada en la caché compartida
+    sin ejecutar la vista. La clave incluye la versión del catálogo, con lo que
+    cualquier cambio deja de servir las páginas anteriores.
+
+    Va antes de ``SessionMiddleware``: así, al guardar, la respuesta ya lleva
+    las cookies de sesión, CSRF y mensajes, y la que pone alguna no se comparte.
+    """
+
+    MAX_AGE = 60
+    TIMEOUT = 60 * 60
+    CABECERAS = ("Content-Type", "ETag", "Last-Modified")
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        clave = getattr(request, "_clave_pagina", None)
+        if clave is None or getattr(request, "_pagina_de_cache", False):
+            return response
+
+        if not es_visitante_sin_estado(request):
+            patch_cache_control(response, private=True)
+            return response
+
+        patch_cache_control(response, public=True, max_age=self.MAX_AGE)
+        patch_vary_headers(response, ("Cookie",))
+        if response.status_code == 200 and not response.cookies and not response.streaming:
+            cabeceras = {h: response[h] for h in self.CABECERAS if response.has_header(h)}
+            cache.set(clave, (response.content, cabeceras), self.TIMEOUT)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        vista = getattr(view_func, "view_class", view_func)
+        if not getattr(vista, "pagina_compartida", False) or request.method not in ("GET", "HEAD"):
+            return None
+
+        clave = "pagina:{}:{}".format(
+            versions.version_catalogo(),
+            hashlib.sha1(request.get_full_path().encode()).hexdigest(),
+        )
+        request._clave_pagina = clave
+        if not es_visitante_sin_estado(request):
+            return None
+
+        guardada = cache.get(clave)
+        if guardada is None:
+            return None
+        contenido, cabeceras = guardada
+        request._pagina_de_cache = True
+        response = get_conditional_response(request, etag=cabeceras.get("ETag"))
+        if response is None:
+            response = HttpResponse(contenido)
+        for cabecera, valor in cabeceras.items():
+            response[cabecera] = valor
+        patch_cache_control(response, public=True, max_age=self.MAX_AGE)
+        patch_vary_headers(response, ("Cookie",))
+        return response
+
+
+def es_visitante_sin_estado(request):
+    """Anónimo sin sesión ni mensajes pendientes: su página es la de cualquier otro."""
+    return (
+        settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and "messages" not in request.COOKIES
+        and not request.user.is_authenticated
+    )
@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS home_producto_fts
+USING fts5(nombre, descripcion, tokenize = 'unicode61 remove_diacritics 2')
+"""
+SQLITE_FILL = """
+INSERT INTO home_producto_fts (rowid, nombre, descripcion)
+SELECT id, nombre, descripcion FROM home_producto
+"""
+SQLITE_DROP = "DROP TABLE IF EXISTS home_producto_fts"
+
+POSTGRES_CREATE = """
+CREATE INDEX IF NOT EXISTS home_producto_fts_idx ON home_producto
+USING GIN (to_tsvector('spanish'::regconfig, COALESCE(nombre, '') || ' ' || COALESCE(descripcion, '')))
+"""
+POSTGRES_DROP = "DROP INDEX IF EXISTS home_producto_fts_idx"
+
+
+def crear_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_FILL)
+    elif vendor == "postgresql":
+        schema_editor.execute(POSTGRES_CREATE)
+
+
+def borrar_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(SQLITE_DROP)
+    elif vendor == "postgresql":
+        schema_editor.execute(POSTGRES_DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
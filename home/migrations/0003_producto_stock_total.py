@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:19
+
+from django.db import migrations, models
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def rellenar_stock_total(apps, schema_editor):
+    Producto = apps.get_model("home", "Producto")
+    TallaProducto = apps.get_model("home", "TallaProducto")
+    suma = (
+        TallaProducto.objects.filter(producto=OuterRef("pk"))
+        .values("producto")
+        .annotate(total=Sum("stock"))
+        .values("total")
+    )
+    Producto.objects.update(
+        stock_total=Coalesce(
+            Subquery(suma, output_field=IntegerField()), F("stock"), output_field=IntegerField()
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0002_producto_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='stock_total',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(rellenar_stock_total, migrations.RunPython.noop),
+    ]
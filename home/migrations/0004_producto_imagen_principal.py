@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:23
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def rellenar_imagen_principal(apps, schema_editor):
+    Producto = apps.get_model("home", "Producto")
+    ImagenProducto = apps.get_model("home", "ImagenProducto")
+    principal = (
+        ImagenProducto.objects.filter(producto=OuterRef("pk"))
+        .order_by("-es_principal", "id")
+        .values("imagen")[:1]
+    )
+    Producto.objects.update(imagen_principal=Coalesce(Subquery(principal), Value("")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_producto_stock_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_principal',
+            field=models.URLField(blank=True, editable=False),
+        ),
+        migrations.RunPython(rellenar_imagen_principal, migrations.RunPython.noop),
+    ]
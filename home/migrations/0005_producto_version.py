@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0004_producto_imagen_principal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_producto_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo_carrito', models.CharField(db_index=True, max_length=50)),
+                ('cantidad', models.PositiveIntegerField()),
+                ('estado', models.CharField(choices=[('active', 'Activa'), ('sold', 'Vendida'), ('released', 'Liberada')], default='active', max_length=10)),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+                ('expira_en', models.DateTimeField()),
+                ('talla_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='home.tallaproducto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'expira_en'], name='home_reserv_estado_fe2adc_idx')],
+            },
+        ),
+    ]
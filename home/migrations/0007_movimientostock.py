@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0006_reservastock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimientoStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('sale', 'Venta'), ('restock', 'Reposición'), ('adjustment', 'Ajuste'), ('reservation', 'Reserva'), ('release', 'Liberación de reserva')], max_length=12)),
+                ('cantidad', models.IntegerField()),
+                ('referencia', models.CharField(blank=True, max_length=100)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+                ('plegado', models.BooleanField(default=False)),
+                ('talla_producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='home.tallaproducto')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['talla_producto', 'plegado'], name='home_movimi_talla_p_41e5e0_idx')],
+            },
+        ),
+    ]
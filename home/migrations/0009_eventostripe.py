@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_tarea'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('evento_id', models.CharField(max_length=255, unique=True)),
+                ('tipo', models.CharField(max_length=100)),
+                ('sesion_id', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('sesion_pagada', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('recibido_en', models.DateTimeField(auto_now_add=True)),
+                ('tarea', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='eventos', to='home.tarea')),
+            ],
+        ),
+    ]
@@ -1,6 +1,8 @@
+import secrets
 import uuid
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 import uuid
 from django.db.models import Sum
@@ -56,6 +58,11 @@ class Color(models.Model):
     class Meta:
         verbose_name_plural = "Colores"
 
+def nueva_version():
+    """Valor nuevo para ``Producto.version``; aleatorio para no repetir nunca uno anterior."""
+    return secrets.randbits(62)
+
+
 class Producto(models.Model):
     nombre = models.CharField(max_length=200)
     slug = models.SlugField(max_length=220, unique=True, blank=True)
@@ -68,6 +75,12 @@ class Producto(models.Model):
     colores = models.ManyToManyField(Color, blank=True, related_name="productos")
     material = models.CharField(max_length=50, blank=True)
     stock = models.PositiveIntegerField(default=0)
+    # Suma del stock de las tallas (o ``stock`` si no tiene); ver home/stock.py
+    stock_total = models.PositiveIntegerField(default=0, db_index=True, editable=False)
+    # URL de la imagen principal (o la primera); ver home/fichas.py
+    imagen_principal = models.URLField(blank=True, editable=False)
+    # Cambia con el producto, sus imágenes, tallas o colores (caché de tarjetas)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
     esta_disponible = models.BooleanField(default=True)
     es_destacado = models.BooleanField(default=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
@@ -90,6 +103,9 @@ class Producto(models.Model):
                 i += 1
                 slug_candidate = f"{base}-{i}"
             self.slug = slug_candidate
+        self.version = nueva_version()
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
         super().save(*args, **kwargs)
 
     @property
@@ -122,6 +138,50 @@ class TallaProducto(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} - {self.talla}"
 
+class MovimientoStock(models.Model):
+    """
+    Apunte del libro de inventario: solo se insertan. El stock disponible de
+    una talla es ``TallaProducto.stock`` más los apuntes aún no plegados.
+    """
+    class Tipo(models.TextChoices):
+        VENTA = "sale", "Venta"
+        REPOSICION = "restock", "Reposición"
+        AJUSTE = "adjustment", "Ajuste"
+        RESERVA = "reservation", "Reserva"
+        LIBERACION = "release", "Liberación de reserva"
+    talla_producto = models.ForeignKey(TallaProducto, on_delete=models.CASCADE, related_name="movimientos")
+    tipo = models.CharField(max_length=12, choices=Tipo.choices)
+    cantidad = models.IntegerField()
+    referencia = models.CharField(max_length=100, blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    plegado = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["talla_producto", "plegado"])]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.cantidad:+d} {self.talla_producto}"
+
+
+class ReservaStock(models.Model):
+    """Unidades de una talla apartadas para un checkout en curso hasta ``expira_en``."""
+    class Estado(models.TextChoices):
+        ACTIVA = "active", "Activa"
+        VENDIDA = "sold", "Vendida"
+        LIBERADA = "released", "Liberada"
+    codigo_carrito = models.CharField(max_length=50, db_index=True)
+    talla_producto = models.ForeignKey(TallaProducto, on_delete=models.CASCADE, related_name="reservas")
+    cantidad = models.PositiveIntegerField()
+    estado = models.CharField(max_length=10, choices=Estado.choices, default=Estado.ACTIVA)
+    creada_en = models.DateTimeField(auto_now_add=True)
+    expira_en = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=["estado", "expira_en"])]
+
+    def __str__(self):
+        return f"{self.cantidad} x {self.talla_producto} ({self.codigo_carrito}, {self.get_estado_display()})"
+
 # Carrito / Pedido (esqueleto funcional)
 class Carrito(models.Model):
     cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name="carritos", null=True, blank=True)
@@ -199,4 +259,74 @@ class ItemPedido(models.Model):
     talla = models.CharField(max_length=20, blank=True)
 
     def __str__(self):
-        return f"Order {self.producto.nombre} - {self.pedido.stripe_checkout_id}"
\ No newline at end of file
+        return f"Order {self.producto.nombre} - {self.pedido.stripe_checkout_id}"
+
+class Tarea(models.Model):
+    """Trabajo pendiente para ``manage.py procesar_tareas`` (ver ``home.tareas``)."""
+    class Estado(models.TextChoices):
+        PENDIENTE = "pending", "Pendiente"
+        EN_CURSO = "running", "En curso"
+        HECHA = "done", "Hecha"
+        FALLIDA = "dead", "Fallida"
+    tipo = models.CharField(max_length=50)
+    datos = models.JSONField(default=dict)
+    estado = models.CharField(max_length=10, choices=Estado.choices, default=Estado.PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    disponible_en = models.DateTimeField(default=timezone.now)
+    bloqueada_hasta = models.DateTimeField(null=True, blank=True)
+    ultimo_error = models.TextField(blank=True)
+    creada_en = models.DateTimeField(auto_now_add=True)
+    actualizada_en = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["estado", "disponible_en"])]
+
+    def __str__(self):
+        return f"{self.tipo} #{self.pk} ({self.get_estado_display()})"
+
+
+class EventoStripe(models.Model):
+    """
+    Evento de Stripe ya recibido. ``evento_id`` descarta las entregas repetidas
+    y ``sesion_pagada`` (solo en el evento que encoló el pedido) que dos
+    eventos distintos de la misma sesión de pago creen dos pedidos.
+    """
+    evento_id = models.CharField(max_length=255, unique=True)
+    tipo = models.CharField(max_length=100)
+    sesion_id = models.CharField(max_length=255, blank=True, db_index=True)
+    sesion_pagada = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    tarea = models.ForeignKey(Tarea, null=True, blank=True, on_delete=models.SET_NULL, related_name="eventos")
+    recibido_en = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.tipo} {self.evento_id}"
+
+
+class CorreoSaliente(models.Model):
+    """Correo pendiente de enviar por ``manage.py enviar_correos`` (ver ``home.correos``)."""
+    class Estado(models.TextChoices):
+        PENDIENTE = "pending", "Pendiente"
+        ENVIANDO = "sending", "Enviando"
+        ENVIADO = "sent", "Enviado"
+        FALLIDO = "dead", "Fallido"
+    pedido = models.ForeignKey(Pedido, null=True, blank=True, on_delete=models.SET_NULL, related_name="correos")
+    destinatario = models.EmailField()
+    asunto = models.CharField(max_length=255)
+    html = models.TextField()
+    estado = models.CharField(max_length=10, choices=Estado.choices, default=Estado.PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    max_intentos = models.PositiveIntegerField(default=5)
+    disponible_en = models.DateTimeField(default=timezone.now)
+    bloqueado_hasta = models.DateTimeField(null=True, blank=True)
+    lote = models.CharField(max_length=32, blank=True, db_index=True)
+    id_mensaje = models.CharField(max_length=255, blank=True)
+    ultimo_error = models.TextField(blank=True)
+    creado_en = models.DateTimeField(auto_now_add=True)
+    enviado_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["estado", "disponible_en"])]
+
+    def __str__(self):
+        return f"{self.asunto} → {self.destinatario} ({self.get_estado_display()})"
@@ -0,0 +1,25 @@
+"""
+Cursores opacos para la paginación por clave (keyset) del catálogo.
+
+El token lleva la clave de ordenación del borde de la página y el sentido,
+firmado para que no se pueda manipular. Uno inválido o caducado se trata
+como si no hubiera cursor (primera página).
+"""
+from django.core import signing
+
+SALT = "home.paginacion"
+
+
+def crear_cursor(clave, hacia_atras=False):
+    return signing.dumps({"k": list(clave), "a": hacia_atras}, salt=SALT, compress=True)
+
+
+def leer_cursor(token):
+    """Devuelve ``(clave, hacia_atras)`` o ``(None, False)`` si el token no vale."""
+    if not token:
+        return None, False
+    try:
+        datos = signing.loads(token, salt=SALT)
+        return tuple(int(v) for v in datos["k"]), bool(datos["a"])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None, False
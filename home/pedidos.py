@@ -0,0 +1,88 @@
+"""
+Creación de los pedidos pagados.
+
+Son las tareas de la cola (``home.tareas``) que encola el webhook de Stripe
+(``home.eventos``) y ejecuta ``manage.py procesar_tareas``. Viven fuera de las
+vistas para que el worker las registre (``HomeConfig.ready``) sin cargarlas.
+"""
+import secrets
+
+from django.db import transaction
+
+from . import carritos, correos, reservas, tareas
+from .models import Carrito, ItemCarrito, ItemPedido, Pedido
+
+
+@tareas.tarea("cumplir_pedido")
+def fulfill_checkout(session, cart_code):
+    """
+    Crea el pedido tras pago exitoso. Lo ejecuta un worker de la cola: si
+    algo falla no queda nada a medias y la tarea se reintenta. Si la sesión ya
+    tiene pedido (un reintento tras un fallo posterior) se devuelve ese.
+    """
+    existente = Pedido.objects.filter(stripe_checkout_id=session["id"]).first()
+    if existente is not None:
+        return existente
+    codigo_seguimiento = secrets.token_urlsafe(8).upper()
+    customer_details = session.get("customer_details")
+    email = None
+    
+    if customer_details and customer_details.get("email"):
+        email = customer_details.get("email")
+    elif session.get("customer_email"):
+        email = session.get("customer_email")
+    if not email:
+        print("⚠️ ALERTA: No se encontró email en la sesión de Stripe.")
+        email = "no-email@found.com"
+
+    # Pedido, venta de las unidades reservadas y vaciado del carrito van juntos
+    with transaction.atomic():
+        order = Pedido.objects.create(
+            stripe_checkout_id=session["id"],
+            cantidad=session["amount_total"] / 100,
+            divisa=session["currency"],
+            cliente_email=email,
+            status="Pagado",
+            codigo_seguimiento=codigo_seguimiento,
+            estado_envio= Pedido.EstadoEnvio.EN_PREPARACION
+        )
+        print("pedido creado")
+
+        # Una sola consulta para las líneas con su carrito y talla; el número
+        # de consultas no crece con el tamaño del pedido
+        items = list(
+            ItemCarrito.objects.filter(carrito__codigo_carrito=cart_code)
+            .select_related("carrito", "talla_producto")
+            .order_by("id")
+        )
+        carrito = items[0].carrito if items else Carrito.objects.filter(codigo_carrito=cart_code).first()
+        if carrito is None:
+            print(f"⚠️ ALERTA: pedido {order.pk} sin carrito {cart_code}")
+        else:
+            ItemPedido.objects.bulk_create([
+                ItemPedido(
+                    pedido=order,
+                    producto_id=item.producto_id,
+                    cantidad=item.cantidad,
+                    talla=item.talla_producto.talla
+                )
+                for item in items
+            ])
+            faltan = reservas.confirmar(
+                cart_code, [(item.talla_producto_id, item.cantidad) for item in items]
+            )
+            if faltan:
+                print(f"⚠️ ALERTA: pedido {order.pk} pagado sin stock suficiente: {faltan}")
+            ItemCarrito.objects.filter(carrito=carrito).delete()
+            carrito.delete()
+            carritos.actualizar(carrito.cliente_id)
+
+        # El correo sale de la bandeja de salida: si Brevo falla se reintenta sin rehacer el pedido
+        correos.encolar_confirmacion(order)
+    return order
+
+
+@tareas.tarea("enviar_correo_pedido")
+def enviar_correo_pedido(pedido_id):
+    # Tareas encoladas antes de la bandeja de salida: el correo pasa a ella
+    correos.encolar_confirmacion(Pedido.objects.get(pk=pedido_id))
@@ -0,0 +1,149 @@
+"""
+Reservas de stock durante el checkout.
+
+Al crear la sesión de pago se apartan las unidades del carrito con un apunte
+de reserva en el libro de inventario (``home.inventario``), que solo se hace
+si las unidades están disponibles: dos compradores nunca se llevan la misma
+unidad, haya los workers que haya. Cada reserva queda en ``ReservaStock`` con
+su caducidad.
+
+El webhook de Stripe convierte las reservas en ventas (``confirmar``) y un
+barrido periódico (``manage.py liberar_reservas``) devuelve al stock las que
+caducaron sin pago. Los cambios de estado de una reserva también son
+condicionales, así que barrido y webhook no pueden aplicar la misma dos veces.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import inventario
+from .models import MovimientoStock, ReservaStock
+
+Tipo = MovimientoStock.Tipo
+
+# Lo que esperamos un webhook que llega tarde antes de liberar una reserva caducada.
+MARGEN = timedelta(minutes=5)
+
+
+class StockInsuficiente(Exception):
+    def __init__(self, talla_producto_id):
+        super().__init__(f"No hay stock suficiente de la talla {talla_producto_id}")
+        self.talla_producto_id = talla_producto_id
+
+
+class ReservaCambiada(Exception):
+    """Otro proceso cambió las reservas del carrito mientras se confirmaban."""
+
+
+def duracion():
+    return timedelta(minutes=getattr(settings, "RESERVA_STOCK_MINUTOS", 30))
+
+
+def _agrupar(lineas):
+    cantidades = defaultdict(int)
+    for talla_producto_id, cantidad in lineas:
+        cantidades[talla_producto_id] += cantidad
+    return cantidades
+
+
+def _cambiar_estado(reserva, desde, hacia):
+    """Transición condicional: True solo para quien la hace efectiva."""
+    return bool(ReservaStock.objects.filter(pk=reserva.pk, estado=desde).update(estado=hacia))
+
+
+def reservar(codigo_carrito, lineas):
+    """
+    Aparta las unidades de ``lineas`` (``[(talla_producto_id, cantidad)]``)
+    para el carrito y devuelve cuándo caducan. Si alguna talla no tiene stock
+    no se reserva nada y se lanza ``StockInsuficiente``. Las reservas activas
+    que ya tuviera el carrito (un checkout repetido) se liberan antes.
+    """
+    expira_en = timezone.now() + duracion()
+    cantidades = _agrupar(lineas)
+    with transaction.atomic():
+        liberar(codigo_carrito)
+        faltan = inventario.retirar_varias(cantidades, Tipo.RESERVA, codigo_carrito)
+        if faltan:
+            # Lo apuntado para las demás tallas se deshace con la transacción
+            raise StockInsuficiente(min(faltan))
+        ReservaStock.objects.bulk_create([
+            ReservaStock(
+                codigo_carrito=codigo_carrito, talla_producto_id=talla_producto_id,
+                cantidad=cantidad, expira_en=expira_en,
+            )
+            for talla_producto_id, cantidad in cantidades.items()
+        ])
+    return expira_en
+
+
+def _soltar(reservas):
+    devueltas = []
+    for reserva in reservas:
+        if _cambiar_estado(reserva, ReservaStock.Estado.ACTIVA, ReservaStock.Estado.LIBERADA):
+            devueltas.append((reserva.talla_producto_id, Tipo.LIBERACION, reserva.cantidad, reserva.codigo_carrito))
+    inventario.apuntar(devueltas)
+    return sum(cantidad for _, _, cantidad, _ in devueltas)
+
+
+def liberar(codigo_carrito):
+    """Devuelve al stock las reservas activas del carrito. Unidades devueltas."""
+    with transaction.atomic():
+        return _soltar(ReservaStock.objects.filter(
+            codigo_carrito=codigo_carrito, estado=ReservaStock.Estado.ACTIVA,
+        ))
+
+
+def liberar_caducadas(ahora=None):
+    """Barrido: devuelve al stock las reservas caducadas sin pagar. Unidades devueltas."""
+    limite = (ahora or timezone.now()) - MARGEN
+    with transaction.atomic():
+        return _soltar(ReservaStock.objects.filter(
+            estado=ReservaStock.Estado.ACTIVA, expira_en__lt=limite,
+        ))
+
+
+def confirmar(codigo_carrito, lineas):
+    """
+    Convierte en venta las reservas del carrito para las ``lineas`` pagadas.
+
+    Cada reserva se apunta como liberada y vendida. Lo que no estuviera
+    reservado (la reserva caducó y se liberó, o el carrito cambió después de
+    empezar el pago) se vende ahora si queda stock, y lo reservado de más
+    vuelve al disponible. Devuelve ``{talla_producto_id: unidades}``
+    que no se pudieron servir: sin ellas no hay sobreventa, pero el pedido
+    está pagado y hay que revisarlo.
+
+    El número de consultas no depende de las líneas del pedido. Si el barrido
+    libera a la vez alguna de las reservas se lanza ``ReservaCambiada`` y no
+    se aplica nada, para que la tarea lo vuelva a intentar.
+    """
+    cantidades = _agrupar(lineas)
+    with transaction.atomic():
+        reservas = list(
+            ReservaStock.objects.select_for_update()
+            .filter(codigo_carrito=codigo_carrito, estado=ReservaStock.Estado.ACTIVA)
+            .values_list("pk", "talla_producto_id", "cantidad")
+        )
+        vendidas = ReservaStock.objects.filter(
+            pk__in=[pk for pk, _, _ in reservas], estado=ReservaStock.Estado.ACTIVA,
+        ).update(estado=ReservaStock.Estado.VENDIDA)
+        if vendidas != len(reservas):
+            raise ReservaCambiada(codigo_carrito)
+        cubiertas = _agrupar((talla_producto_id, cantidad) for _, talla_producto_id, cantidad in reservas)
+
+        apuntes = []
+        for talla_producto_id in sorted(set(cantidades) | set(cubiertas)):
+            pedidas = cantidades.get(talla_producto_id, 0)
+            cubierta = cubiertas.get(talla_producto_id, 0)
+            apuntes.append((talla_producto_id, Tipo.LIBERACION, cubierta, codigo_carrito))
+            apuntes.append((talla_producto_id, Tipo.VENTA, -min(pedidas, cubierta), codigo_carrito))
+        inventario.apuntar(apuntes)
+        restos = {
+            talla_producto_id: pedidas - cubiertas.get(talla_producto_id, 0)
+            for talla_producto_id, pedidas in cantidades.items()
+            if pedidas > cubiertas.get(talla_producto_id, 0)
+        }
+        return inventario.retirar_varias(restos, Tipo.VENTA, codigo_carrito)
@@ -0,0 +1,144 @@
+"""
+Caché de respuestas de ``/autocomplete/`` por prefijo normalizado.
+
+Cada entrada guarda los candidatos exactos de un prefijo (hasta
+MAX_CANDIDATOS, con el texto necesario para volver a filtrarlos). Si un
+prefijo más corto ya tiene su lista completa, la de uno más largo se obtiene
+filtrándola en memoria, sin ir a la BD: al escribir "p", "pi", "pie"... solo
+el primer prefijo con resultados completos consulta la BD. Las entradas se
+expulsan por LRU y se descartan todas cuando cambia la versión del catálogo.
+"""
+import threading
+from collections import OrderedDict
+
+from home import versions
+from home.models import Producto
+
+from . import fts
+from .texto import tokens
+from .trigramas import trigramas_productos
+
+LIMITE = 6
+MAX_CANDIDATOS = 200
+MAX_ENTRADAS = 2048
+
+
+def normalizar(q):
+    return " ".join(tokens(q))
+
+
+def _coincide(palabras_producto, terminos):
+    """Mismo criterio que el índice FTS: cada término es prefijo de alguna palabra."""
+    return all(any(p.startswith(t) for p in palabras_producto) for t in terminos)
+
+
+class CacheAutocompletado:
+    """
+    El cerrojo solo protege ``_entradas``, ``_fichas`` y la versión: las
+    consultas a la BD y a los trigramas de un fallo se hacen fuera, y si dos
+    peticiones calculan la misma clave a la vez se queda la última.
+    """
+
+    def __init__(self, max_entradas=MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()
+        self._version = None
+        self._entradas = OrderedDict()
+        self._fichas = {}
+        self.aciertos = 0
+        self.fallos = 0
+
+    def _comprobar_version(self, version):
+        if version != self._version:
+            self._entradas.clear()
+            self._fichas.clear()
+            self._version = version
+
+    def _hidratar(self, ids):
+        """Fichas (``{pk: ficha}``) de los productos indicados: como mucho 1 consulta."""
+        with self._lock:
+            fichas = {pk: self._fichas[pk] for pk in ids if pk in self._fichas}
+        faltan = [pk for pk in ids if pk not in fichas]
+        if faltan:
+            productos = Producto.objects.filter(pk__in=faltan, esta_disponible=True).values(
+                "id", "nombre", "slug", "precio", "descripcion", "imagen_principal"
+            )
+            for p in productos:
+                fichas[p["id"]] = {
+                    "datos": {
+                        "nombre": p["nombre"],
+                        "slug": p["slug"],
+                        "precio": float(p["precio"]),
+                        "imagen": p["imagen_principal"] or None,
+                    },
+                    "palabras": frozenset(tokens(f'{p["nombre"]} {p["descripcion"]}')),
+                }
+        return fichas
+
+    def _candidatos(self, clave):
+        """(ids exactos, completo, fichas) para ``clave``, de la caché si es posible."""
+        terminos = clave.split()
+        with self._lock:
+            for corte in range(len(clave) - 1, -1, -1):
+                base = self._entradas.get(clave[:corte])
+                if base is not None and base["completo"]:
+                    self._entradas.move_to_end(clave[:corte])
+                    ids = [pk for pk in base["ids"] if _coincide(self._fichas[pk]["palabras"], terminos)]
+                    return ids, True, {pk: self._fichas[pk] for pk in ids}
+
+        disponibles = Producto.objects.filter(esta_disponible=True)
+        ids = list(
+            fts.filtrar(disponibles, clave).values_list("pk", flat=True)[:MAX_CANDIDATOS + 1]
+        )
+        completo = len(ids) <= MAX_CANDIDATOS
+        fichas = self._hidratar(ids[:MAX_CANDIDATOS])
+        return [pk for pk in ids[:MAX_CANDIDATOS] if pk in fichas], completo, fichas
+
+    def autocompletar(self, q):
+        clave = normalizar(q)
+        version = versions.version_catalogo()
+        with self._lock:
+            self._comprobar_version(version)
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada["respuesta"]
+            self.fallos += 1
+
+        ids, completo, fichas = self._candidatos(clave)
+        resultado = ids[:LIMITE]
+        if clave and len(resultado) < LIMITE:
+            # Completar con sugerencias tolerantes a erratas ("peinso" -> "Pienso").
+            extra = [
+                pk for pk in trigramas_productos.sugerir(clave, limite=LIMITE * 2)
+                if pk not in resultado
+            ]
+            fichas.update(self._hidratar(extra))
+            resultado += [pk for pk in extra if pk in fichas][:LIMITE - len(resultado)]
+
+        respuesta = [fichas[pk]["datos"] for pk in resultado]
+        with self._lock:
+            if self._version != version:
+                # El catálogo cambió mientras se calculaba: no se guarda
+                return respuesta
+            # Las fichas entran con la entrada que las usa, por si otra petición
+            # soltó entretanto las que se leyeron de la caché
+            self._fichas.update(fichas)
+            self._entradas[clave] = {
+                "ids": ids, "completo": completo, "resultado": resultado, "respuesta": respuesta,
+            }
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+            if len(self._fichas) > self.max_entradas * MAX_CANDIDATOS:
+                # Soltar las fichas que ya no usa ninguna entrada.
+                en_uso = set()
+                for e in self._entradas.values():
+                    en_uso.update(e["ids"])
+                    en_uso.update(e["resultado"])
+                self._fichas = {pk: f for pk, f in self._fichas.items() if pk in en_uso}
+        return respuesta
+
+
+autocompletado = CacheAutocompletado()
@@ -0,0 +1,91 @@
+"""
+Índice de texto completo sobre Producto (nombre + descripción).
+
+- SQLite: tabla virtual FTS5 ``home_producto_fts`` (rowid = id del producto),
+  mantenida desde las señales de Producto.
+- PostgreSQL: índice GIN sobre ``to_tsvector('spanish', ...)``; no necesita
+  mantenimiento manual.
+- Otros motores: se recurre a ``icontains`` como antes.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+TABLA_FTS = "home_producto_fts"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokens_consulta(q):
+    """Extrae los términos de búsqueda descartando la sintaxis propia de FTS."""
+    return _TOKEN_RE.findall((q or "").lower())
+
+
+def _match_fts5(tokens):
+    # Cada término como prefijo ("pien"*), todos obligatorios.
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def _usa_fts5():
+    return connection.vendor == "sqlite"
+
+
+def filtrar(qs, q):
+    """Filtra un queryset de Producto por la consulta ``q`` usando el índice."""
+    tokens = tokens_consulta(q)
+    if not tokens:
+        return qs
+
+    if _usa_fts5():
+        return qs.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s",
+            [_match_fts5(tokens)],
+        ))
+
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import SearchQuery, SearchVector
+
+        consulta = SearchQuery(
+            " & ".join(f"{t}:*" for t in tokens), search_type="raw", config="spanish"
+        )
+        return qs.annotate(
+            fts=SearchVector("nombre", "descripcion", config="spanish")
+        ).filter(fts=consulta)
+
+    filtro = Q()
+    for t in tokens:
+        filtro &= Q(nombre__icontains=t) | Q(descripcion__icontains=t)
+    return qs.filter(filtro)
+
+
+def indexar(producto):
+    """Inserta o reemplaza la entrada de un producto en el índice FTS5."""
+    if not _usa_fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [producto.pk])
+        cursor.execute(
+            f"INSERT INTO {TABLA_FTS} (rowid, nombre, descripcion) VALUES (%s, %s, %s)",
+            [producto.pk, producto.nombre, producto.descripcion],
+        )
+
+
+def desindexar(producto_id):
+    if not _usa_fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid = %s", [producto_id])
+
+
+def reconstruir():
+    """Vuelve a generar el índice FTS5 completo a partir de Producto."""
+    if not _usa_fts5():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS}")
+        cursor.execute(
+            f"INSERT INTO {TABLA_FTS} (rowid, nombre, descripcion) "
+            "SELECT id, nombre, descripcion FROM home_producto"
+        )
@@ -0,0 +1,175 @@
+"""
+Motor de búsqueda en memoria para el catálogo.
+
+Índice invertido sobre nombre y descripción de los productos disponibles, con
+puntuación BM25F (el nombre pesa más que la descripción). Se construye desde la
+BD la primera vez que se usa y después solo relee los productos que cambian
+(ver ``home.versions``). Las consultas no tocan la BD: devuelven ids ordenados
+por relevancia y solo se hidrata la página que se va a mostrar.
+"""
+import bisect
+import math
+from collections import Counter
+
+from home import versions
+from home.models import Producto
+
+from .texto import terminos
+
+PESOS = {"nombre": 3.0, "descripcion": 1.0}
+K1 = 1.2
+B = 0.75
+# Los términos que solo coinciden por prefijo ("pien" -> "piens") puntúan menos.
+PESO_PREFIJO = 0.5
+MAX_EXPANSIONES = 50
+
+
+class IndiceBusqueda(versions.IndiceVersionado):
+    def _vaciar(self):
+        self._docs = {}
+        self._postings = {}
+        self._vocabulario = []
+        self._longitudes = {campo: 0 for campo in PESOS}
+
+    # ---------- mantenimiento ----------
+
+    def _añadir(self, pk, nombre, descripcion):
+        doc = {}
+        for campo, texto in (("nombre", nombre), ("descripcion", descripcion)):
+            tf = Counter(terminos(texto))
+            doc[campo] = (tf, sum(tf.values()))
+        self._docs[pk] = doc
+        for campo, (tf, longitud) in doc.items():
+            self._longitudes[campo] += longitud
+            for termino in tf:
+                ids = self._postings.get(termino)
+                if ids is None:
+                    ids = self._postings[termino] = set()
+                    bisect.insort(self._vocabulario, termino)
+                ids.add(pk)
+
+    def _quitar(self, pk):
+        doc = self._docs.pop(pk, None)
+        if doc is None:
+            return
+        for campo, (tf, longitud) in doc.items():
+            self._longitudes[campo] -= longitud
+            for termino in tf:
+                ids = self._postings.get(termino)
+                if ids is None:
+                    continue
+                ids.discard(pk)
+                if not ids:
+                    del self._postings[termino]
+                    i = bisect.bisect_left(self._vocabulario, termino)
+                    if i < len(self._vocabulario) and self._vocabulario[i] == termino:
+                        del self._vocabulario[i]
+
+    def _cargar(self, pks):
+        qs = Producto.objects.filter(esta_disponible=True)
+        if pks is not None:
+            qs = qs.filter(pk__in=pks)
+        filas = qs.values_list("id", "nombre", "descripcion").iterator(chunk_size=2000)
+        for pk, nombre, descripcion in filas:
+            self._añadir(pk, nombre, descripcion)
+
+    # ---------- consulta ----------
+
+    def _expandir(self, termino):
+        """Términos del vocabulario que empiezan por ``termino`` (con su peso)."""
+        resultado = {}
+        if termino in self._postings:
+            resultado[termino] = 1.0
+        i = bisect.bisect_left(self._vocabulario, termino)
+        while i < len(self._vocabulario) and len(resultado) < MAX_EXPANSIONES:
+            candidato = self._vocabulario[i]
+            if not candidato.startswith(termino):
+                break
+            resultado.setdefault(candidato, PESO_PREFIJO)
+            i += 1
+        return resultado
+
+    def buscar(self, q):
+        """
+        Devuelve los ids de los productos disponibles que contienen todos los
+        términos de ``q``, del más al menos relevante.
+        """
+        self.sincronizar()
+        consulta = terminos(q)
+        if not consulta:
+            return []
+
+        with self._lock:
+            total = len(self._docs)
+            if not total:
+                return []
+            medias = {c: (self._longitudes[c] / total) or 1.0 for c in PESOS}
+
+            puntuaciones = None
+            for termino in dict.fromkeys(consulta):
+                expansion = self._expandir(termino)
+                parcial = Counter()
+                for variante, factor in expansion.items():
+                    ids = self._postings[variante]
+                    idf = math.log(1 + (total - len(ids) + 0.5) / (len(ids) + 0.5))
+                    for pk in ids:
+                        doc = self._docs[pk]
+                        tf = 0.0
+                        for campo, peso in PESOS.items():
+                            frecuencias, longitud = doc[campo]
+                            frecuencia = frecuencias.get(variante)
+                            if frecuencia:
+                                norma = 1 - B + B * longitud / medias[campo]
+                                tf += peso * frecuencia / norma
+                        puntuacion = factor * idf * tf / (K1 + tf)
+                        if puntuacion > parcial[pk]:
+                            parcial[pk] = puntuacion
+                if puntuaciones is None:
+                    puntuaciones = parcial
+                else:
+                    puntuaciones = Counter({
+                        pk: p + parcial[pk] for pk, p in puntuaciones.items() if pk in parcial
+                    })
+                if not puntuaciones:
+                    return []
+
+        return [pk for pk, _ in sorted(puntuaciones.items(), key=lambda kv: (-kv[1], kv[0]))]
+
+
+class ResultadosOrdenados:
+    """
+    Secuencia de ids ya ordenada que se comporta como una lista de productos
+    para el Paginator: al cortarla solo se consulta la BD para esa página.
+    ``ids`` puede ser una función, que solo se evalúa si hace falta.
+    """
+
+    def __init__(self, ids, queryset):
+        self._ids = ids
+        self.queryset = queryset
+
+    @property
+    def ids(self):
+        if callable(self._ids):
+            self._ids = self._ids()
+        return self._ids
+
+    def hidratar(self, ids):
+        objetos = self.queryset.in_bulk(ids)
+        return [objetos[pk] for pk in ids if pk in objetos]
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return self.hidratar(self.ids[indice])
+        return self[indice:indice + 1][0]
+
+
+buscador = IndiceBusqueda()
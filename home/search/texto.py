@@ -0,0 +1,53 @@
+"""
+Normalización de texto para las búsquedas: minúsculas, sin tildes (la ñ se
+pliega a n), sin palabras vacías y con un stemming ligero para el español que
+solo quita plurales y terminaciones de género.
+"""
+import re
+import unicodedata
+
+_PALABRA_RE = re.compile(r"\w+", re.UNICODE)
+
+VOCALES = "aeiou"
+
+PALABRAS_VACIAS = frozenset("""
+a al con de del el en es la las lo los o para por sin su sus un una unos unas y
+""".split())
+
+
+def plegar(texto):
+    """'Cama Pequeño' -> 'cama pequeno'."""
+    descompuesto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def raiz(palabra):
+    """Stemming ligero: collares -> collar, pequeños/pequeña -> pequen."""
+    if len(palabra) <= 3:
+        return palabra
+    if palabra.endswith("iones"):
+        palabra = palabra[:-2]
+    elif palabra.endswith("es") and len(palabra) > 4 and palabra[-3] not in VOCALES:
+        palabra = palabra[:-2]
+    elif palabra.endswith("s"):
+        palabra = palabra[:-1]
+    if len(palabra) > 3 and palabra[-1] in "aoe":
+        palabra = palabra[:-1]
+    return palabra
+
+
+def tokens(texto):
+    """Todas las palabras plegadas, igual que las trocea el índice FTS5."""
+    return _PALABRA_RE.findall(plegar(texto))
+
+
+def palabras(texto):
+    """Palabras plegadas, sin las vacías ni letras sueltas."""
+    return [
+        p for p in tokens(texto)
+        if p not in PALABRAS_VACIAS and not (len(p) == 1 and not p.isdigit())
+    ]
+
+
+def terminos(texto):
+    return [raiz(p) for p in palabras(texto)]
@@ -0,0 +1,191 @@
+"""
+Índice de trigramas para sugerencias tolerantes a errores de escritura.
+
+Los trigramas se indexan sobre el vocabulario (palabras distintas de los
+nombres de producto, marca y categoría), que es mucho más pequeño que el
+catálogo: cada palabra de la consulta se compara con el vocabulario y después
+se puntúan solo los productos que contienen las palabras parecidas. La
+similitud es la fracción de trigramas de la consulta presentes en la palabra,
+así que también sirve para palabras a medio escribir.
+"""
+import heapq
+import itertools
+import math
+import time
+from collections import Counter
+
+from home import versions
+from home.models import Categoria, Marca, Producto
+
+from .texto import palabras
+
+UMBRAL = 0.4
+# Una palabra de la marca o la categoría cuenta algo menos que una del nombre.
+PESO_RELACIONADO = 0.9
+MAX_VARIANTES = 8
+MAX_PALABRAS = 3
+PRESUPUESTO_MS = 5
+
+
+def trigramas(palabra):
+    """Trigramas con relleno al estilo de pg_trgm: 'gato' -> '  g', ' ga', 'gat', ..."""
+    relleno = f"  {palabra} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+
+class IndiceTrigramas(versions.IndiceVersionado):
+    def _vaciar(self):
+        self._trigramas = {}      # palabra -> trigramas
+        self._postings = {}       # trigrama -> palabras
+        # palabra -> ids de producto, por separado según aparezca en el
+        # nombre o en la marca/categoría (que puntúan con PESO_RELACIONADO).
+        self._en_nombre = {}
+        self._en_relacionado = {}
+        self._docs = {}           # id de producto -> palabras
+        self._marcas = {}
+        self._categorias = {}
+
+    def _añadir_palabra(self, palabra, pk, postings):
+        if palabra not in self._trigramas:
+            tris = self._trigramas[palabra] = trigramas(palabra)
+            for tri in tris:
+                self._postings.setdefault(tri, set()).add(palabra)
+        postings.setdefault(palabra, set()).add(pk)
+
+    def _quitar_palabra(self, palabra, pk):
+        for postings in (self._en_nombre, self._en_relacionado):
+            productos = postings.get(palabra)
+            if productos is not None:
+                productos.discard(pk)
+                if not productos:
+                    del postings[palabra]
+        if palabra in self._en_nombre or palabra in self._en_relacionado:
+            return
+        for tri in self._trigramas.pop(palabra, ()):
+            palabras_tri = self._postings.get(tri)
+            if palabras_tri is not None:
+                palabras_tri.discard(palabra)
+                if not palabras_tri:
+                    del self._postings[tri]
+
+    def _quitar(self, pk):
+        for palabra in self._docs.pop(pk, ()):
+            self._quitar_palabra(palabra, pk)
+
+    def _cargar(self, pks):
+        if pks is None:
+            self._marcas = dict(Marca.objects.values_list("id", "nombre"))
+            self._categorias = dict(Categoria.objects.values_list("id", "nombre"))
+
+        qs = Producto.objects.filter(esta_disponible=True)
+        if pks is not None:
+            qs = qs.filter(pk__in=pks)
+        filas = qs.values_list("id", "nombre", "marca_id", "categoria_id").iterator(chunk_size=2000)
+        for pk, nombre, marca_id, categoria_id in filas:
+            del_nombre = set(palabras(nombre))
+            relacionadas = set(palabras(
+                f"{self._marcas.get(marca_id, '')} {self._categorias.get(categoria_id, '')}"
+            ))
+            self._docs[pk] = del_nombre | relacionadas
+            for palabra in del_nombre:
+                self._añadir_palabra(palabra, pk, self._en_nombre)
+            for palabra in relacionadas:
+                self._añadir_palabra(palabra, pk, self._en_relacionado)
+
+    def _variantes(self, palabra):
+        """Palabras del vocabulario parecidas a ``palabra``: [(palabra, similitud)]."""
+        consulta = trigramas(palabra)
+        ordenados = sorted(consulta, key=lambda t: len(self._postings.get(t, ())))
+        minimo = max(1, math.ceil(UMBRAL * len(ordenados)))
+        # Una palabra que no aparezca en los primeros trigramas (los más raros)
+        # ya no puede llegar al mínimo: el resto solo suma a candidatas conocidas.
+        prefijo = len(ordenados) - minimo + 1
+
+        comunes = Counter()
+        for tri in ordenados[:prefijo]:
+            comunes.update(self._postings.get(tri, ()))
+        for tri in ordenados[prefijo:]:
+            for candidata in comunes:
+                if tri in self._trigramas[candidata]:
+                    comunes[candidata] += 1
+
+        similares = []
+        for candidata, n in comunes.items():
+            if n < minimo:
+                continue
+            # Desempate: palabras de longitud parecida primero.
+            jaccard = n / (len(consulta) + len(self._trigramas[candidata]) - n)
+            similares.append((n / len(consulta), jaccard, candidata))
+        return [(c, s) for s, _, c in heapq.nlargest(MAX_VARIANTES, similares)]
+
+    def _niveles(self, variantes):
+        """
+        Productos que contienen alguna variante de una palabra de la consulta,
+        agrupados por puntuación: [(puntuación, ids)] de mayor a menor, con
+        los grupos disjuntos (cada producto en su mejor nivel).
+        """
+        opciones = []
+        for palabra, similitud in variantes:
+            opciones.append((similitud, self._en_nombre.get(palabra)))
+            opciones.append((similitud * PESO_RELACIONADO, self._en_relacionado.get(palabra)))
+        opciones.sort(key=lambda o: -o[0])
+
+        niveles = []
+        vistos = set()
+        for puntuacion, productos in opciones:
+            if not productos:
+                continue
+            nuevos = productos - vistos
+            if nuevos:
+                niveles.append((puntuacion, nuevos))
+                vistos |= nuevos
+        return niveles
+
+    def sugerir(self, q, limite=6, presupuesto_ms=PRESUPUESTO_MS):
+        """
+        Ids de productos cuyo nombre (o marca/categoría) se parece a ``q``,
+        del más al menos parecido.
+
+        Las puntuaciones por palabra son discretas, así que en lugar de
+        puntuar cada producto se recorren las combinaciones de niveles de
+        mayor a menor puntuación total intersecando sus conjuntos, y se para
+        en cuanto ya no pueden aparecer resultados mejores o se agota el
+        presupuesto de tiempo.
+        """
+        self.sincronizar()
+        consulta = list(dict.fromkeys(palabras(q)))[:MAX_PALABRAS]
+        if not consulta:
+            return []
+        limite_tiempo = time.perf_counter() + presupuesto_ms / 1000
+
+        with self._lock:
+            niveles = [self._niveles(self._variantes(p)) for p in consulta]
+            if not any(niveles):
+                return []
+            # El nivel (0, None) representa "esta palabra no coincide".
+            combinaciones = sorted(
+                itertools.product(*[n + [(0, None)] for n in niveles]),
+                key=lambda c: -sum(p for p, _ in c),
+            )
+
+            resultados = []
+            vistos = set()
+            for combinacion in combinaciones:
+                total = sum(p for p, _ in combinacion) / len(consulta)
+                if total < UMBRAL:
+                    break
+                if len(resultados) >= limite and (
+                    total < resultados[limite - 1][0] or time.perf_counter() > limite_tiempo
+                ):
+                    break
+                conjuntos = sorted((c for _, c in combinacion if c is not None), key=len)
+                comunes = conjuntos[0].intersection(*conjuntos[1:]) - vistos
+                for pk in heapq.nsmallest(limite, comunes):
+                    resultados.append((total, pk))
+                    vistos.add(pk)
+                resultados.sort(key=lambda r: (-r[0], r[1]))
+
+        return [pk for _, pk in resultados[:limite]]
+
+
+trigramas_productos = IndiceTrigramas()
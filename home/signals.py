@@ -0,0 +1,86 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import condicional, fichas, metadatos, stock, versions
+from .models import Categoria, Color, ImagenProducto, Marca, Producto, TallaProducto, nueva_version
+from .search import fts
+
+
+# ============================================
+# ÍNDICES Y CACHÉS DEL CATÁLOGO
+# ============================================
+
+@receiver(post_save, sender=Producto)
+def producto_guardado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Por si se guardó una instancia con los campos desnormalizados antiguos
+    stock.recalcular([instance.pk])
+    fichas.actualizar_imagen_principal([instance.pk])
+    condicional.recordar_slug(instance)
+    fts.indexar(instance)
+    versions.marcar_producto(instance.pk)
+    metadatos.invalidar()
+
+
+@receiver(post_delete, sender=Producto)
+def producto_eliminado(sender, instance, **kwargs):
+    condicional.olvidar_slug(instance)
+    fts.desindexar(instance.pk)
+    versions.marcar_producto(instance.pk)
+    metadatos.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Marca)
+@receiver([post_save, post_delete], sender=Categoria)
+def marca_o_categoria_cambiada(sender, raw=False, **kwargs):
+    if raw:
+        return
+    versions.marcar_catalogo()
+    metadatos.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Color)
+def color_cambiado(sender, raw=False, **kwargs):
+    if raw:
+        return
+    metadatos.invalidar()
+
+
+@receiver([post_save, post_delete], sender=TallaProducto)
+def talla_cambiada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    stock.recalcular([instance.producto_id])
+    versions.marcar_producto(instance.producto_id)
+    # Los destacados se guardan con sus tallas
+    metadatos.invalidar()
+
+
+@receiver([post_save, post_delete], sender=ImagenProducto)
+def imagen_cambiada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fichas.actualizar_imagen_principal([instance.producto_id])
+    versions.marcar_producto(instance.producto_id)
+    metadatos.invalidar()
+
+
+@receiver(m2m_changed, sender=Producto.colores.through)
+def colores_cambiados(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == "pre_clear":
+        # color.productos.clear(): después ya no sabremos qué productos tenía.
+        instance.productos.update(version=nueva_version())
+        return
+    if not action.startswith("post_"):
+        return
+    metadatos.invalidar()
+    if not reverse:
+        Producto.objects.filter(pk=instance.pk).update(version=nueva_version())
+        versions.marcar_producto(instance.pk)
+    elif pk_set:
+        Producto.objects.filter(pk__in=pk_set).update(version=nueva_version())
+        for producto_id in pk_set:
+            versions.marcar_producto(producto_id)
+    else:
+        versions.marcar_catalogo()
@@ -0,0 +1,43 @@
+"""
+Stock total desnormalizado de los productos.
+
+``Producto.stock_total`` es la suma del stock de sus tallas o, si no tiene
+tallas, su propio ``stock``. Se recalcula en la BD con un único UPDATE cada
+vez que cambian las tallas o el producto, dentro de la misma transacción que
+el cambio, para que el catálogo lea una columna indexada en lugar de agrupar
+``TallaProducto`` en cada consulta.
+"""
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Producto, TallaProducto, nueva_version
+
+
+def stock_real():
+    """Expresión con el stock total calculado a partir de las tallas."""
+    suma = (
+        TallaProducto.objects.filter(producto=OuterRef("pk"))
+        .values("producto")
+        .annotate(total=Sum("stock"))
+        .values("total")
+    )
+    return Coalesce(
+        Subquery(suma, output_field=IntegerField()), F("stock"), output_field=IntegerField()
+    )
+
+
+def recalcular(producto_ids=None):
+    """Recalcula ``stock_total`` de los productos indicados (o de todos) y cambia su versión."""
+    qs = Producto.objects.all()
+    if producto_ids is not None:
+        qs = qs.filter(pk__in=producto_ids)
+    return qs.update(stock_total=stock_real(), version=nueva_version())
+
+
+def descuadres():
+    """Productos cuyo ``stock_total`` no coincide con sus tallas: (id, guardado, real)."""
+    return list(
+        Producto.objects.annotate(real=stock_real())
+        .exclude(stock_total=F("real"))
+        .values_list("id", "stock_total", "real")
+    )
@@ -0,0 +1,224 @@
+"""
+Stripe local para pruebas de carga.
+
+``StripeLocal`` es un servidor HTTP en localhost que contesta a
+``POST /v1/checkout/sessions`` como la API de Stripe, así que la librería
+``stripe`` (y ``PasarelaStripe``) funciona contra él con solo cambiar
+``stripe.api_base`` (``STRIPE_API_BASE``). Al pagar una sesión (con
+``pagar()`` o, si se configura, sola tras ``pago_automatico`` segundos) envía el webhook
+``checkout.session.completed`` firmado con el secreto del webhook igual que
+Stripe, y lo reintenta con espera si no recibe un 2xx.
+
+La latencia y la proporción de fallos de la API y el retraso y las entregas
+repetidas de los webhooks se configuran para ver cómo aguanta el embudo de
+compra. ``manage.py stripe_local`` lo arranca solo; ``manage.py prueba_carga``
+lo usa con compradores simulados.
+"""
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+def firmar(payload, secreto, marca=None):
+    """Cabecera ``Stripe-Signature`` de ``payload`` (bytes) con el esquema v1 de Stripe."""
+    marca = int(time.time()) if marca is None else marca
+    firma = hmac.new(secreto.encode(), f"{marca}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={marca},v1={firma}"
+
+
+def entregar_http(url):
+    """Entrega los webhooks con un POST a ``url``; devuelve el código de estado."""
+    def entregar(payload, firma):
+        peticion = urllib.request.Request(
+            url, data=payload, method="POST",
+            headers={"Content-Type": "application/json", "Stripe-Signature": firma},
+        )
+        try:
+            with urllib.request.urlopen(peticion, timeout=30) as respuesta:
+                return respuesta.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return entregar
+
+
+def _anidar(pares):
+    """Deshace la codificación de formularios de la librería: ``a[0][b]=1`` → ``{"a": [{"b": "1"}]}``."""
+    raiz = {}
+    for clave, valor in pares:
+        partes = clave.replace("]", "").split("[")
+        nodo = raiz
+        for parte in partes[:-1]:
+            nodo = nodo.setdefault(parte, {})
+        nodo[partes[-1]] = valor
+    return _listas(raiz)
+
+
+def _listas(nodo):
+    if not isinstance(nodo, dict):
+        return nodo
+    if nodo and all(clave.isdigit() for clave in nodo):
+        return [_listas(nodo[clave]) for clave in sorted(nodo, key=int)]
+    return {clave: _listas(valor) for clave, valor in nodo.items()}
+
+
+class StripeLocal:
+    """
+    ``entregar(payload, firma) -> status`` recibe cada webhook (por ejemplo
+    ``entregar_http(url)``). ``latencia`` y ``fallos`` afectan a la API;
+    ``retraso_webhook`` es lo que tarda Stripe en avisar y ``duplicados`` la
+    probabilidad de entregar dos veces el mismo evento.
+    """
+
+    def __init__(self, secreto, entregar, latencia=0.0, fallos=0.0, retraso_webhook=0.0,
+                 duplicados=0.0, pago_automatico=None, reintentos=5, hilos_webhook=8, puerto=0):
+        self.secreto = secreto
+        self.entregar = entregar
+        self.latencia = latencia
+        self.fallos = fallos
+        self.retraso_webhook = retraso_webhook
+        self.duplicados = duplicados
+        self.pago_automatico = pago_automatico
+        self.reintentos = reintentos
+        self.sesiones = {}
+        self.entregados = 0
+        self.fallidos = 0
+        self._pendientes = 0
+        self._cerrojo = threading.Lock()
+        self._webhooks = ThreadPoolExecutor(max_workers=hilos_webhook)
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), self._manejador())
+        self._servidor.daemon_threads = True
+        self._hilo = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    @property
+    def pendientes(self):
+        """Webhooks de sesiones pagadas que aún no han recibido un 2xx."""
+        with self._cerrojo:
+            return self._pendientes
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+        self._webhooks.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+    # API
+
+    def crear_sesion(self, datos):
+        sesion_id = f"cs_local_{uuid.uuid4().hex}"
+        lineas = datos.get("line_items", [])
+        total = sum(
+            int(linea["price_data"]["unit_amount"]) * int(linea.get("quantity", 1)) for linea in lineas
+        )
+        sesion = {
+            "id": sesion_id,
+            "object": "checkout.session",
+            "amount_total": total,
+            "currency": lineas[0]["price_data"]["currency"] if lineas else "eur",
+            "customer_email": datos.get("customer_email"),
+            "customer_details": None,
+            "metadata": datos.get("metadata", {}),
+            "mode": datos.get("mode", "payment"),
+            "payment_status": "unpaid",
+            "status": "open",
+            "expires_at": int(datos["expires_at"]) if "expires_at" in datos else None,
+            "success_url": datos.get("success_url", ""),
+            "cancel_url": datos.get("cancel_url", ""),
+            "url": datos.get("success_url", "").replace("{CHECKOUT_SESSION_ID}", sesion_id),
+        }
+        with self._cerrojo:
+            self.sesiones[sesion_id] = sesion
+        if self.pago_automatico is not None:
+            threading.Timer(self.pago_automatico, self.pagar, args=[sesion_id]).start()
+        return sesion
+
+    def pagar(self, sesion_id):
+        """Marca la sesión como pagada y envía (en segundo plano) su webhook."""
+        with self._cerrojo:
+            sesion = self.sesiones[sesion_id]
+            sesion.update(status="complete", payment_status="paid")
+            evento = {
+                "id": f"evt_local_{uuid.uuid4().hex}",
+                "object": "event",
+                "type": "checkout.session.completed",
+                "created": int(time.time()),
+                "data": {"object": dict(sesion)},
+            }
+            copias = 2 if random.random() < self.duplicados else 1
+            self._pendientes += copias
+        for _ in range(copias):
+            self._webhooks.submit(self._enviar_webhook, json.dumps(evento).encode())
+
+    def _enviar_webhook(self, payload):
+        if self.retraso_webhook:
+            time.sleep(self.retraso_webhook)
+        entregado = False
+        for intento in range(self.reintentos + 1):
+            try:
+                entregado = 200 <= self.entregar(payload, firmar(payload, self.secreto)) < 300
+            except Exception:
+                entregado = False
+            if entregado:
+                break
+            time.sleep(min(0.1 * 2 ** intento, 5))
+        with self._cerrojo:
+            self._pendientes -= 1
+            if entregado:
+                self.entregados += 1
+            else:
+                self.fallidos += 1
+
+    def _manejador(self):
+        stripe_local = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def responder(self, status, cuerpo, cabeceras=()):
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                for nombre, valor in cabeceras:
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def do_POST(self):
+                longitud = int(self.headers.get("Content-Length") or 0)
+                datos = _anidar(parse_qsl(self.rfile.read(longitud).decode(), keep_blank_values=True))
+                if stripe_local.latencia:
+                    time.sleep(stripe_local.latencia)
+                if self.path.rstrip("/") != "/v1/checkout/sessions":
+                    return self.responder(404, {"error": {"type": "invalid_request_error", "message": "Unrecognized request URL"}})
+                if random.random() < stripe_local.fallos:
+                    return self.responder(
+                        500, {"error": {"type": "api_error", "message": "Fallo simulado de Stripe local"}},
+                        [("Stripe-Should-Retry", "false")],
+                    )
+                self.responder(200, stripe_local.crear_sesion(datos))
+
+        return Manejador
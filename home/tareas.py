@@ -0,0 +1,134 @@
+"""
+Cola de trabajos en la base de datos.
+
+``encolar()`` inserta una ``Tarea`` dentro de la transacción en curso, así que
+el trabajo solo existe si lo que lo originó se confirmó. Los workers
+(``manage.py procesar_tareas``) reclaman tareas con un UPDATE condicional (dos
+workers nunca ejecutan la misma a la vez) y llaman a la función registrada
+para su tipo con ``@tarea("tipo")``.
+
+Si la función lanza una excepción la tarea se reintenta con espera
+exponencial; al agotar ``max_intentos`` queda como fallida (la cola de
+muertos) con el último error, para revisarla desde el admin. Una tarea cuyo
+worker murió a medias vuelve a estar disponible cuando vence su bloqueo, así
+que las funciones deben poder repetirse sin efectos dobles.
+"""
+import logging
+import random
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Tarea
+
+logger = logging.getLogger(__name__)
+
+# Tiempo que un worker tiene una tarea antes de que otro pueda recuperarla.
+BLOQUEO = timedelta(minutes=5)
+ESPERA_BASE = timedelta(seconds=10)
+ESPERA_MAXIMA = timedelta(hours=1)
+
+_funciones = {}
+
+
+def tarea(tipo):
+    """Registra la función que ejecuta las tareas de ``tipo``: ``funcion(**datos)``."""
+    def registrar(funcion):
+        _funciones[tipo] = funcion
+        return funcion
+    return registrar
+
+
+def encolar(tipo, max_intentos=5, **datos):
+    return Tarea.objects.create(tipo=tipo, datos=datos, max_intentos=max_intentos)
+
+
+def espera(intentos):
+    """Espera antes del reintento número ``intentos``: exponencial con algo de azar."""
+    segundos = min(ESPERA_BASE.total_seconds() * 2 ** (intentos - 1), ESPERA_MAXIMA.total_seconds())
+    return timedelta(seconds=segundos * random.uniform(0.75, 1.25))
+
+
+def reclamar(tipos=None):
+    """Marca como en curso la siguiente tarea disponible y la devuelve (o None)."""
+    ahora = timezone.now()
+    disponibles = Tarea.objects.filter(
+        Q(estado=Tarea.Estado.PENDIENTE, disponible_en__lte=ahora)
+        | Q(estado=Tarea.Estado.EN_CURSO, bloqueada_hasta__lt=ahora)
+    )
+    if tipos:
+        disponibles = disponibles.filter(tipo__in=tipos)
+    while True:
+        candidatas = list(
+            disponibles.order_by("disponible_en", "pk").values_list("pk", "estado", "bloqueada_hasta")[:10]
+        )
+        if not candidatas:
+            return None
+        for pk, estado, bloqueada_hasta in candidatas:
+            # Solo uno de los workers que vean la misma candidata consigue el UPDATE
+            reclamada = Tarea.objects.filter(pk=pk, estado=estado, bloqueada_hasta=bloqueada_hasta).update(
+                estado=Tarea.Estado.EN_CURSO,
+                bloqueada_hasta=ahora + BLOQUEO,
+                intentos=F("intentos") + 1,
+                actualizada_en=ahora,
+            )
+            if reclamada:
+                return Tarea.objects.get(pk=pk)
+
+
+def _anotar(pk, **campos):
+    """Guarda el resultado de una tarea insistiendo un poco si la BD está ocupada."""
+    for intento in range(5):
+        try:
+            return Tarea.objects.filter(pk=pk).update(actualizada_en=timezone.now(), **campos)
+        except DatabaseError:
+            if intento == 4:
+                raise
+            time.sleep(0.05 * 2 ** intento)
+
+
+def ejecutar(tarea_):
+    """Ejecuta una tarea ya reclamada y guarda el resultado. True si terminó bien."""
+    funcion = _funciones.get(tarea_.tipo)
+    try:
+        if funcion is None:
+            raise LookupError(f"No hay ninguna función registrada para «{tarea_.tipo}»")
+        with transaction.atomic():
+            funcion(**tarea_.datos)
+    except Exception:
+        error = traceback.format_exc()
+        fallida = tarea_.intentos >= tarea_.max_intentos
+        logger.warning("Tarea %s falló (intento %s/%s)", tarea_, tarea_.intentos, tarea_.max_intentos)
+        _anotar(
+            tarea_.pk,
+            estado=Tarea.Estado.FALLIDA if fallida else Tarea.Estado.PENDIENTE,
+            disponible_en=timezone.now() + espera(tarea_.intentos),
+            bloqueada_hasta=None,
+            ultimo_error=error,
+        )
+        return False
+    _anotar(tarea_.pk, estado=Tarea.Estado.HECHA, bloqueada_hasta=None, ultimo_error="")
+    return True
+
+
+def procesar(maximo=None, tipos=None):
+    """Ejecuta tareas hasta vaciar la cola (o hasta ``maximo``). Devuelve cuántas ejecutó."""
+    hechas = 0
+    while maximo is None or hechas < maximo:
+        siguiente = reclamar(tipos)
+        if siguiente is None:
+            break
+        ejecutar(siguiente)
+        hechas += 1
+    return hechas
+
+
+def reintentar(tarea_ids):
+    """Devuelve a la cola tareas fallidas, con los intentos a cero."""
+    return Tarea.objects.filter(pk__in=tarea_ids, estado=Tarea.Estado.FALLIDA).update(
+        estado=Tarea.Estado.PENDIENTE, intentos=0, disponible_en=timezone.now(), bloqueada_hasta=None,
+    )
@@ -0,0 +1,21 @@
+# home/templatetags/pagina_tags.py
+from django import template
+from django.middleware.csrf import get_token
+from django.utils.html import format_html
+
+from home.middleware import es_visitante_sin_estado
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def csrf_diferido(context):
+    """
+    Como ``{% csrf_token %}``, pero en las páginas que se comparten entre
+    visitantes anónimos deja el valor vacío: lo rellena la cabecera con el
+    token de ``/carrito/resumen.json``, para no guardar el de nadie en la caché.
+    """
+    request = context["request"]
+    if es_visitante_sin_estado(request):
+        return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="" data-csrf-diferido>')
+    return format_html('<input type="hidden" name="csrfmiddlewaretoken" value="{}">', get_token(request))
@@ -13,3 +13,11 @@ def query_transform(context, **kwargs):
     for k, v in kwargs.items():
         query[k] = v
     return query.urlencode()
+
+
+@register.filter
+def get_item(diccionario, clave):
+    """Acceso a un diccionario con una clave variable: {{ conteos|get_item:cat.id }}"""
+    if not diccionario:
+        return None
+    return diccionario.get(clave)
@@ -0,0 +1,16 @@
+# home/templatetags/tarjeta_tags.py
+from django import template
+from django.utils.safestring import mark_safe
+
+from home.fragmentos import fragmentos
+
+register = template.Library()
+
+
+@register.simple_tag
+def tarjeta_producto(producto, plantilla):
+    """
+    Pinta la tarjeta de un producto con ``plantilla`` usando la caché de
+    fragmentos (ver home/fragmentos.py). La plantilla solo recibe ``producto``.
+    """
+    return mark_safe(fragmentos.tarjeta(producto, plantilla))
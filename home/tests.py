@@ -1,9 +1,22 @@
-from django.test import TestCase, Client, override_settings
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.text import slugify
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from decimal import Decimal
 import json
+import threading
+import time
+from io import StringIO
+from unittest.mock import patch
+import stripe
 
 from .models import (
     Cliente,
@@ -17,8 +30,23 @@ from .models import (
     ItemCarrito,
     Pedido,
     ItemPedido,
+    MovimientoStock,
+    ReservaStock,
+    Tarea,
+    EventoStripe,
+    CorreoSaliente,
 )
 from .forms import ClienteRegistrationForm
+from .search.texto import terminos
+from .search.motor import buscador
+from .facetas import facetas, Filtros, ids_de, maximo_tramo, TRAMOS_PRECIO
+from .carritos import ResumenCarrito, fusionar_sesion, lineas_sesion
+from .fragmentos import CacheFragmentos, fragmentos
+from .metadatos import metadatos_catalogo
+from . import checkout, correos, eventos, inventario, reservas, tareas
+from .stripe_local import StripeLocal
+from .pedidos import fulfill_checkout
+from .views import ProductListView
 
 
 User = get_user_model()
@@ -261,6 +289,8 @@ class TestsFormularioRegistro(TestCase):
 @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
 class TestsPaginasBasicas(TestCase):    
     def setUp(self):
+        # La caché de páginas compartidas sobrevive al rollback de cada test
+        cache.clear()
         self.client = Client()
 
     def test_pagina_catalogo_accesible(self):
@@ -721,8 +751,1540 @@ class TestsStripeCheckout(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, "home/success.html")
 
+    def test_success_no_espera_al_webhook(self):
+        with patch("time.sleep") as dormir:
+            resp = self.client.get(reverse("home:success"), {"session_id": "cs_lento"})
+        dormir.assert_not_called()
+        self.assertIsNone(resp.context["pedido"])
+        self.assertContains(resp, reverse("home:pedido_estado") + "?session_id=cs_lento")
+
+    def test_estado_del_pedido_para_la_pagina_de_exito(self):
+        url = reverse("home:pedido_estado")
+        self.assertEqual(self.client.get(url, {"session_id": "cs_estado"}).json(), {"estado": "pendiente"})
+        EventoStripe.objects.create(
+            evento_id="evt_estado", tipo="checkout.session.completed", sesion_id="cs_estado", sesion_pagada="cs_estado",
+        )
+        self.assertEqual(self.client.get(url, {"session_id": "cs_estado"}).json(), {"estado": "procesando"})
+        Pedido.objects.create(stripe_checkout_id="cs_estado", cantidad=Decimal("10.00"), divisa="eur", cliente_email="e@test.com")
+        resp = self.client.get(url, {"session_id": "cs_estado"})
+        self.assertEqual(resp.json(), {"estado": "listo"})
+        self.assertIn("no-store", resp["Cache-Control"])
+        pagina = self.client.get(reverse("home:success"), {"session_id": "cs_estado"})
+        self.assertEqual(pagina.context["pedido"].stripe_checkout_id, "cs_estado")
+        self.assertNotContains(pagina, "pedido-pendiente")
+
     def test_pagina_cancel_accesible(self):
         url = reverse("home:cancel")
         resp = self.client.get(url)
         self.assertEqual(resp.status_code, 200)
         self.assertTemplateUsed(resp, "home/cancel.html")
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsBusquedaTextoCompleto(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.categoria = Categoria.objects.create(nombre="Camas")
+        self.marca = Marca.objects.create(nombre="DormiPet")
+        self.cama = Producto.objects.create(
+            nombre="Cama pequeño",
+            descripcion="Cama acolchada para cachorros",
+            precio=25.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+
+    def test_busqueda_sin_acentos_y_por_prefijo(self):
+        url = reverse("home:catalogo")
+        resp = self.client.get(url, {"q": "pequeno acolch"})
+        self.assertIn(self.cama, list(resp.context["productos"]))
+
+    def test_consulta_solo_con_palabras_vacias_muestra_el_catalogo(self):
+        url = reverse("home:catalogo")
+        for q in ("de", "la", "a", "   "):
+            resp = self.client.get(url, {"q": q})
+            self.assertEqual(list(resp.context["productos"]), [self.cama], q)
+
+    def test_indice_se_actualiza_al_guardar(self):
+        self.cama.nombre = "Cojín viscoelástico"
+        self.cama.save()
+        url = reverse("home:autocomplete")
+        data = json.loads(self.client.get(url, {"q": "cojin"}).content)
+        self.assertEqual([d["slug"] for d in data], [self.cama.slug])
+
+    def test_indice_se_actualiza_al_eliminar(self):
+        self.cama.delete()
+        url = reverse("home:autocomplete")
+        data = json.loads(self.client.get(url, {"q": "cama"}).content)
+        self.assertEqual(data, [])
+
+
+class TestsMotorBusqueda(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.indice = buscador
+        self.categoria = Categoria.objects.create(nombre="Descanso")
+        self.marca = Marca.objects.create(nombre="SleepPet")
+        self.cama = Producto.objects.create(
+            nombre="Cama pequeña",
+            descripcion="Cama de algodón",
+            precio=20.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+        self.manta = Producto.objects.create(
+            nombre="Manta polar",
+            descripcion="Manta ideal para la cama pequeña del gato",
+            precio=10.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+        self.indice.reconstruir()
+
+    def test_normalizacion_y_stemming(self):
+        self.assertEqual(terminos("Camas PEQUEÑOS"), terminos("cama pequeno"))
+        self.assertEqual(terminos("collares"), terminos("collar"))
+
+    def test_relevancia_prioriza_nombre(self):
+        self.assertEqual(self.indice.buscar("cama pequeno"), [self.cama.pk, self.manta.pk])
+
+    def test_prefijo_mientras_se_escribe(self):
+        self.assertEqual(self.indice.buscar("pola"), [self.manta.pk])
+
+    def test_actualizacion_incremental(self):
+        self.indice.buscar("cama")
+        nuevo = Producto.objects.create(
+            nombre="Cama grande",
+            precio=30.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+        self.manta.esta_disponible = False
+        self.manta.save()
+        with self.assertNumQueries(1):
+            ids = self.indice.buscar("cama")
+        self.assertEqual(set(ids), {self.cama.pk, nuevo.pk})
+
+    def test_consulta_sin_cambios_no_toca_bd(self):
+        self.indice.buscar("cama")
+        with self.assertNumQueries(0):
+            self.indice.buscar("manta")
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsAutocompletadoTolerante(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.categoria = Categoria.objects.create(nombre="Alimentación")
+        self.marca = Marca.objects.create(nombre="Whiskas")
+        self.pienso = Producto.objects.create(
+            nombre="Pienso premium",
+            precio=30.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+
+    def _sugerencias(self, q):
+        resp = self.client.get(reverse("home:autocomplete"), {"q": q})
+        return [d["slug"] for d in json.loads(resp.content)]
+
+    def test_errata_en_nombre(self):
+        self.assertEqual(self._sugerencias("peinso"), [self.pienso.slug])
+
+    def test_errata_en_marca(self):
+        self.assertEqual(self._sugerencias("wiskas"), [self.pienso.slug])
+
+    def test_nuevo_producto_sin_reconstruir(self):
+        self._sugerencias("peinso")
+        nuevo = Producto.objects.create(
+            nombre="Pienso senior",
+            precio=28.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+        self.assertIn(nuevo.slug, self._sugerencias("peinso senoir"))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsCacheAutocompletado(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.categoria = Categoria.objects.create(nombre="Comida")
+        self.marca = Marca.objects.create(nombre="Royal")
+        self.pienso = Producto.objects.create(
+            nombre="Pienso cachorro",
+            precio=30.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+        ImagenProducto.objects.create(producto=self.pienso, imagen="https://example.com/p.jpg")
+        self.pelota = Producto.objects.create(
+            nombre="Pelota de goma",
+            precio=5.00,
+            categoria=self.categoria,
+            marca=self.marca,
+        )
+
+    def _autocompletar(self, q):
+        resp = self.client.get(reverse("home:autocomplete"), {"q": q})
+        return json.loads(resp.content)
+
+    def test_prefijo_mas_largo_se_filtra_en_memoria(self):
+        self.assertEqual(len(self._autocompletar("p")), 2)
+        with self.assertNumQueries(0):
+            data = self._autocompletar("Pien")
+        self.assertEqual([d["slug"] for d in data], [self.pienso.slug])
+        self.assertEqual(data[0]["imagen"], "https://example.com/p.jpg")
+
+    def test_mismo_prefijo_sin_consultas(self):
+        self._autocompletar("pelota")
+        with self.assertNumQueries(0):
+            data = self._autocompletar("  PELOTA ")
+        self.assertEqual(data[0]["slug"], self.pelota.slug)
+
+    def test_fallo_consulta_sin_tener_el_cerrojo(self):
+        from .search.autocompletado import autocompletado, trigramas_productos
+
+        bloqueado = []
+
+        def anotar(ejecutar, *args):
+            bloqueado.append(autocompletado._lock.locked())
+            return ejecutar(*args)
+
+        sugerir = trigramas_productos.sugerir
+
+        def sugerir_anotando(*args, **kwargs):
+            bloqueado.append(autocompletado._lock.locked())
+            return sugerir(*args, **kwargs)
+
+        with connection.execute_wrapper(anotar), patch.object(trigramas_productos, "sugerir", sugerir_anotando):
+            self.assertEqual(self._autocompletar("peinso")[0]["slug"], self.pienso.slug)
+        self.assertTrue(bloqueado)
+        self.assertNotIn(True, bloqueado)
+
+    def test_cambio_de_catalogo_invalida(self):
+        self._autocompletar("pe")
+        self.pelota.nombre = "Hueso de goma"
+        self.pelota.save()
+        self.assertEqual([d["slug"] for d in self._autocompletar("pel")], [])
+
+
+class TestsFacetas(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.perros = Categoria.objects.create(nombre="Perros")
+        self.gatos = Categoria.objects.create(nombre="Gatos")
+        self.marca = Marca.objects.create(nombre="Facet")
+        self.rojo = Color.objects.create(nombre="Rojo")
+        self.azul = Color.objects.create(nombre="Azul")
+        self.collar = Producto.objects.create(
+            nombre="Collar", precio=Decimal("9.99"), categoria=self.perros, marca=self.marca,
+            material="cuero",
+        )
+        self.collar.colores.add(self.rojo, self.azul)
+        self.rascador = Producto.objects.create(
+            nombre="Rascador", precio=Decimal("10.00"), categoria=self.gatos, marca=self.marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.rascador, talla="M", stock=0)
+
+    def _filtrar(self, **kwargs):
+        return facetas.filtrar(Filtros(**kwargs))
+
+    def test_conteos_ignoran_la_propia_faceta(self):
+        resultado = self._filtrar(categoria={self.perros.pk})
+        self.assertEqual(ids_de(resultado.bits), [self.collar.pk])
+        self.assertEqual(resultado.conteos["categoria"], {self.perros.pk: 1, self.gatos.pk: 1})
+        self.assertEqual(resultado.conteos["marca"], {self.marca.pk: 1})
+
+    def test_varios_colores_no_duplican(self):
+        resultado = self._filtrar(color={self.rojo.pk, self.azul.pk})
+        self.assertEqual(resultado.total, 1)
+
+    def test_rango_de_precio_exacto(self):
+        resultado = self._filtrar(precio_max=Decimal("9.99"))
+        self.assertEqual(ids_de(resultado.bits), [self.collar.pk])
+        resultado = self._filtrar(precio_min=Decimal("10"))
+        self.assertEqual(ids_de(resultado.bits), [self.rascador.pk])
+
+    def test_enlace_de_cada_tramo_filtra_lo_que_cuenta(self):
+        conteos = self._filtrar().conteos["precio"]
+        for i, (desde, hasta) in enumerate(TRAMOS_PRECIO):
+            resultado = self._filtrar(precio_min=Decimal(desde), precio_max=maximo_tramo(hasta))
+            self.assertEqual(resultado.total, conteos.get(i, 0))
+
+    def test_stock_se_actualiza_con_las_tallas(self):
+        self.assertNotIn(self.rascador.pk, ids_de(self._filtrar(solo_stock=True).bits))
+        self.talla.stock = 3
+        self.talla.save()
+        self.assertIn(self.rascador.pk, ids_de(self._filtrar(solo_stock=True).bits))
+
+    def test_colores_se_actualizan_con_m2m(self):
+        self.rascador.colores.add(self.rojo)
+        resultado = self._filtrar(color={self.rojo.pk})
+        self.assertEqual(resultado.total, 2)
+        self.collar.colores.remove(self.rojo)
+        self.assertEqual(self._filtrar(color={self.rojo.pk}).total, 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsPaginacionCursor(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        categoria = Categoria.objects.create(nombre="Cursor")
+        marca = Marca.objects.create(nombre="Cursor")
+        self.productos = [
+            Producto.objects.create(
+                nombre=f"Producto {i}", precio=Decimal("5.00"), categoria=categoria,
+                marca=marca, orden_categoria=i % 3, orden_catalogo=i,
+            )
+            for i in range(7)
+        ]
+        self.orden = [
+            p.pk for p in sorted(self.productos, key=lambda p: (p.orden_categoria, p.orden_catalogo, p.pk))
+        ]
+
+    def _pagina(self, **params):
+        with patch.object(ProductListView, "paginate_by", 3), \
+                patch.object(ProductListView, "max_paginas_numeradas", 1):
+            return self.client.get(reverse("home:catalogo"), params)
+
+    def test_recorre_el_catalogo_con_cursores(self):
+        vistos = []
+        response = self._pagina()
+        self.assertIsNone(response.context["cursores"]["anterior"])
+        while True:
+            vistos += [p.pk for p in response.context["productos"]]
+            siguiente = response.context["cursores"]["siguiente"]
+            if not siguiente:
+                break
+            response = self._pagina(cursor=siguiente)
+        self.assertEqual(vistos, self.orden)
+        self.assertEqual(response.context["total_productos"], 7)
+
+        anterior = response.context["cursores"]["anterior"]
+        response = self._pagina(cursor=anterior)
+        self.assertEqual([p.pk for p in response.context["productos"]], self.orden[3:6])
+        self.assertIsNotNone(response.context["cursores"]["anterior"])
+
+    def test_cursor_manipulado_vuelve_al_principio(self):
+        response = self._pagina(cursor="no-es-un-cursor")
+        self.assertEqual([p.pk for p in response.context["productos"]], self.orden[:3])
+
+    def test_pocos_resultados_usan_paginas_numeradas(self):
+        response = self.client.get(reverse("home:catalogo"))
+        self.assertIsNone(response.context["cursores"])
+        self.assertEqual(len(response.context["productos"]), 7)
+
+
+class TestsStockTotal(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre="Stock")
+        marca = Marca.objects.create(nombre="Stock")
+        self.producto = Producto.objects.create(
+            nombre="Arnés", precio=Decimal("15.00"), categoria=categoria, marca=marca, stock=4,
+        )
+
+    def _stock_total(self):
+        return Producto.objects.values_list("stock_total", flat=True).get(pk=self.producto.pk)
+
+    def test_sin_tallas_usa_el_stock_del_producto(self):
+        self.assertEqual(self._stock_total(), 4)
+        self.producto.stock = 7
+        self.producto.save()
+        self.assertEqual(self._stock_total(), 7)
+
+    def test_se_mantiene_con_las_tallas(self):
+        talla_s = TallaProducto.objects.create(producto=self.producto, talla="S", stock=2)
+        TallaProducto.objects.create(producto=self.producto, talla="M", stock=3)
+        self.assertEqual(self._stock_total(), 5)
+        talla_s.stock = 10
+        talla_s.save()
+        self.assertEqual(self._stock_total(), 13)
+        talla_s.delete()
+        self.assertEqual(self._stock_total(), 3)
+
+    def test_fulfill_checkout_descuenta_stock_total(self):
+        talla = TallaProducto.objects.create(producto=self.producto, talla="M", stock=5)
+        carrito = Carrito.objects.create()
+        ItemCarrito.objects.create(carrito=carrito, producto=self.producto, talla_producto=talla, cantidad=2)
+        session = {"id": "cs_test_stock", "amount_total": 3000, "currency": "eur", "customer_email": "a@b.com"}
+        fulfill_checkout(session, carrito.codigo_carrito)
+        # La venta queda en el libro de inventario hasta que se compacta
+        self.assertEqual(self._stock_total(), 5)
+        inventario.compactar()
+        self.assertEqual(self._stock_total(), 3)
+
+    def test_comando_detecta_y_corrige_descuadres(self):
+        Producto.objects.filter(pk=self.producto.pk).update(stock_total=99)
+        with self.assertRaises(CommandError):
+            call_command("recalcular_stock", "--comprobar", stdout=StringIO())
+        call_command("recalcular_stock", stdout=StringIO())
+        self.assertEqual(self._stock_total(), 4)
+        call_command("recalcular_stock", "--comprobar", stdout=StringIO())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsFichasProducto(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.categoria = Categoria.objects.create(nombre="Fichas")
+        self.marca = Marca.objects.create(nombre="Fichas")
+
+    def _crear(self, n, destacado=False):
+        for i in range(n):
+            producto = Producto.objects.create(
+                nombre=f"Ficha {destacado} {i}", precio=Decimal("3.00"), categoria=self.categoria,
+                marca=self.marca, es_destacado=destacado,
+            )
+            ImagenProducto.objects.create(producto=producto, imagen=f"https://img.test/{producto.pk}.jpg")
+            TallaProducto.objects.create(producto=producto, talla="S", stock=1)
+            TallaProducto.objects.create(producto=producto, talla="M", stock=0)
+
+    def _consultas_catalogo(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(reverse("home:catalogo"))
+        self.assertEqual(response.status_code, 200)
+        return len(consultas), response
+
+    def test_consultas_no_dependen_del_numero_de_productos(self):
+        self._crear(2)
+        self._crear(1, destacado=True)
+        pocas, _ = self._consultas_catalogo()
+        self._crear(8)
+        self._crear(4, destacado=True)
+        muchas, response = self._consultas_catalogo()
+        self.assertEqual(pocas, muchas)
+        producto = response.context["productos"][0]
+        self.assertEqual(producto.imagen_principal, f"https://img.test/{producto.pk}.jpg")
+        self.assertEqual(
+            [t["talla"] for t in response.context["tallas_data"][str(producto.pk)]], ["S", "M"]
+        )
+
+    def test_prefiere_la_imagen_principal(self):
+        self._crear(1)
+        producto = Producto.objects.get()
+        principal = ImagenProducto.objects.create(
+            producto=producto, imagen="https://img.test/principal.jpg", es_principal=True
+        )
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_principal, "https://img.test/principal.jpg")
+
+        principal.es_principal = False
+        principal.save()
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_principal, f"https://img.test/{producto.pk}.jpg")
+
+        producto.imagenes.all().delete()
+        producto.refresh_from_db()
+        self.assertEqual(producto.imagen_principal, "")
+
+    def test_comando_rellena_la_imagen_principal(self):
+        self._crear(1)
+        Producto.objects.update(imagen_principal="")
+        call_command("rellenar_imagen_principal", stdout=StringIO())
+        producto = Producto.objects.get()
+        self.assertEqual(producto.imagen_principal, f"https://img.test/{producto.pk}.jpg")
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsFragmentosTarjeta(TestCase):
+    def setUp(self):
+        cache.clear()
+        fragmentos.vaciar()
+        self.client = Client()
+        categoria = Categoria.objects.create(nombre="Fragmentos")
+        marca = Marca.objects.create(nombre="Fragmentos")
+        self.producto = Producto.objects.create(
+            nombre="Pelota", precio=Decimal("4.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=10)
+
+    def _catalogo(self):
+        return self.client.get(reverse("home:catalogo")).content.decode()
+
+    def test_segunda_visita_sale_de_cache(self):
+        self._catalogo()
+        self.assertEqual(fragmentos.fallos, 1)
+        user = User.objects.create_user(username="frag", email="frag@test.com", password="x")
+        self.client.force_login(user)
+        self._catalogo()
+        self.assertEqual(fragmentos.aciertos, 1)
+        self.assertEqual(fragmentos.fallos, 1)
+
+    def test_cambio_en_tallas_invalida_la_tarjeta(self):
+        self.assertNotIn("Últimas unidades", self._catalogo())
+        self.talla.stock = 2
+        self.talla.save()
+        self.assertIn("Últimas unidades", self._catalogo())
+
+    def test_cambio_en_imagenes_invalida_la_tarjeta(self):
+        self._catalogo()
+        ImagenProducto.objects.create(producto=self.producto, imagen="https://img.test/pelota.jpg")
+        self.assertIn("https://img.test/pelota.jpg", self._catalogo())
+
+    def test_cambio_en_colores_cambia_la_version(self):
+        version = Producto.objects.get(pk=self.producto.pk).version
+        self.producto.colores.add(Color.objects.create(nombre="Verde"))
+        self.assertNotEqual(Producto.objects.get(pk=self.producto.pk).version, version)
+
+    def test_memoria_acotada(self):
+        plantilla = "home/tarjetas/producto.html"
+        cache_pequeña = CacheFragmentos(max_bytes=len(fragmentos.tarjeta(self.producto, plantilla)))
+        otro = Producto.objects.create(
+            nombre="Hueso", precio=Decimal("2.00"), categoria=self.producto.categoria,
+            marca=self.producto.marca,
+        )
+        for producto in (self.producto, otro):
+            cache_pequeña.tarjeta(producto, plantilla)
+        estadisticas = cache_pequeña.estadisticas()
+        self.assertLessEqual(estadisticas["bytes"], cache_pequeña.max_bytes)
+        self.assertEqual(estadisticas["entradas"], 1)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsMetadatosCatalogo(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.categoria = Categoria.objects.create(nombre="Metadatos")
+        self.marca = Marca.objects.create(nombre="Metadatos")
+        self.producto = Producto.objects.create(
+            nombre="Comedero", precio=Decimal("6.00"), categoria=self.categoria, marca=self.marca,
+            material="acero", es_destacado=True,
+        )
+        TallaProducto.objects.create(producto=self.producto, talla="Única", stock=3)
+
+    def test_pagina_caliente_solo_consulta_los_productos(self):
+        # Con sesión la página no sale de la caché de páginas compartidas
+        session = self.client.session
+        session["cart"] = {}
+        session.save()
+        self.client.get(reverse("home:catalogo"))
+        # Sesión, página de productos y sus tallas
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("home:catalogo"))
+        self.assertEqual(response.context["categorias"], [self.categoria])
+        self.assertEqual(response.context["material"], ["acero"])
+        self.assertEqual(response.context["productos_destacados"], [self.producto])
+
+    def test_se_invalida_con_las_señales(self):
+        metadatos_catalogo()
+        Color.objects.create(nombre="Morado")
+        self.assertEqual([c.nombre for c in metadatos_catalogo()["colores"]], ["Morado"])
+
+        self.producto.es_destacado = False
+        self.producto.save()
+        self.assertEqual(metadatos_catalogo()["destacados"], [])
+
+        Producto.objects.create(
+            nombre="Bebedero", precio=Decimal("6.00"), categoria=self.categoria, marca=self.marca,
+            material="plástico",
+        )
+        self.assertEqual(metadatos_catalogo()["materiales"], ["acero", "plástico"])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsGetCondicional(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        categoria = Categoria.objects.create(nombre="Condicional")
+        marca = Marca.objects.create(nombre="Condicional")
+        self.producto = Producto.objects.create(
+            nombre="Cepillo", precio=Decimal("7.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=5)
+
+    def _revalidar(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_catalogo_sin_cambios_devuelve_304_sin_consultas(self):
+        url = reverse("home:catalogo")
+        response = self.client.get(url)
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._revalidar(url, response).status_code, 304)
+
+        self.talla.stock = 1
+        self.talla.save()
+        self.assertEqual(self._revalidar(url, response).status_code, 200)
+
+    def test_detalle_depende_solo_de_su_producto(self):
+        url = self.producto.get_absolute_url()
+        response = self.client.get(url)
+        otro = Producto.objects.create(
+            nombre="Peine", precio=Decimal("3.00"), categoria=self.producto.categoria,
+            marca=self.producto.marca,
+        )
+        TallaProducto.objects.create(producto=otro, talla="Única", stock=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._revalidar(url, response).status_code, 304)
+
+        ImagenProducto.objects.create(producto=self.producto, imagen="https://img.test/cepillo.jpg")
+        self.assertEqual(self._revalidar(url, response).status_code, 200)
+
+    def test_autocompletado_revalida_por_consulta(self):
+        url = reverse("home:autocomplete")
+        response = self.client.get(url, {"q": "cep"})
+        self.assertEqual(self._revalidar(url, response, q="cep").status_code, 304)
+        self.assertEqual(self._revalidar(url, response, q="pei").status_code, 200)
+
+    def test_validador_distinto_para_cada_usuario(self):
+        url = reverse("home:catalogo")
+        anonimo = self.client.get(url)
+        user = User.objects.create_user(username="cond", email="cond@test.com", password="x")
+        self.client.force_login(user)
+        self.assertEqual(self._revalidar(url, anonimo).status_code, 200)
+        identificado = self.client.get(url)
+        self.assertNotEqual(identificado["ETag"], anonimo["ETag"])
+        self.assertEqual(self._revalidar(url, identificado).status_code, 304)
+
+    def test_volver_a_iniciar_sesion_invalida_la_pagina_con_el_token_viejo(self):
+        url = reverse("home:catalogo")
+        User.objects.create_user(username="rota", email="rota@test.com", password="x")
+        entrar = {"username": "rota", "password": "x"}
+        self.client.post(reverse("home:login"), entrar)
+        vieja = self.client.get(url)
+        self.assertEqual(self._revalidar(url, vieja).status_code, 304)
+        self.client.post(reverse("home:logout"))
+        # El login rota el token CSRF que lleva la página guardada
+        self.client.post(reverse("home:login"), entrar)
+        nueva = self._revalidar(url, vieja)
+        self.assertEqual(nueva.status_code, 200)
+        self.assertNotEqual(nueva["ETag"], vieja["ETag"])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsPaginaCompartida(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        categoria = Categoria.objects.create(nombre="Compartida")
+        marca = Marca.objects.create(nombre="Compartida")
+        self.producto = Producto.objects.create(
+            nombre="Transportín", precio=Decimal("30.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=5)
+
+    def test_anonimos_comparten_la_pagina_sin_ejecutar_la_vista(self):
+        url = self.producto.get_absolute_url()
+        primera = self.client.get(url)
+        self.assertIn("public", primera["Cache-Control"])
+        self.assertIn("Cookie", primera["Vary"])
+        self.assertFalse(primera.cookies)
+        self.assertContains(primera, 'value="" data-csrf-diferido')
+
+        with self.assertNumQueries(0):
+            segunda = Client().get(url)
+        self.assertEqual(segunda.status_code, 200)
+        self.assertEqual(segunda.content, primera.content)
+
+    def test_respuesta_que_pone_cookies_no_se_comparte(self):
+        from django.middleware.csrf import get_token
+        from .views import ProductDetailView
+
+        original = ProductDetailView.get_context_data
+
+        def con_token(vista, **kwargs):
+            get_token(vista.request)
+            return original(vista, **kwargs)
+
+        url = self.producto.get_absolute_url()
+        with patch.object(ProductDetailView, "get_context_data", con_token):
+            primera = self.client.get(url)
+        self.assertTrue(primera.cookies)
+        # La cookie la pone CsrfViewMiddleware al salir: la página no se guarda
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = Client().get(url)
+        self.assertTrue(consultas.captured_queries)
+        self.assertFalse(segunda.cookies)
+
+    def test_cambio_en_el_catalogo_renueva_la_pagina(self):
+        url = self.producto.get_absolute_url()
+        self.client.get(url)
+        self.producto.nombre = "Transportín grande"
+        self.producto.save()
+        self.assertContains(Client().get(url), "Transportín grande")
+
+    def test_usuario_identificado_no_usa_la_cache(self):
+        self.client.get(reverse("home:catalogo"))
+        user = User.objects.create_user(username="compartida", email="c@test.com", password="x")
+        self.client.force_login(user)
+        response = self.client.get(reverse("home:catalogo"))
+        self.assertIn("private", response["Cache-Control"])
+        self.assertContains(response, "@compartida")
+        self.assertNotContains(response, 'value="" data-csrf-diferido')
+
+    def test_resumen_del_carrito(self):
+        session = self.client.session
+        session["cart"] = {f"{self.producto.pk}-{self.talla.pk}": 2}
+        session.save()
+        response = self.client.get(reverse("home:carrito_resumen"))
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(Decimal(data["subtotal"]), Decimal("60.00"))
+        self.assertTrue(data["csrf"])
+        self.assertIn("no-store", response["Cache-Control"])
+
+
+class TestsContadorCarrito(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="contador", email="contador@test.com", password="x")
+        self.client.force_login(self.user)
+        categoria = Categoria.objects.create(nombre="Contador")
+        marca = Marca.objects.create(nombre="Contador")
+        self.producto = Producto.objects.create(
+            nombre="Comedero", precio=Decimal("10.00"), precio_oferta=Decimal("8.00"),
+            categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=10)
+
+    def resumen(self):
+        with CaptureQueriesContext(connection) as consultas:
+            data = json.loads(self.client.get(reverse("home:carrito_resumen")).content)
+        carrito = [q for q in consultas.captured_queries if "home_itemcarrito" in q["sql"]]
+        return data, len(carrito)
+
+    def añadir(self, cantidad):
+        self.client.post(
+            reverse("home:carrito_add", args=[self.producto.pk]),
+            {"talla_producto_id": self.talla.pk, "cantidad": cantidad},
+        )
+
+    def test_lectura_repetida_no_consulta_el_carrito(self):
+        self.añadir(3)
+        data, consultas = self.resumen()
+        self.assertEqual((data["count"], Decimal(data["subtotal"])), (3, Decimal("24.00")))
+        data, consultas = self.resumen()
+        self.assertEqual(data["count"], 3)
+        self.assertEqual(consultas, 0)
+
+    def test_cada_cambio_del_carrito_actualiza_el_contador(self):
+        self.añadir(2)
+        self.assertEqual(self.resumen()[0]["count"], 2)
+        item = ItemCarrito.objects.get(carrito__cliente=self.user)
+        self.client.post(reverse("home:carrito_update", args=[item.pk]), {"action": "increase"})
+        self.assertEqual(self.resumen()[0]["count"], 3)
+        self.client.post(reverse("home:carrito_update", args=[item.pk]), {"action": "decrease"})
+        self.assertEqual(self.resumen()[0]["count"], 2)
+        self.client.post(reverse("home:carrito_remove", args=[item.pk]))
+        self.assertEqual(self.resumen()[0]["count"], 0)
+
+    def test_se_recalcula_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.añadir(1)
+        data, consultas = self.resumen()
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(consultas, 0)
+
+    def test_cambio_de_precio_rehace_el_subtotal(self):
+        self.añadir(2)
+        self.resumen()
+        self.producto.precio_oferta = None
+        self.producto.save()
+        data, _ = self.resumen()
+        self.assertEqual(Decimal(data["subtotal"]), Decimal("20.00"))
+
+    def test_pago_vacia_el_contador(self):
+        self.añadir(2)
+        self.resumen()
+        carrito = Carrito.objects.get(cliente=self.user)
+        session = {
+            "id": "cs_contador", "amount_total": 1600, "currency": "eur",
+            "customer_details": {"email": "contador@test.com"},
+        }
+        fulfill_checkout(session, carrito.codigo_carrito)
+        self.assertEqual(self.resumen()[0]["count"], 0)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsResumenCarrito(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="resumen", email="resumen@test.com", password="x")
+        categoria = Categoria.objects.create(nombre="Resumen")
+        marca = Marca.objects.create(nombre="Resumen")
+        self.carrito = Carrito.objects.create(cliente=self.user)
+        for i, precio in enumerate([Decimal("10.05"), Decimal("3.33"), Decimal("7.10")]):
+            producto = Producto.objects.create(
+                nombre=f"Resumen {i}", precio=precio, categoria=categoria, marca=marca,
+            )
+            talla = TallaProducto.objects.create(producto=producto, talla="Única", stock=10)
+            ItemCarrito.objects.create(carrito=self.carrito, producto=producto, talla_producto=talla, cantidad=i + 1)
+
+    def test_importes_exactos_en_decimal(self):
+        resumen = ResumenCarrito.de_carrito(self.carrito)
+        self.assertEqual(resumen.unidades, 6)
+        self.assertEqual(resumen.subtotal, Decimal("38.01"))
+        self.assertEqual(resumen.iva, Decimal("7.98"))
+        self.assertEqual(resumen.envio, Decimal("4.50"))
+        self.assertEqual(resumen.total, Decimal("50.49"))
+
+    def test_carrito_vacio_no_cobra_envio(self):
+        resumen = ResumenCarrito.de_carrito(None)
+        self.assertEqual((resumen.unidades, resumen.total), (0, Decimal("0.00")))
+
+    def test_lineas_de_stripe(self):
+        lineas = ResumenCarrito.de_carrito(self.carrito).lineas_stripe()
+        importes = [(l["price_data"]["unit_amount"], l["quantity"]) for l in lineas]
+        self.assertEqual(importes, [(1005, 1), (333, 2), (710, 3), (450, 1), (798, 1)])
+
+    def test_una_consulta_para_las_lineas(self):
+        with self.assertNumQueries(1):
+            resumen = ResumenCarrito.de_carrito(self.carrito)
+            for item in resumen.items:
+                item.producto.imagen_principal, item.talla_producto.talla
+
+    def test_pagina_del_carrito_no_depende_del_numero_de_lineas(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as antes:
+            response = self.client.get(reverse("home:carrito"))
+        self.assertEqual(response.context["total"], Decimal("50.49"))
+        producto = Producto.objects.first()
+        otra = TallaProducto.objects.create(producto=producto, talla="XL", stock=3)
+        ItemCarrito.objects.create(carrito=self.carrito, producto=producto, talla_producto=otra, cantidad=1)
+        with CaptureQueriesContext(connection) as despues:
+            self.client.get(reverse("home:carrito"))
+        self.assertEqual(len(antes), len(despues))
+
+
+class TestsCarritoSesionEnLote(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="lote", email="lote@test.com", password="x")
+        categoria = Categoria.objects.create(nombre="Lote")
+        marca = Marca.objects.create(nombre="Lote")
+        self.tallas = []
+        for i in range(8):
+            producto = Producto.objects.create(
+                nombre=f"Lote {i}", precio=Decimal("5.00"), categoria=categoria, marca=marca,
+            )
+            self.tallas.append(TallaProducto.objects.create(producto=producto, talla="Única", stock=20))
+
+    def cart(self, tallas, cantidad=1):
+        return {f"{t.producto_id}-{t.pk}": cantidad for t in tallas}
+
+    def test_lineas_de_sesion_con_una_consulta_por_modelo(self):
+        cart = self.cart(self.tallas)
+        cart["basura"] = 3
+        cart["999-999"] = 1
+        with self.assertNumQueries(2):
+            items = lineas_sesion(cart)
+        self.assertEqual([i["talla_producto"] for i in items], self.tallas)
+
+    def test_fusion_crea_e_incrementa_con_consultas_constantes(self):
+        carrito = Carrito.objects.create(cliente=self.user)
+        for talla in self.tallas[:3]:
+            ItemCarrito.objects.create(carrito=carrito, producto_id=talla.producto_id, talla_producto=talla, cantidad=2)
+
+        with CaptureQueriesContext(connection) as pocas:
+            fusionar_sesion(self.cart(self.tallas[:4], 3), self.user)
+        with CaptureQueriesContext(connection) as muchas:
+            fusionar_sesion(self.cart(self.tallas, 1), self.user)
+        self.assertEqual(len(pocas), len(muchas))
+
+        cantidades = dict(
+            ItemCarrito.objects.filter(carrito=carrito).values_list("talla_producto_id", "cantidad")
+        )
+        esperado = {t.pk: 1 for t in self.tallas}
+        esperado.update({t.pk: 6 for t in self.tallas[:3]})
+        esperado[self.tallas[3].pk] = 4
+        self.assertEqual(cantidades, esperado)
+
+    def test_login_fusiona_y_vacia_la_sesion(self):
+        client = Client()
+        session = client.session
+        session["cart"] = self.cart(self.tallas[:2], 2)
+        session.save()
+        client.post(reverse("home:login"), {"username": "lote", "password": "x"})
+        self.assertEqual(
+            sum(ItemCarrito.objects.filter(carrito__cliente=self.user).values_list("cantidad", flat=True)), 4
+        )
+        self.assertEqual(client.session.get("cart"), {})
+
+
+class TestsReservasStock(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Reservas")
+        marca = Marca.objects.create(nombre="Reservas")
+        self.producto = Producto.objects.create(
+            nombre="Arnés", precio=Decimal("15.00"), categoria=categoria, marca=marca,
+        )
+        self.s = TallaProducto.objects.create(producto=self.producto, talla="S", stock=5)
+        self.m = TallaProducto.objects.create(producto=self.producto, talla="M", stock=1)
+
+    def stock(self, talla):
+        return inventario.disponible(talla.pk)
+
+    def test_reservar_aparta_y_al_compactar_actualiza_stock_total(self):
+        reservas.reservar("CRT-A", [(self.s.pk, 2), (self.m.pk, 1)])
+        self.assertEqual((self.stock(self.s), self.stock(self.m)), (3, 0))
+        self.assertEqual(inventario.compactar(), 2)
+        self.s.refresh_from_db()
+        self.producto.refresh_from_db()
+        self.assertEqual((self.s.stock, self.producto.stock_total), (3, 3))
+        self.assertEqual(ReservaStock.objects.filter(estado=ReservaStock.Estado.ACTIVA).count(), 2)
+
+    def test_sin_stock_no_reserva_nada(self):
+        with self.assertRaises(reservas.StockInsuficiente) as error:
+            reservas.reservar("CRT-A", [(self.s.pk, 2), (self.m.pk, 2)])
+        self.assertEqual(error.exception.talla_producto_id, self.m.pk)
+        self.assertEqual((self.stock(self.s), self.stock(self.m)), (5, 1))
+        self.assertFalse(ReservaStock.objects.exists())
+
+    def test_repetir_checkout_sustituye_la_reserva(self):
+        reservas.reservar("CRT-A", [(self.s.pk, 2)])
+        reservas.reservar("CRT-A", [(self.s.pk, 3)])
+        self.assertEqual(self.stock(self.s), 2)
+
+    def test_confirmar_convierte_en_venta_sin_descontar_otra_vez(self):
+        reservas.reservar("CRT-A", [(self.s.pk, 2)])
+        self.assertEqual(reservas.confirmar("CRT-A", [(self.s.pk, 2)]), {})
+        self.assertEqual(self.stock(self.s), 3)
+        self.assertEqual(ReservaStock.objects.get().estado, ReservaStock.Estado.VENDIDA)
+        # Un webhook repetido no vuelve a vender lo reservado, pero ya no hay reserva que cubra
+        self.assertEqual(reservas.liberar_caducadas(timezone.now() + timedelta(days=1)), 0)
+
+    def test_barrido_devuelve_las_caducadas(self):
+        reservas.reservar("CRT-A", [(self.s.pk, 2)])
+        self.assertEqual(reservas.liberar_caducadas(), 0)
+        despues = timezone.now() + reservas.duracion() + reservas.MARGEN + timedelta(seconds=1)
+        self.assertEqual(reservas.liberar_caducadas(despues), 2)
+        self.assertEqual(reservas.liberar_caducadas(despues), 0)
+        self.assertEqual(self.stock(self.s), 5)
+
+    def test_pago_tras_liberar_descuenta_si_queda_stock(self):
+        reservas.reservar("CRT-A", [(self.m.pk, 1)])
+        reservas.liberar("CRT-A")
+        reservas.reservar("CRT-B", [(self.m.pk, 1)])
+        self.assertEqual(reservas.confirmar("CRT-A", [(self.m.pk, 1)]), {self.m.pk: 1})
+        self.assertEqual(self.stock(self.m), 0)
+
+    def test_checkout_sin_stock_responde_409(self):
+        user = User.objects.create_user(username="reserva", email="reserva@test.com", password="x")
+        carrito = Carrito.objects.create(cliente=user)
+        ItemCarrito.objects.create(carrito=carrito, producto=self.producto, talla_producto=self.m, cantidad=2)
+        response = Client().post(
+            reverse("home:create_checkout_session"), {"cart_code": carrito.codigo_carrito},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stock(self.m), 1)
+
+    def test_checkout_reserva_y_fallo_de_stripe_libera(self):
+        user = User.objects.create_user(username="reserva", email="reserva@test.com", password="x")
+        carrito = Carrito.objects.create(cliente=user)
+        ItemCarrito.objects.create(carrito=carrito, producto=self.producto, talla_producto=self.s, cantidad=2)
+        url = reverse("home:create_checkout_session")
+        datos = {"cart_code": carrito.codigo_carrito}
+        with patch("home.views.stripe.checkout.Session.create", return_value={"id": "cs_reserva", "url": "https://pago"}) as crear:
+            self.assertEqual(Client().post(url, datos, content_type="application/json").status_code, 200)
+        self.assertIn("expires_at", crear.call_args.kwargs)
+        self.assertEqual(self.stock(self.s), 3)
+        with patch("home.views.stripe.checkout.Session.create", side_effect=RuntimeError("caído")):
+            self.assertEqual(Client().post(url, datos, content_type="application/json").status_code, 400)
+        self.assertEqual(self.stock(self.s), 5)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsServicioCheckout(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Checkout")
+        marca = Marca.objects.create(nombre="Checkout")
+        self.tallas = []
+        for i in range(10):
+            producto = Producto.objects.create(
+                nombre=f"Juguete {i}", precio=Decimal("4.00"), categoria=categoria, marca=marca,
+            )
+            self.tallas.append(TallaProducto.objects.create(producto=producto, talla="U", stock=5))
+        self.pasarela = checkout.PasarelaFalsa()
+        anterior = checkout.usar_pasarela(self.pasarela)
+        self.addCleanup(checkout.usar_pasarela, anterior)
+
+    def carrito(self, tallas):
+        carrito = Carrito.objects.create()
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto_id=talla.producto_id, talla_producto=talla, cantidad=1)
+            for talla in tallas
+        ])
+        return carrito
+
+    def pagar(self, carrito):
+        return Client().post(
+            reverse("home:create_checkout_session"), {"cart_code": carrito.codigo_carrito, "email": "c@test.com"},
+            content_type="application/json",
+        )
+
+    def test_sesion_con_la_pasarela_falsa(self):
+        carrito = self.carrito(self.tallas[:2])
+        respuesta = self.pagar(carrito)
+        self.assertEqual(respuesta.status_code, 200)
+        sesion_id = respuesta.json()["data"]["id"]
+        self.assertTrue(respuesta.json()["data"]["url"].endswith(f"/success/?session_id={sesion_id}"))
+        sesion = self.pasarela.sesiones[sesion_id]
+        self.assertEqual((sesion["cart_code"], sesion["email"]), (carrito.codigo_carrito, "c@test.com"))
+        # Dos productos, el envío y el IVA
+        self.assertEqual(len(sesion["line_items"]), 4)
+        self.assertEqual(inventario.disponible(self.tallas[0].pk), 4)
+
+    def test_consultas_no_dependen_del_tamano_del_carrito(self):
+        pequeno, grande = self.carrito(self.tallas[:1]), self.carrito(self.tallas)
+        with CaptureQueriesContext(connection) as una:
+            checkout.iniciar_pago(pequeno.codigo_carrito, None, "http://t/ok", "http://t/no")
+        with CaptureQueriesContext(connection) as diez:
+            checkout.iniciar_pago(grande.codigo_carrito, None, "http://t/ok", "http://t/no")
+        self.assertEqual(len(una), len(diez))
+
+    def test_carrito_vacio_o_inexistente(self):
+        self.assertEqual(self.pagar(Carrito.objects.create()).status_code, 400)
+        respuesta = Client().post(
+            reverse("home:create_checkout_session"), {"cart_code": "no-existe"}, content_type="application/json",
+        )
+        self.assertEqual(respuesta.status_code, 404)
+        self.assertEqual(self.pasarela.sesiones, {})
+
+    def test_fallo_de_la_pasarela_libera_la_reserva(self):
+        carrito = self.carrito(self.tallas[:1])
+        with patch.object(self.pasarela, "crear_sesion", side_effect=ConnectionError("caída")):
+            with self.assertRaises(checkout.ErrorCheckout) as error:
+                checkout.iniciar_pago(carrito.codigo_carrito, None, "http://t/ok", "http://t/no")
+        self.assertEqual(error.exception.status, 400)
+        self.assertEqual(inventario.disponible(self.tallas[0].pk), 5)
+
+    def test_compra_invitado_llama_al_servicio_directamente(self):
+        cliente = Client()
+        sesion = cliente.session
+        sesion["cart"] = {f"{self.tallas[0].producto_id}-{self.tallas[0].pk}": 2}
+        sesion.save()
+        with patch("home.views.create_checkout_session") as vista:
+            respuesta = cliente.get(reverse("home:guestBuy"))
+        vista.assert_not_called()
+        self.assertEqual(respuesta.status_code, 302)
+        sesion_id, = self.pasarela.sesiones
+        self.assertTrue(respuesta["Location"].endswith(f"/success/?session_id={sesion_id}"))
+        self.assertEqual(inventario.disponible(self.tallas[0].pk), 3)
+
+
+class TestsStripeLocal(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Local")
+        marca = Marca.objects.create(nombre="Local")
+        producto = Producto.objects.create(nombre="Cama", precio=Decimal("20.00"), categoria=categoria, marca=marca)
+        self.talla = TallaProducto.objects.create(producto=producto, talla="XL", stock=3)
+        self.carrito = Carrito.objects.create()
+        ItemCarrito.objects.create(carrito=self.carrito, producto=producto, talla_producto=self.talla, cantidad=2)
+        self.webhooks = []
+        self.local = StripeLocal("whsec_prueba", lambda payload, firma: self.webhooks.append((payload, firma)) or 200)
+        self.local.iniciar()
+        self.addCleanup(self.local.parar)
+        anteriores = stripe.api_base, stripe.api_key
+        stripe.api_base, stripe.api_key = self.local.url, "sk_test_local"
+        self.addCleanup(lambda: setattr(stripe, "api_base", anteriores[0]) or setattr(stripe, "api_key", anteriores[1]))
+        anterior = checkout.usar_pasarela(checkout.PasarelaStripe())
+        self.addCleanup(checkout.usar_pasarela, anterior)
+
+    def esperar_webhooks(self):
+        limite = time.monotonic() + 5
+        while self.local.pendientes and time.monotonic() < limite:
+            time.sleep(0.01)
+
+    def test_la_libreria_de_stripe_crea_sesiones_y_el_webhook_va_firmado(self):
+        sesion = checkout.iniciar_pago(
+            self.carrito.codigo_carrito, "c@test.com", "http://t/success/?session_id={CHECKOUT_SESSION_ID}", "http://t/no",
+        )
+        self.assertTrue(sesion.id.startswith("cs_local_"))
+        self.assertEqual(sesion.url, f"http://t/success/?session_id={sesion.id}")
+        creada = self.local.sesiones[sesion.id]
+        # 2 × 20 € + 4,50 € de envío + 8,40 € de IVA
+        self.assertEqual(creada["amount_total"], 5290)
+        self.assertEqual(creada["metadata"], {"cart_code": self.carrito.codigo_carrito})
+
+        self.local.pagar(sesion.id)
+        self.esperar_webhooks()
+        (payload, firma), = self.webhooks
+        evento = stripe.Webhook.construct_event(payload, firma, "whsec_prueba")
+        self.assertEqual(evento["type"], "checkout.session.completed")
+        self.assertEqual(evento["data"]["object"]["id"], sesion.id)
+        with self.assertRaises(stripe.error.SignatureVerificationError):
+            stripe.Webhook.construct_event(payload, firma, "whsec_otro")
+
+    def test_fallos_simulados_liberan_la_reserva(self):
+        self.local.fallos = 1.0
+        with self.assertRaises(checkout.ErrorCheckout):
+            checkout.iniciar_pago(self.carrito.codigo_carrito, None, "http://t/ok", "http://t/no")
+        self.assertEqual(inventario.disponible(self.talla.pk), 3)
+
+    def test_webhook_rechazado_se_reintenta(self):
+        respuestas = iter([500, 200])
+        self.local.entregar = lambda payload, firma: next(respuestas)
+        sesion = checkout.iniciar_pago(self.carrito.codigo_carrito, None, "http://t/ok", "http://t/no")
+        self.local.pagar(sesion.id)
+        self.esperar_webhooks()
+        self.assertEqual((self.local.entregados, self.local.fallidos), (1, 0))
+
+
+class TestsPedidoEnLote(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Lote")
+        marca = Marca.objects.create(nombre="Lote")
+        self.tallas = []
+        for i in range(20):
+            producto = Producto.objects.create(
+                nombre=f"Pienso {i}", precio=Decimal("5.00"), categoria=categoria, marca=marca,
+            )
+            self.tallas.append(TallaProducto.objects.create(producto=producto, talla="2kg", stock=3))
+
+    def pagar(self, tallas, reservar=True):
+        carrito = Carrito.objects.create()
+        ItemCarrito.objects.bulk_create([
+            ItemCarrito(carrito=carrito, producto_id=talla.producto_id, talla_producto=talla, cantidad=2)
+            for talla in tallas
+        ])
+        if reservar:
+            reservas.reservar(carrito.codigo_carrito, [(talla.pk, 2) for talla in tallas])
+        session = {
+            "id": f"cs_{carrito.codigo_carrito}", "amount_total": 1000, "currency": "eur",
+            "customer_email": "lote@test.com",
+        }
+        with CaptureQueriesContext(connection) as consultas:
+            pedido = fulfill_checkout(session, carrito.codigo_carrito)
+        return pedido, len(consultas)
+
+    def test_consultas_no_dependen_del_tamano_del_pedido(self):
+        _, una = self.pagar(self.tallas[:1])
+        pedido, veinte = self.pagar(self.tallas[1:])
+        self.assertEqual(una, veinte)
+        self.assertEqual(pedido.pedido_items.count(), 19)
+        self.assertEqual(inventario.disponible(self.tallas[1].pk), 1)
+
+    def test_sin_reserva_vende_lo_que_queda_sin_sobreventa(self):
+        inventario.ajustar(self.tallas[1].pk, 1)
+        pedido, _ = self.pagar(self.tallas[:2], reservar=False)
+        self.assertEqual(pedido.pedido_items.count(), 2)
+        self.assertEqual([inventario.disponible(t.pk) for t in self.tallas[:2]], [1, 1])
+
+    def test_reserva_liberada_a_la_vez_reintenta_la_tarea(self):
+        carrito = Carrito.objects.create()
+        reservas.reservar(carrito.codigo_carrito, [(self.tallas[0].pk, 2)])
+        filtro_original = ReservaStock.objects.filter
+
+        def liberar_antes(*args, **kwargs):
+            # El barrido se cuela entre la lectura y el cambio de estado
+            if "pk__in" in kwargs:
+                ReservaStock.objects.update(estado=ReservaStock.Estado.LIBERADA)
+            return filtro_original(*args, **kwargs)
+
+        with patch.object(ReservaStock.objects, "filter", side_effect=liberar_antes):
+            with self.assertRaises(reservas.ReservaCambiada):
+                reservas.confirmar(carrito.codigo_carrito, [(self.tallas[0].pk, 2)])
+
+    def test_comando_de_medicion_no_deja_datos(self):
+        salida = StringIO()
+        call_command("medir_pedidos", "--lineas", "1", "3", "--repeticiones", "1", stdout=salida)
+        filas = [linea.split() for linea in salida.getvalue().splitlines() if linea.split()[0].isdigit()]
+        self.assertEqual([fila[0] for fila in filas], ["1", "3"])
+        self.assertEqual(filas[0][1], filas[1][1])
+        self.assertFalse(Producto.objects.filter(nombre__startswith="Medición").exists())
+
+
+def intentar(funcion, *args):
+    """
+    Llama a ``funcion`` desde un hilo de prueba, reintentando mientras SQLite
+    tenga la BD bloqueada por otra escritura (como haría un worker o Stripe).
+    """
+    for _ in range(200):
+        try:
+            return funcion(*args)
+        except OperationalError:
+            time.sleep(0.01)
+        finally:
+            connection.close()
+    raise AssertionError("la BD no dejó de estar bloqueada")
+
+
+class TestsReservasConcurrentes(TransactionTestCase):
+    """Muchos compradores a la vez sobre la misma talla: nunca se vende más de lo que hay."""
+
+    COMPRADORES = 40
+    HILOS = 8
+
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Concurrencia")
+        marca = Marca.objects.create(nombre="Concurrencia")
+        producto = Producto.objects.create(
+            nombre="Pelota", precio=Decimal("3.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=producto, talla="Única", stock=10)
+
+    def comprar(self, i):
+        try:
+            intentar(reservas.reservar, f"CRT-{i}", [(self.talla.pk, 1)])
+        except reservas.StockInsuficiente:
+            return False
+        return True
+
+    def test_no_hay_sobreventa(self):
+        with ThreadPoolExecutor(self.HILOS) as pool:
+            resultados = list(pool.map(self.comprar, range(self.COMPRADORES)))
+        self.assertEqual(sum(resultados), 10)
+        self.assertEqual(inventario.disponible(self.talla.pk), 0)
+        self.assertEqual(ReservaStock.objects.filter(estado=ReservaStock.Estado.ACTIVA).count(), 10)
+
+        # Barrido y webhooks compitiendo por las mismas reservas: cada una se aplica una vez.
+        ganadores = [i for i, ok in enumerate(resultados) if ok]
+        despues = timezone.now() + timedelta(days=1)
+        with ThreadPoolExecutor(self.HILOS) as pool:
+            barridos = [pool.submit(intentar, reservas.liberar_caducadas, despues) for _ in range(4)]
+            pagos = [
+                pool.submit(intentar, reservas.confirmar, f"CRT-{i}", [(self.talla.pk, 1)])
+                for i in ganadores
+            ]
+            faltan = [sum(pago.result().values()) for pago in pagos]
+            devueltas = sum(barrido.result() for barrido in barridos)
+        servidas = len(ganadores) - sum(faltan)
+        self.assertEqual(inventario.disponible(self.talla.pk) + servidas, 10)
+        intentar(inventario.compactar)
+        self.talla.refresh_from_db()
+        self.assertEqual(self.talla.stock + servidas, 10)
+        self.assertEqual(
+            ReservaStock.objects.filter(estado=ReservaStock.Estado.LIBERADA).count(), devueltas
+        )
+        self.assertFalse(ReservaStock.objects.filter(estado=ReservaStock.Estado.ACTIVA).exists())
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class TestsLibroInventario(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Libro")
+        marca = Marca.objects.create(nombre="Libro")
+        self.producto = Producto.objects.create(
+            nombre="Rascador", precio=Decimal("40.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=4)
+
+    def test_venta_queda_en_el_historial(self):
+        reservas.reservar("CRT-L", [(self.talla.pk, 3)])
+        reservas.confirmar("CRT-L", [(self.talla.pk, 3)])
+        tipos = list(MovimientoStock.objects.order_by("pk").values_list("tipo", "cantidad"))
+        self.assertEqual(tipos, [
+            (MovimientoStock.Tipo.RESERVA, -3),
+            (MovimientoStock.Tipo.LIBERACION, 3),
+            (MovimientoStock.Tipo.VENTA, -3),
+        ])
+        self.assertEqual(inventario.disponible(self.talla.pk), 1)
+
+    def test_compactar_pliega_una_vez_y_conserva_los_apuntes(self):
+        inventario.apuntar([(self.talla.pk, MovimientoStock.Tipo.REPOSICION, 6, "albarán 7")])
+        self.assertTrue(inventario.retirar(self.talla.pk, 2, MovimientoStock.Tipo.VENTA))
+        self.assertFalse(inventario.retirar(self.talla.pk, 9, MovimientoStock.Tipo.VENTA))
+        self.assertEqual(inventario.compactar(), 2)
+        self.assertEqual(inventario.compactar(), 0)
+        self.talla.refresh_from_db()
+        self.assertEqual((self.talla.stock, inventario.disponible(self.talla.pk)), (8, 8))
+        self.assertEqual(MovimientoStock.objects.filter(plegado=True).count(), 2)
+
+    def test_cambio_de_stock_en_el_admin_es_un_ajuste(self):
+        admin = User.objects.create_superuser(username="admin", email="admin@test.com", password="x")
+        client = Client()
+        client.force_login(admin)
+        reservas.reservar("CRT-L", [(self.talla.pk, 1)])
+        url = reverse("admin:home_producto_change", args=[self.producto.pk])
+        response = client.get(url)
+        datos = {}
+        for nombre, valor in response.context["adminform"].form.initial.items():
+            if valor is None or isinstance(valor, list):
+                continue
+            datos[nombre] = getattr(valor, "pk", valor)
+        for formset in response.context["inline_admin_formsets"]:
+            gestion = formset.formset.management_form
+            for campo in gestion:
+                datos[campo.html_name] = campo.value()
+            for form in formset.formset.forms:
+                for campo in form:
+                    if campo.value() is not None:
+                        datos[campo.html_name] = campo.value()
+        talla_form = next(
+            f.formset for f in response.context["inline_admin_formsets"] if f.formset.model is TallaProducto
+        )
+        # Se muestra la base (4) aunque haya una unidad reservada: pasar a 10 suma 6
+        self.assertEqual(datos[f"{talla_form.prefix}-0-stock"], 4)
+        datos[f"{talla_form.prefix}-0-stock"] = 10
+        response = client.post(url, datos)
+        self.assertEqual(response.status_code, 302)
+
+        self.talla.refresh_from_db()
+        self.assertEqual(self.talla.stock, 4)
+        self.assertEqual(inventario.disponible(self.talla.pk), 9)
+        ajuste = MovimientoStock.objects.get(tipo=MovimientoStock.Tipo.AJUSTE)
+        self.assertEqual((ajuste.cantidad, ajuste.referencia), (6, "admin:admin"))
+
+        # Volver a guardar sin tocarlo no apunta nada; la reserva sigue contando
+        response = client.post(url, {**datos, f"{talla_form.prefix}-0-stock": 4})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(MovimientoStock.objects.filter(tipo=MovimientoStock.Tipo.AJUSTE).count(), 1)
+        self.assertEqual(inventario.disponible(self.talla.pk), 9)
+
+
+class TestsColaTareas(TestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Cola")
+        marca = Marca.objects.create(nombre="Cola")
+        self.producto = Producto.objects.create(
+            nombre="Collar", precio=Decimal("12.00"), categoria=categoria, marca=marca,
+        )
+        self.talla = TallaProducto.objects.create(producto=self.producto, talla="Única", stock=5)
+        self.carrito = Carrito.objects.create()
+        ItemCarrito.objects.create(carrito=self.carrito, producto=self.producto, talla_producto=self.talla, cantidad=2)
+        self.session = {
+            "id": "cs_cola", "amount_total": 2400, "currency": "eur",
+            "customer_email": "cola@test.com", "metadata": {"cart_code": self.carrito.codigo_carrito},
+        }
+
+    def webhook(self, evento_id="evt_cola", tipo="checkout.session.completed"):
+        evento = {"id": evento_id, "type": tipo, "data": {"object": self.session}}
+        with patch("home.views.stripe.Webhook.construct_event", return_value=evento):
+            return Client().post(
+                reverse("home:webhook"), json.dumps(evento),
+                content_type="application/json", HTTP_STRIPE_SIGNATURE="t=1,v1=x",
+            )
+
+    def test_webhook_solo_encola(self):
+        response = self.webhook()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Pedido.objects.exists())
+        self.assertFalse(CorreoSaliente.objects.exists())
+        tarea = Tarea.objects.get()
+        self.assertEqual((tarea.tipo, tarea.datos["cart_code"]), ("cumplir_pedido", self.carrito.codigo_carrito))
+
+    def test_worker_crea_el_pedido_y_deja_el_correo_en_la_bandeja(self):
+        self.webhook()
+        self.assertEqual(tareas.procesar(), 1)
+        pedido = Pedido.objects.get()
+        self.assertEqual(pedido.pedido_items.count(), 1)
+        self.assertFalse(Carrito.objects.filter(pk=self.carrito.pk).exists())
+        self.assertEqual(Tarea.objects.get().estado, Tarea.Estado.HECHA)
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual((correo.pedido, correo.destinatario), (pedido, "cola@test.com"))
+        self.assertEqual(correo.estado, CorreoSaliente.Estado.PENDIENTE)
+
+    def test_tarea_de_correo_antigua_pasa_a_la_bandeja(self):
+        self.webhook()
+        tareas.procesar()
+        CorreoSaliente.objects.all().delete()
+        tareas.encolar("enviar_correo_pedido", pedido_id=Pedido.objects.get().pk)
+        self.assertEqual(tareas.procesar(), 1)
+        self.assertEqual(CorreoSaliente.objects.count(), 1)
+
+    def test_pedido_fallido_no_deja_nada_a_medias(self):
+        self.webhook()
+        with patch("home.pedidos.reservas.confirmar", side_effect=RuntimeError("BD caída")):
+            tareas.procesar()
+        self.assertFalse(Pedido.objects.exists())
+        self.assertTrue(Carrito.objects.filter(pk=self.carrito.pk).exists())
+        self.assertEqual(Tarea.objects.get().estado, Tarea.Estado.PENDIENTE)
+
+    def test_evento_repetido_no_vuelve_a_encolar(self):
+        for _ in range(3):
+            self.assertEqual(self.webhook().status_code, 200)
+        self.assertEqual(Tarea.objects.count(), 1)
+        self.assertEqual(EventoStripe.objects.get().tarea, Tarea.objects.get())
+
+    def test_segundo_evento_de_pago_de_la_sesion_solo_se_registra(self):
+        self.webhook()
+        self.webhook("evt_asincrono", "checkout.session.async_payment_succeeded")
+        self.assertEqual(EventoStripe.objects.filter(sesion_id="cs_cola").count(), 2)
+        tareas.procesar()
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_cumplir_pedido_repetido_devuelve_el_mismo_pedido(self):
+        self.webhook()
+        tareas.procesar()
+        pedido = Pedido.objects.get()
+        # Un worker que murió tras confirmar vuelve a ejecutar la tarea
+        tarea = Tarea.objects.get(tipo="cumplir_pedido")
+        self.assertTrue(tareas.ejecutar(tarea))
+        self.assertEqual(Pedido.objects.get(), pedido)
+        self.assertEqual(CorreoSaliente.objects.count(), 1)
+
+    def test_una_tarea_reclamada_no_la_coge_otro_worker(self):
+        tareas.encolar("no_existe")
+        primera = tareas.reclamar()
+        self.assertIsNotNone(primera)
+        self.assertIsNone(tareas.reclamar())
+        # Si el worker muere, se recupera al vencer el bloqueo
+        Tarea.objects.filter(pk=primera.pk).update(bloqueada_hasta=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(tareas.reclamar().pk, primera.pk)
+
+
+class TestsBandejaSalida(TestCase):
+    def setUp(self):
+        categoria = Categoria.objects.create(nombre="Correo")
+        marca = Marca.objects.create(nombre="Correo")
+        producto = Producto.objects.create(nombre="Rascador", precio=Decimal("30.00"), categoria=categoria, marca=marca)
+        self.pedido = Pedido.objects.create(
+            stripe_checkout_id="cs_correo", cantidad=Decimal("30.00"), divisa="eur", cliente_email="correo@test.com",
+        )
+        ItemPedido.objects.create(pedido=self.pedido, producto=producto, cantidad=1, talla="L")
+        self.falso = correos.TransporteFalso()
+        anterior = correos.usar_transporte(self.falso)
+        self.addCleanup(correos.usar_transporte, anterior)
+
+    def bandeja(self, n):
+        return [
+            CorreoSaliente.objects.create(destinatario=f"c{i}@test.com", asunto=f"Correo {i}", html="<p>Hola</p>")
+            for i in range(n)
+        ]
+
+    def test_confirmacion_va_en_la_transaccion_del_pedido(self):
+        correo = correos.encolar_confirmacion(self.pedido)
+        self.assertIn("cs_correo", correo.asunto)
+        self.assertIn(str(self.pedido.seguimiento_token), correo.html)
+        self.assertIn("Rascador", correo.html)
+        try:
+            with transaction.atomic():
+                correos.encolar_confirmacion(self.pedido)
+                raise RuntimeError("el pedido no se confirma")
+        except RuntimeError:
+            pass
+        self.assertEqual(CorreoSaliente.objects.count(), 1)
+
+    def test_envia_por_lotes_sin_repetir(self):
+        enviados = self.bandeja(7)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(correos.procesar(lote=3), (7, 0))
+        # Por lote: leer, reclamar, cargar y anotar; más la lectura que encuentra la bandeja vacía
+        self.assertLessEqual(len(consultas), 3 * 5 + 1)
+        self.assertEqual(sorted(self.falso.enviados), [c.pk for c in enviados])
+        self.assertFalse(CorreoSaliente.objects.exclude(estado=CorreoSaliente.Estado.ENVIADO).exists())
+        self.assertTrue(CorreoSaliente.objects.first().id_mensaje.startswith("falso-"))
+        self.assertEqual(correos.procesar(), (0, 0))
+
+    def test_un_lote_reclamado_no_lo_coge_otro_worker(self):
+        self.bandeja(2)
+        self.assertEqual(len(correos.reclamar()), 2)
+        self.assertEqual(correos.reclamar(), [])
+        # Si el worker muere, se recupera al vencer el bloqueo
+        CorreoSaliente.objects.update(bloqueado_hasta=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(len(correos.reclamar()), 2)
+
+    def test_fallos_se_reintentan_con_espera_y_acaban_en_fallidos(self):
+        correo, = self.bandeja(1)
+        self.falso.fallos = 1.0
+        esperas = []
+        for _ in range(correo.max_intentos):
+            CorreoSaliente.objects.filter(pk=correo.pk).update(disponible_en=timezone.now())
+            antes = timezone.now()
+            self.assertEqual(correos.procesar(), (0, 1))
+            correo.refresh_from_db()
+            esperas.append(correo.disponible_en - antes)
+        self.assertEqual((correo.estado, correo.intentos), (CorreoSaliente.Estado.FALLIDO, correo.max_intentos))
+        self.assertIn("Fallo simulado", correo.ultimo_error)
+        self.assertGreater(esperas[2], esperas[0])
+
+        self.falso.fallos = 0
+        correos.reintentar([correo.pk])
+        self.assertEqual(correos.procesar(), (1, 0))
+
+    def test_error_permanente_no_se_reintenta(self):
+        correo, = self.bandeja(1)
+        with patch.object(self.falso, "enviar", side_effect=correos.ErrorPermanente("dirección no válida")):
+            correos.procesar()
+        correo.refresh_from_db()
+        self.assertEqual((correo.estado, correo.intentos), (CorreoSaliente.Estado.FALLIDO, 1))
+
+    def test_respeta_la_concurrencia(self):
+        self.bandeja(8)
+        activos, maximo, cerrojo = [0], [0], threading.Lock()
+        enviar = self.falso.enviar
+
+        def contar(correo):
+            with cerrojo:
+                activos[0] += 1
+                maximo[0] = max(maximo[0], activos[0])
+            time.sleep(0.02)
+            with cerrojo:
+                activos[0] -= 1
+            return enviar(correo)
+
+        with patch.object(self.falso, "enviar", side_effect=contar):
+            self.assertEqual(correos.procesar(concurrencia=2), (8, 0))
+        self.assertEqual(maximo[0], 2)
+
+    @override_settings(CORREO_TRANSPORTE="brevo")
+    def test_brevo_reutiliza_un_cliente_por_proceso(self):
+        correos.usar_transporte(None)
+        with patch("home.correos.sib_api_v3_sdk.ApiClient") as cliente, \
+                patch("home.correos.sib_api_v3_sdk.TransactionalEmailsApi") as api:
+            api.return_value.send_transac_email.return_value.message_id = "<brevo-1>"
+            self.bandeja(3)
+            self.assertEqual(correos.procesar(), (3, 0))
+            self.assertIs(correos.transporte(), correos.transporte())
+        cliente.assert_called_once()
+        self.assertEqual(api.return_value.send_transac_email.call_count, 3)
+        self.assertEqual(set(CorreoSaliente.objects.values_list("id_mensaje", flat=True)), {"<brevo-1>"})
+
+    def test_comando_envia_la_bandeja(self):
+        self.bandeja(3)
+        salida = StringIO()
+        call_command("enviar_correos", "--una-vez", "--lote", "2", stdout=salida)
+        self.assertIn("3 correos enviados, 0 fallos", salida.getvalue())
+
+
+class TestsEventosConcurrentes(TransactionTestCase):
+    def test_entregas_simultaneas_encolan_un_solo_pedido(self):
+        sesion = {"id": "cs_simultaneo", "amount_total": 1000, "currency": "eur", "metadata": {"cart_code": "CRT-X"}}
+        entregas = [
+            {"id": f"evt_{i % 3}", "type": eventos.TIPOS_PAGO[i % 2], "data": {"object": sesion}}
+            for i in range(12)
+        ]
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            encoladas = [t for t in pool.map(lambda e: intentar(eventos.recibir, e), entregas) if t]
+        self.assertEqual(len(encoladas), 1)
+        self.assertEqual(Tarea.objects.filter(tipo="cumplir_pedido").count(), 1)
+        self.assertEqual(EventoStripe.objects.count(), 3)
+
+
+class TestsPruebaCarga(TransactionTestCase):
+    def test_compradores_simulados_sin_sobreventa(self):
+        salida = StringIO()
+        with patch("home.views.endpoint_secret", "whsec_prueba"):
+            call_command(
+                "prueba_carga", "--compradores", "6", "--concurrencia", "3", "--stock", "4", "--workers", "2",
+                stdout=salida,
+            )
+        informe = salida.getvalue()
+        self.assertIn("comprados: 4  sin stock: 2  errores: 0", informe)
+        self.assertIn("sobreventa: 0  pagados sin servir: 0", informe)
+        self.assertIn("p95", informe)
+        self.assertIn("final 0", informe)
+        self.assertFalse(Producto.objects.exists())
+        self.assertFalse(Pedido.objects.exists())
+
+
+class TestsWorkerTareas(TransactionTestCase):
+    def test_varios_hilos_reparten_la_cola(self):
+        ejecutadas = []
+        tareas.tarea("prueba")(lambda n: ejecutadas.append(n))
+        for n in range(20):
+            tareas.encolar("prueba", n=n)
+        salida = StringIO()
+        call_command("procesar_tareas", "--una-vez", "--hilos", "4", "--tipo", "prueba", stdout=salida)
+        self.assertIn("20 tareas", salida.getvalue())
+        self.assertEqual(sorted(ejecutadas), list(range(20)))
+        self.assertEqual(Tarea.objects.filter(estado=Tarea.Estado.HECHA).count(), 20)
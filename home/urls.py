@@ -11,6 +11,7 @@ urlpatterns = [
     
     # Carrito
     path("carrito/", views.CartView.as_view(), name="carrito"),
+    path("carrito/resumen.json", views.carrito_resumen, name="carrito_resumen"),
     path("carrito/add/<int:pk>/", views.add_to_cart, name="carrito_add"),
     path("carrito/update/<int:item_id>/", views.update_cart_item, name="carrito_update"),
     path("carrito/remove/<int:item_id>/", views.remove_from_cart, name="carrito_remove"),
@@ -36,6 +37,7 @@ urlpatterns = [
     path("guestBuy/", views.invitado_compra_view, name="guestBuy"),
     path("webhook/", views.my_webhook_view, name="webhook"),
     path("success/", views.success_view, name="success"),
+    path("success/estado/", views.pedido_estado, name="pedido_estado"),
     path("cancel/", views.cancel_view, name="cancel"),
     path("historial/", views.OrderHistoryListView.as_view(), name="historial"),
     path("historial/<int:pk>/", views.PedidoDetailView.as_view(), name="historial_detalle"),
@@ -0,0 +1,169 @@
+"""
+Versión del catálogo compartida entre procesos.
+
+Cada cambio en un producto incrementa un contador global guardado en la caché
+de Django. Los índices en memoria de cada proceso comparan ese contador con la
+versión con la que se sincronizaron: si todos los saltos se produjeron en el
+propio proceso aplican solo los productos afectados; si no, se reconstruyen.
+
+Además se guarda cuándo cambió por última vez el catálogo y cada producto, que
+es lo que usan las cabeceras ETag/Last-Modified (``home.condicional``).
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CLAVE_VERSION = "catalogo:version"
+# Milisegundos del último cambio: en cualquier parte del catálogo, en algo que
+# afecte a muchos productos (marcas, categorías...) y en cada producto.
+CLAVE_CAMBIO = "catalogo:cambio"
+CLAVE_CAMBIO_GENERAL = "catalogo:cambio:general"
+CLAVE_CAMBIO_PRODUCTO = "catalogo:cambio:{}"
+
+_oyentes = []
+_lock = threading.Lock()
+
+
+def version_catalogo():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        # Semilla basada en el reloj para que un borrado de la caché nunca
+        # devuelva una versión que algún proceso ya haya visto.
+        cache.add(CLAVE_VERSION, int(time.time() * 1000), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def _incrementar():
+    try:
+        return cache.incr(CLAVE_VERSION)
+    except ValueError:
+        version_catalogo()
+        return cache.incr(CLAVE_VERSION)
+
+
+def _ahora_ms():
+    return int(time.time() * 1000)
+
+
+def _registrar_cambio(producto_id):
+    clave = CLAVE_CAMBIO_GENERAL if producto_id is None else CLAVE_CAMBIO_PRODUCTO.format(producto_id)
+    ahora = _ahora_ms()
+    cache.set_many({CLAVE_CAMBIO: ahora, clave: ahora}, None)
+
+
+def ultimo_cambio(producto_id=None):
+    """
+    Milisegundos del último cambio del catálogo o, con ``producto_id``, del
+    producto o de algo general que le afecte. Si la caché lo perdió se toma
+    el momento actual: como mucho invalida de más, nunca de menos.
+    """
+    if producto_id is None:
+        claves = [CLAVE_CAMBIO]
+    else:
+        claves = [CLAVE_CAMBIO_GENERAL, CLAVE_CAMBIO_PRODUCTO.format(producto_id)]
+    valores = cache.get_many(claves)
+    for clave in claves:
+        if clave not in valores:
+            cache.add(clave, _ahora_ms(), None)
+            valores[clave] = cache.get(clave)
+    return max(valores.values())
+
+
+def registrar_oyente(funcion):
+    """``funcion(producto_id, version)`` se llama en este proceso tras cada cambio."""
+    with _lock:
+        _oyentes.append(funcion)
+    return funcion
+
+
+def _notificar(producto_id):
+    _registrar_cambio(producto_id)
+    version = _incrementar()
+    for funcion in list(_oyentes):
+        funcion(producto_id, version)
+    return version
+
+
+def marcar_catalogo():
+    """Cambio que afecta a muchos productos (marcas, categorías...): fuerza reconstruir."""
+    marcar_producto(None)
+
+
+def marcar_producto(producto_id):
+    """
+    Registra que un producto ha cambiado.
+
+    Se incrementa ya (para que el propio proceso vea el cambio dentro de la
+    transacción) y de nuevo al confirmar, para invalidar a cualquier otro
+    proceso que hubiera reconstruido antes de que el cambio fuera visible.
+    """
+    _notificar(producto_id)
+    transaction.on_commit(lambda: _notificar(producto_id))
+
+
+class IndiceVersionado:
+    """
+    Base de los índices en memoria que siguen la versión del catálogo.
+
+    Las subclases implementan ``_vaciar()``, ``_quitar(pk)`` y
+    ``_cargar(pks)``, que lee de la BD los productos indicados (todos si
+    ``pks`` es None) y los añade al índice.
+    """
+
+    MAX_PENDIENTES = 10000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._pendientes = {}
+        self._vaciar()
+        registrar_oyente(self.anotar_cambio)
+
+    def anotar_cambio(self, producto_id, version):
+        with self._lock:
+            if len(self._pendientes) >= self.MAX_PENDIENTES:
+                # Demasiados cambios sin consultar: sale más barato reconstruir.
+                self._pendientes.clear()
+                self._version = None
+                return
+            self._pendientes[version] = producto_id
+
+    def _construir(self, version):
+        self._vaciar()
+        self._pendientes = {v: pk for v, pk in self._pendientes.items() if v > version}
+        self._cargar(None)
+        self._version = version
+
+    def _cubre(self, version):
+        """True si todos los saltos hasta ``version`` se anotaron en este proceso."""
+        if self._version is None or version < self._version:
+            return False
+        propios = [pk for v, pk in self._pendientes.items() if self._version < v <= version]
+        return None not in propios and len(propios) == version - self._version
+
+    def _aplicar(self, version):
+        pks = {pk for v, pk in self._pendientes.items() if v <= version}
+        self._pendientes = {v: pk for v, pk in self._pendientes.items() if v > version}
+        for pk in pks:
+            self._quitar(pk)
+        self._cargar(pks)
+        self._version = version
+
+    def sincronizar(self):
+        actual = version_catalogo()
+        if actual == self._version:
+            return
+        with self._lock:
+            if actual == self._version:
+                return
+            if self._cubre(actual):
+                self._aplicar(actual)
+            else:
+                self._construir(actual)
+
+    def reconstruir(self):
+        with self._lock:
+            self._construir(version_catalogo())
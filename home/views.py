@@ -13,39 +13,38 @@ from django.db.models import Q
 from django.views.generic import TemplateView, ListView, DetailView, FormView
 from django.http import HttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Sum, F
-from django.db.models.functions import Coalesce
+import json
 import uuid
-from decimal import Decimal
 import secrets
-import sib_api_v3_sdk
-from sib_api_v3_sdk.rest import ApiException
-
-from django.template.loader import render_to_string
-from django.core.mail import send_mail, EmailMultiAlternatives
-from email.mime.image import MIMEImage
-import os
-from django.http import HttpResponse
-from django.templatetags.static import static
-import urllib.request
 
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from .forms import ClienteRegistrationForm
+from . import carritos, checkout, condicional, eventos, inventario
+from .search.motor import buscador, ResultadosOrdenados
+from .search.texto import terminos
+from .search.autocompletado import autocompletado
+from .facetas import facetas, Filtros, ids_de, maximo_tramo, TRAMOS_PRECIO
+from .paginacion import crear_cursor, leer_cursor
+from .fichas import cargar_fichas, tallas_por_producto
+from .metadatos import metadatos_catalogo
 from .models import (
-    Categoria, Marca, Producto, Carrito, ItemCarrito, 
-    Pedido, ItemPedido, TallaProducto, Cliente
+    Producto, Carrito, ItemCarrito,
+    Pedido, TallaProducto, Cliente, EventoStripe
 )
 
 from django.conf import settings
 import stripe
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
-from django.db.models import Q
 from django.http import JsonResponse
 from django.db.models import Count
 
-from home import models
-
 stripe.api_key = settings.STRIPE_SECRET_KEY
+if settings.STRIPE_API_BASE:
+    stripe.api_base = settings.STRIPE_API_BASE
 endpoint_secret = settings.WEBHOOK_SECRET
 site_domain = settings.SITE_DOMAIN
 
@@ -74,25 +73,7 @@ def get_cart_items_from_session(request):
     Convierte el carrito de sesión en una lista de items procesables.
     Retorna lista de diccionarios: {"producto": Producto, "talla_producto": TallaProducto, "cantidad": int}
     """
-    session_cart = request.session.get('cart', {})
-    items = []
-    
-    for key, cantidad in session_cart.items():
-        try:
-            producto_id, talla_producto_id = key.split('-')
-            producto = Producto.objects.get(pk=int(producto_id))
-            talla_producto = TallaProducto.objects.get(pk=int(talla_producto_id))
-            items.append({
-                "producto": producto,
-                "talla_producto": talla_producto,
-                "cantidad": cantidad,
-                "subtotal": producto.precio_final * cantidad,
-                "key": key
-            })
-        except (ValueError, Producto.DoesNotExist, TallaProducto.DoesNotExist):
-            continue
-    
-    return items
+    return carritos.lineas_sesion(request.session.get('cart', {}))
 
 
 def merge_session_cart_to_user(request, user):
@@ -103,30 +84,10 @@ def merge_session_cart_to_user(request, user):
     if not session_cart:
         return
     
-    carrito, _ = Carrito.objects.get_or_create(cliente=user)
-    
-    for key, cantidad in session_cart.items():
-        try:
-            producto_id, talla_producto_id = key.split('-')
-            producto = Producto.objects.get(pk=int(producto_id))
-            talla_producto = TallaProducto.objects.get(pk=int(talla_producto_id))
-            
-            
-            item, created = ItemCarrito.objects.get_or_create(
-                carrito=carrito,
-                producto=producto,
-                talla_producto=talla_producto,
-                defaults={"cantidad": cantidad}
-            )
-            if not created:
-                item.cantidad += cantidad
-                item.save()
-        except (ValueError, Producto.DoesNotExist, TallaProducto.DoesNotExist):
-            continue
-    
-    
+    carritos.fusionar_sesion(session_cart, user)
     request.session['cart'] = {}
     request.session.modified = True
+    carritos.actualizar(user.pk)
 
 
 # ============================================
@@ -228,91 +189,124 @@ class CustomLoginView(auth_views.LoginView):
 # CATÁLOGO
 # ============================================
 
+@method_decorator(
+    condition(etag_func=condicional.etag_catalogo, last_modified_func=condicional.modificado_catalogo),
+    name="dispatch",
+)
 class ProductListView(ListView):
+    pagina_compartida = True
     model = Producto
     template_name = "home/lista_productos.html"
     context_object_name = "productos"
     paginate_by = 12
+    # A partir de aquí se pagina por cursor en lugar de por número de página
+    max_paginas_numeradas = 10
 
     def get_queryset(self):
         qs = super().get_queryset().filter(esta_disponible=True)
 
         q = self.request.GET.get("q", "")
+        if not terminos(q):
+            # Solo palabras vacías o letras sueltas ("de", "a"): como si no se buscara nada
+            q = ""
         categoria = self.request.GET.getlist("categoria", [])
         marca = self.request.GET.getlist("marca", [])
-        precio_min = self.request.GET.get("min", "")
-        precio_max = self.request.GET.get("max", "")
-        color_ids = self.request.GET.getlist("color", []) 
-        material = self.request.GET.getlist("material", [])
-
-        qs = qs.annotate(
-                stock_tallas=Sum("tallas__stock"),
-            ).annotate(
-                stock_total=Coalesce("stock_tallas", F("stock"))
-            )
+
+        # Filtros, búsqueda y orden se resuelven en memoria (facetas y motor de
+        # búsqueda); la BD solo se consulta para hidratar la página.
+        ids_busqueda = buscador.buscar(q) if q else None
+        self.facetas = facetas.filtrar(Filtros.desde_get(self.request.GET), ids_busqueda)
+
         if q:
-            qs = qs.filter(Q(nombre__icontains=q) | Q(descripcion__icontains=q))
-        if categoria:
-            qs = qs.filter(categoria__id__in=categoria)
-        if marca:
-            qs = qs.filter(marca__id__in=marca)
-        if material:
-            qs = qs.filter(material__in=material)
-        if color_ids:
-            qs = qs.filter(colores__id__in=color_ids)
-
-        if precio_min:
-            qs = qs.filter(precio__gte=precio_min)
-        if precio_max:
-            qs = qs.filter(precio__lte=precio_max)
-
-        if categoria and not marca:
-            qs = qs.order_by('orden_categoria', 'id')
+            incluidos = set(ids_de(self.facetas.bits))
+            self.orden = None
+            ids = [pk for pk in ids_busqueda if pk in incluidos]
+            return ResultadosOrdenados(ids, qs)
+        elif categoria and not marca:
+            self.orden = ('orden_categoria',)
         elif marca and not categoria:
-            qs = qs.order_by('orden_catalogo', 'id')
+            self.orden = ('orden_catalogo',)
         else:
-            qs = qs.order_by('orden_categoria', 'orden_catalogo', 'id')
-        
-        return qs
+            self.orden = ('orden_categoria', 'orden_catalogo')
+
+        bits, orden = self.facetas.bits, self.orden
+        return ResultadosOrdenados(lambda: facetas.ordenar(bits, orden), qs)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Con pocos resultados se mantiene la paginación numerada. Con muchos (o
+        si llega un cursor) se pagina por clave de ordenación: el coste de una
+        página no depende de su profundidad y el total sale de las facetas.
+        """
+        self.cursores = None
+        token = self.request.GET.get("cursor")
+        if self.orden is None or (
+            not token and self.facetas.total <= page_size * self.max_paginas_numeradas
+        ):
+            return super().paginate_queryset(queryset, page_size)
+
+        clave, hacia_atras = leer_cursor(token)
+        ids, claves, hay_anterior, hay_siguiente = facetas.pagina(
+            self.facetas.bits, self.orden, clave, hacia_atras, page_size
+        )
+        self.cursores = {
+            "anterior": crear_cursor(claves[0], hacia_atras=True) if ids and hay_anterior else None,
+            "siguiente": crear_cursor(claves[-1]) if ids and hay_siguiente else None,
+        }
+        return (None, None, queryset.hidratar(ids), False)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
-        ctx["categorias"] = Categoria.objects.all()
-        ctx["marcas"] = Marca.objects.all()
-        ctx["colores"] = models.Color.objects.all()
-        ctx["material"] = Producto.objects.exclude(material="").values_list("material", flat=True).distinct()
+        # Barra lateral y destacados salen de la caché compartida (ver home/metadatos.py)
+        metadatos = metadatos_catalogo()
+        ctx["categorias"] = metadatos["categorias"]
+        ctx["marcas"] = metadatos["marcas"]
+        ctx["colores"] = metadatos["colores"]
+        ctx["material"] = metadatos["materiales"]
         ctx["search"] = self.request.GET.get("q", "")
         ctx["selected_categorias"] = self.request.GET.getlist("categoria")
         ctx["selected_marcas"] = self.request.GET.getlist("marca")
         ctx["selected_colores"] = [int(c) for c in self.request.GET.getlist("color") if c.isdigit()]
         ctx["selected_materiales"] = self.request.GET.getlist("material")
-        ctx["productos_destacados"] = Producto.objects.filter(
-            es_destacado=True,
-            esta_disponible=True
-        )[:12]
+        ctx["productos_destacados"] = metadatos["destacados"]
+        productos = cargar_fichas(ctx["productos"], marca_categoria=False)
+        ctx["tallas_data"] = tallas_por_producto(productos + ctx["productos_destacados"])
         ctx["min_value"] = self.request.GET.get("min", "")
         ctx["max_value"] = self.request.GET.get("max", "")
+        ctx["facetas"] = self.facetas.conteos
+        ctx["tramos_precio"] = [
+            {
+                "desde": desde,
+                "hasta": hasta,
+                "maximo": maximo_tramo(hasta),
+                "total": self.facetas.conteos["precio"].get(i, 0),
+            }
+            for i, (desde, hasta) in enumerate(TRAMOS_PRECIO)
+        ]
+        ctx["solo_stock"] = self.request.GET.get("stock") == "1"
+        ctx["total_productos"] = self.facetas.total
+        ctx["cursores"] = self.cursores
         return ctx
     
 
+@condition(
+    etag_func=condicional.etag_autocompletado,
+    last_modified_func=condicional.modificado_autocompletado,
+)
 def autocomplete_productos(request):
     q = request.GET.get("q", "")
-    productos = Producto.objects.filter(
-        Q(nombre__icontains=q) | Q(descripcion__icontains=q),
-        esta_disponible=True
-    )[:6]
+    return JsonResponse(autocompletado.autocompletar(q), safe=False)
 
-    data = [{
-        "nombre": p.nombre,
-        "slug": p.slug,
-        "precio": float(p.precio),
-        "imagen": p.imagenes.first().imagen if p.imagenes.exists() else None
-    } for p in productos]
 
-    return JsonResponse(data, safe=False)
+autocomplete_productos.pagina_compartida = True
 
 
+@method_decorator(
+    condition(etag_func=condicional.etag_producto, last_modified_func=condicional.modificado_producto),
+    name="dispatch",
+)
 class ProductDetailView(DetailView):
+    pagina_compartida = True
     model = Producto
     template_name = "producto_detalle.html"
     context_object_name = "producto"
@@ -322,6 +316,26 @@ class ProductDetailView(DetailView):
 # CARRITO
 # ============================================
 
+def carrito_resumen(request):
+    """
+    Unidades y subtotal del carrito (y el token CSRF) para la cabecera. Es lo
+    único propio del usuario en las páginas compartidas del catálogo.
+    """
+    if request.user.is_authenticated:
+        cantidad, subtotal = carritos.resumen(request.user.pk)
+    else:
+        resumen = carritos.ResumenCarrito.de_sesion(request.session)
+        cantidad, subtotal = resumen.unidades, resumen.subtotal
+
+    response = JsonResponse({
+        "count": cantidad,
+        "subtotal": str(subtotal),
+        "csrf": get_token(request),
+    })
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
 def add_to_cart(request, pk):
     """Añade un producto al carrito."""
     if request.method != "POST":
@@ -345,7 +359,7 @@ def add_to_cart(request, pk):
         return redirect(request.META.get('HTTP_REFERER', 'home:catalogo'))
 
     try:
-        talla_producto = TallaProducto.objects.get(pk=int(talla_producto_id), producto=producto)
+        talla_producto = inventario.con_disponible().get(pk=int(talla_producto_id), producto=producto)
     except (ValueError, TallaProducto.DoesNotExist):
         messages.error(request, "La talla seleccionada no es válida.")
         return redirect(request.META.get('HTTP_REFERER', 'home:catalogo'))
@@ -353,10 +367,10 @@ def add_to_cart(request, pk):
     
     def build_stock_message(talla_producto, producto):
         if talla_producto.talla == "Única" or producto.tallas.count() <= 1:
-            return f"Solo quedan {talla_producto.stock} unidades disponibles."
-        return f"Solo quedan {talla_producto.stock} unidades disponibles de la talla {talla_producto.talla}."
+            return f"Solo quedan {talla_producto.disponible} unidades disponibles."
+        return f"Solo quedan {talla_producto.disponible} unidades disponibles de la talla {talla_producto.talla}."
     
-    if cantidad > talla_producto.stock:
+    if cantidad > talla_producto.disponible:
         messages.error(request, build_stock_message(talla_producto, producto))
         return redirect(request.META.get('HTTP_REFERER', 'home:catalogo'))
     
@@ -371,11 +385,12 @@ def add_to_cart(request, pk):
         )
         if not created:
             nueva_cantidad = item.cantidad + cantidad
-            if nueva_cantidad > talla_producto.stock:
+            if nueva_cantidad > talla_producto.disponible:
                 messages.error(request, build_stock_message(talla_producto, producto))
                 return redirect(request.META.get('HTTP_REFERER', 'home:catalogo'))
             item.cantidad = nueva_cantidad
             item.save()
+        carritos.actualizar(request.user.pk)
         messages.success(request, f"{producto.nombre} añadido al carrito.")
     else:
         if 'cart' not in request.session:
@@ -385,7 +400,7 @@ def add_to_cart(request, pk):
         current_qty = request.session['cart'].get(key, 0)
         nueva_cantidad = current_qty + cantidad
         
-        if nueva_cantidad > talla_producto.stock:
+        if nueva_cantidad > talla_producto.disponible:
             messages.error(request, build_stock_message(talla_producto, producto))
             return redirect(request.META.get('HTTP_REFERER', 'home:catalogo'))
         
@@ -406,16 +421,19 @@ def update_cart_item(request, item_id):
         item = get_object_or_404(ItemCarrito, pk=item_id, carrito__cliente=request.user)
         
         if action == "increase":
-            if item.cantidad + 1 > item.talla_producto.stock:
-                messages.error(request, f"Solo quedan {item.talla_producto.stock} unidades disponibles.")
+            disponible = inventario.disponible(item.talla_producto_id)
+            if item.cantidad + 1 > disponible:
+                messages.error(request, f"Solo quedan {disponible} unidades disponibles.")
             else:
                 item.cantidad += 1
                 item.save()
+                carritos.actualizar(request.user.pk)
                 messages.success(request, "Cantidad actualizada.")
         elif action == "decrease":
             if item.cantidad > 1:
                 item.cantidad -= 1
                 item.save()
+                carritos.actualizar(request.user.pk)
                 messages.success(request, "Cantidad actualizada.")
             else:
                 messages.warning(request, "La cantidad mínima es 1. Usa 'Eliminar' para quitar el producto.")
@@ -437,6 +455,7 @@ def remove_from_cart(request, item_id):
     """Elimina un item del carrito."""
     if request.user.is_authenticated:
         ItemCarrito.objects.filter(id=item_id, carrito__cliente=request.user).delete()
+        carritos.actualizar(request.user.pk)
         messages.success(request, "Producto eliminado del carrito.")
     else:
         key = str(item_id)
@@ -461,8 +480,8 @@ def carrito_update_session_item(request):
         if action == 'increase':
             try:
                 producto_id, talla_producto_id = key.split('-')
-                talla = TallaProducto.objects.get(pk=int(talla_producto_id))
-                if cart[key] < talla.stock:
+                talla = inventario.con_disponible().get(pk=int(talla_producto_id))
+                if cart[key] < talla.disponible:
                     cart[key] += 1
                     messages.success(request, 'Cantidad actualizada')
                 else:
@@ -484,52 +503,6 @@ def carrito_update_session_item(request):
 class CheckoutConfirmacionView(LoginRequiredMixin, TemplateView):
     template_name = "home/checkout_confirmacion.html"
     
-def get_brevo_api_instance():
-    configuration = sib_api_v3_sdk.Configuration()
-    api_key = os.environ.get('BREVO_API_KEY')
-    configuration.api_key['api-key'] = api_key
-    return sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
-
-def enviar_correo(pedido):
-    dom = site_domain
-    asunto = f"Confirmación de tu pedido #{pedido.stripe_checkout_id}"
-    FROM_EMAIL = "entertainpet2025@gmail.com" 
-    to_email = pedido.cliente_email
-    
-    seguimiento_url = dom + reverse("home:seguimiento_token", args=[pedido.seguimiento_token]) 
-    items_con_subtotal = [
-        {
-            "producto": item.producto,
-            "cantidad": item.cantidad,
-            "subtotal": item.producto.precio_final * item.cantidad,
-            "imagen_url": getattr(item.producto.imagenes.filter(es_principal=True).first(), "imagen", None),
-        }
-        for item in pedido.pedido_items.select_related("producto")
-    ]
-
-    cliente = Cliente.objects.filter(email=pedido.cliente_email).first()
-
-    context = {
-        "pedido": pedido,
-        "items_con_subtotal": items_con_subtotal,
-        "cliente": cliente,
-        "seguimiento_url": seguimiento_url,
-    }
-    html_content = render_to_string("email/confirmacion.html", context)
-    
-    api_instance = get_brevo_api_instance()
-    if api_instance is None:
-        raise Exception("Fallo en la inicialización de la API de Brevo") 
-
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=[{"email": to_email}],
-        sender={"name": "Entertain Pet", "email": FROM_EMAIL},
-        subject=asunto,
-        html_content=html_content
-    )
-    
-    api_instance.send_transac_email(send_smtp_email)
-
 @require_POST
 def carrito_remove_session_item(request):
     """Eliminar item del carrito de sesión (usuarios no autenticados)"""
@@ -556,41 +529,22 @@ class CartView(TemplateView):
         if request.user.is_authenticated:
             if not getattr(request.user, 'is_anonymous_user', False):
                 client_email = request.user.email
-                
-            carrito, _ = Carrito.objects.get_or_create(cliente=request.user)
-
-            subtotal = float(carrito.total)
-            iva = carrito.subtotalIVA
-            envio = 4.50 if subtotal > 0 else 0.0
-            total = subtotal + iva + envio
-
-            ctx["carrito"] = carrito
-            ctx["cart_items"] = carrito.carrito_items.all()
-            ctx["subtotal"] = subtotal
-            ctx["subtotalIVA"] = iva
-            ctx["total"] = total
-            ctx["codigo_carrito"] = carrito.codigo_carrito
-            ctx["cantidad_items"] = carrito.cantidad_total_items
-
-        else:
-            # Carrito de sesión
-            items = get_cart_items_from_session(request)
-            ctx["cart_items"] = items
-
-            subtotal = float(sum(item["subtotal"] for item in items))
-            iva = subtotal * 0.21
-            envio = 4.50 if subtotal > 0 else 0.0
-            total = subtotal + iva + envio
 
-            ctx["subtotal"] = subtotal
-            ctx["subtotalIVA"] = Decimal(iva)
-            ctx["total"] = total
-            ctx["cantidad_items"] = sum(item["cantidad"] for item in items)
+        # Carrito del cliente o de sesión; la imagen principal viene con el producto
+        resumen = carritos.ResumenCarrito.de_peticion(request, crear=True)
+        if resumen.carrito:
+            ctx["carrito"] = resumen.carrito
+            ctx["codigo_carrito"] = resumen.codigo_carrito
+        ctx["cart_items"] = resumen.items
+        ctx["subtotal"] = resumen.subtotal
+        ctx["subtotalIVA"] = resumen.iva
+        ctx["envio"] = resumen.envio
+        ctx["total"] = resumen.total
+        ctx["cantidad_items"] = resumen.unidades
 
         ctx["client_email"] = client_email
         return ctx
 
-from rest_framework.test import APIRequestFactory
 def invitado_compra_view(request):
     """Crea un usuario invitado temporal y lo autentica, y procesa la compra correctamente."""
 
@@ -614,27 +568,13 @@ def invitado_compra_view(request):
     if not carrito:
         return JsonResponse({"error": "El usuario no tiene carrito"}, status=400)
 
-    cart_code = carrito.codigo_carrito
-
-    factory = APIRequestFactory()
-    stripe_request = factory.post(
-        '/create_checkout_session/', 
-        {"cart_code": cart_code}, 
-        format='json'
-    )
-
-    stripe_request.META['HTTP_HOST'] = request.META['HTTP_HOST']
-    stripe_request.META['wsgi.url_scheme'] = request.scheme
-
-    response = create_checkout_session(stripe_request)
-
-    if response.status_code == 200:
-
-        checkout_session = response.data['data']
-
-        return redirect(checkout_session.url)
-    else:
-        return JsonResponse(response.data, status=response.status_code)
+    try:
+        sesion = checkout.iniciar_pago(
+            carrito.codigo_carrito, None, *urls_pago(request)
+        )
+    except checkout.ErrorCheckout as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+    return redirect(sesion.url)
 
 
 
@@ -645,14 +585,9 @@ def invitado_compra_view(request):
 def guest_checkout_view(request):
     """Vista para que invitados ingresen email antes de pagar."""
 
-    if request.user.is_authenticated:
-        carrito = Carrito.objects.filter(cliente=request.user).first()
-        cart_items = carrito.carrito_items.all() if carrito else []
-        total = carrito.total if carrito else 0
-    else:
-        items = get_cart_items_from_session(request)
-        cart_items = items
-        total = sum(item["subtotal"] for item in items)
+    resumen = carritos.ResumenCarrito.de_peticion(request)
+    cart_items = resumen.items
+    total = resumen.total
     
     if not cart_items:
         messages.warning(request, "Tu carrito está vacío.")
@@ -779,66 +714,25 @@ class PedidoDetailView(LoginRequiredMixin, DetailView):
         ctx["total_sum"] = sum(i.get("subtotal", 0) for i in items_list)
         return ctx
 
-from decimal import Decimal
 
-@api_view(['POST'])
-def create_checkout_session(request):
-    """Crea sesión de checkout de Stripe."""
-    cart_code = request.data.get("cart_code")
-    email = request.data.get("email")
-    carrito = Carrito.objects.get(codigo_carrito=cart_code)
-
-    iva_rate = Decimal('0.21')  
-    decimal_100 = Decimal('100')
-
-    subtotal = sum(
-        (item.producto.precio_final * item.cantidad)
-        for item in carrito.carrito_items.all()
+def urls_pago(request):
+    """URLs de vuelta de la pasarela: éxito (con el id de la sesión) y cancelación."""
+    return (
+        request.build_absolute_uri("/success/") + "?session_id={CHECKOUT_SESSION_ID}",
+        request.build_absolute_uri("/cancel/"),
     )
 
-    iva_amount = int((subtotal * iva_rate * decimal_100).quantize(Decimal('1')))
 
-        
+@api_view(['POST'])
+def create_checkout_session(request):
+    """Crea sesión de checkout de Stripe."""
     try:
-        checkout_session = stripe.checkout.Session.create(
-            customer_email=email,
-            payment_method_types=['card'],
-            line_items=[
-                {
-                    'price_data': {
-                        'currency': 'eur',
-                        'product_data': {'name': item.producto.nombre},
-                        'unit_amount': int(item.producto.precio_final * 100),
-                    },
-                    'quantity': item.cantidad,
-                }
-                for item in carrito.carrito_items.all()
-            ]  + [
-        {
-            'price_data': {
-                'currency': 'eur',
-                'product_data': {'name': 'Gastos de envío'},
-                'unit_amount': 450, 
-            },
-            'quantity': 1,
-        },
-        {
-            'price_data': {
-                'currency': 'eur',
-                'product_data': {'name': 'IVA (21%)'},
-                'unit_amount': iva_amount,
-            },
-            'quantity': 1,
-        }
-    ],
-            mode='payment',
-            success_url=request.build_absolute_uri("/success/") + "?session_id={CHECKOUT_SESSION_ID}",
-            cancel_url=request.build_absolute_uri("/cancel/"),
-            metadata={"cart_code": cart_code}
+        sesion = checkout.iniciar_pago(
+            request.data.get("cart_code"), request.data.get("email"), *urls_pago(request)
         )
-        return Response({'data': checkout_session})
-    except Exception as e:
-        return Response({'error': str(e)}, status=400)
+    except checkout.ErrorCheckout as e:
+        return Response({'error': str(e)}, status=e.status)
+    return Response({'data': {'id': sesion.id, 'url': sesion.url}})
 
 
 @csrf_exempt
@@ -856,85 +750,44 @@ def my_webhook_view(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
 
-    if event['type'] in ['checkout.session.completed', 'checkout.session.async_payment_succeeded']:
-        session = event['data']['object']
-        try:
-            cart_code = session.get("metadata", {}).get("cart_code")
-            fulfill_checkout(session, cart_code)
-            print("🎉 Pedido creado con éxito")
-        except Exception as e:
-            print(f"❌ Error en fulfill_checkout: {e}") 
+    # Solo se guarda el evento: el pedido y el correo los hace procesar_tareas.
+    # Las entregas repetidas no encolan nada y se contestan igual con un 200.
+    if eventos.recibir(json.loads(payload)):
+        print("📥 Pedido en cola")
 
     return HttpResponse(status=200)
 
 
-    
-    
-def fulfill_checkout(session, cart_code):
-    """Crea el pedido tras pago exitoso."""
-    codigo_seguimiento = secrets.token_urlsafe(8).upper()
-    customer_details = session.get("customer_details")
-    email = None
-    
-    if customer_details and customer_details.get("email"):
-        email = customer_details.get("email")
-    elif session.get("customer_email"):
-        email = session.get("customer_email")
-    if not email:
-        print("⚠️ ALERTA: No se encontró email en la sesión de Stripe.")
-        email = "no-email@found.com"
-    try:
-        order = Pedido.objects.create(
-            stripe_checkout_id=session["id"],
-            cantidad=session["amount_total"] / 100,
-            divisa=session["currency"],
-            cliente_email=email,
-            status="Pagado",
-            codigo_seguimiento=codigo_seguimiento,
-            estado_envio= Pedido.EstadoEnvio.EN_PREPARACION
-        )
-        print("pedido creado")
-    except Exception as e:
-        print("Error creando pedido:", e)
-
-    try:
-        carrito = Carrito.objects.get(codigo_carrito=cart_code)
-        for item in carrito.carrito_items.all():
-            ItemPedido.objects.create(
-                pedido=order,
-                producto=item.producto,
-                cantidad=item.cantidad,
-                talla=item.talla_producto.talla
-            )
-            
-            item.talla_producto.stock -= item.cantidad
-            item.talla_producto.save()
-    except Exception as e:
-        print("Error creando ItemPedidos", e)
-    
-    try:
-        enviar_correo(order)
-    except Exception as e:
-        print("Error enviando correo:", e)
-        
-    carrito.delete()
-
-import time
-
 def success_view(request):
+    """
+    Página de vuelta de Stripe. No espera al webhook: si el pedido aún no
+    existe la página pregunta por él a ``pedido_estado`` y se recarga al estar.
+    """
     session_id = request.GET.get('session_id')
     pedido = None
 
     if session_id:
         pedido = Pedido.objects.filter(stripe_checkout_id=session_id).first()
-        
-        intentos = 0
-        while not pedido and intentos < 3:
-            time.sleep(0.5) 
-            pedido = Pedido.objects.filter(stripe_checkout_id=session_id).first()
-            intentos += 1
 
-    return render(request, "home/success.html", {"pedido": pedido})
+    return render(request, "home/success.html", {"pedido": pedido, "session_id": session_id})
+
+
+def pedido_estado(request):
+    """
+    Estado del pedido de una sesión de pago para la página de éxito:
+    ``listo`` (el pedido existe), ``procesando`` (el webhook llegó y está en
+    la cola) o ``pendiente`` (Stripe aún no lo ha enviado).
+    """
+    session_id = request.GET.get("session_id", "")
+    if session_id and Pedido.objects.filter(stripe_checkout_id=session_id).exists():
+        estado = "listo"
+    elif session_id and EventoStripe.objects.filter(sesion_pagada=session_id).exists():
+        estado = "procesando"
+    else:
+        estado = "pendiente"
+    response = JsonResponse({"estado": estado})
+    patch_cache_control(response, private=True, no_store=True)
+    return response
 
 
 